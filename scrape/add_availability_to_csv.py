@@ -1,17 +1,41 @@
 import pandas as pd
 import requests
-from bs4 import BeautifulSoup
 import time
 import os
+import argparse
+import heapq
+import itertools
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import metrics
+from metrics import add_metrics_arguments, dump_metrics_from_args
+import profiling
+from profiling import add_profile_arguments, start_profile_from_args
+from http_client import PoliteClient, parse_retry_after, backoff_delay, is_retryable_response, add_adaptive_arguments, adaptive_options_from_args
+from http_cache import add_cache_arguments, wrap_client_from_args, CacheMissError
+from html_parsing import make_soup, add_parser_argument, set_parser_backend
+from checkpoint import CheckpointJournal
+from csv_io import write_csv_atomic, read_csv
+from card_store import RETRY_AVAILABILITY_VALUES
+from card_db import add_database_argument, open_database_from_args
 # from urllib.parse import urljoin # 今回は明示的には使っていませんが、requests内で使われる可能性はあります
 
 # --- 設定項目 ---
 # CSVファイルが保存されているディレクトリ
 CSV_DIRECTORY = '.'
-# 詳細ページアクセス間の待機時間 (秒)
-DETAIL_PAGE_WAIT_TIME = 1.2 # サーバー負荷を考慮
+# 詳細ページアクセス間の待機時間 (秒)。--workers 1 の場合のリクエスト間隔
+DETAIL_PAGE_WAIT_TIME = 1.2 # サーバー負荷を考慮 (自動調整ではその初期値)
 # リクエストのタイムアウト時間 (秒)
 REQUEST_TIMEOUT = 20
+# 詳細ページを同時に取得するスレッド数 (--workers で上書き可能)
+DETAIL_FETCH_WORKERS = 4
+# 全スレッド合計のリクエスト数/秒の上限 (--rate で上書き可能)
+DETAIL_REQUESTS_PER_SECOND = 4.0
+# 一時的なエラー (タイムアウト, 429, 5xx) の再試行回数の上限
+MAX_FETCH_RETRIES = 4
 # 処理対象のCSVファイルリスト
 RARITY_CSV_FILES = [
     "cgss_ssr_card_list.csv",
@@ -19,138 +43,383 @@ RARITY_CSV_FILES = [
     "cgss_r_card_list.csv",
     "cgss_n_card_list.csv",
 ]
+# 詳細ページの項目名 (li.h の文字列と完全一致) → CSVの列名
+# ここにない項目は DETAIL_COLUMN_PREFIX + 項目名 の列に保存する
+DETAIL_FIELD_COLUMNS = {
+    "主な入手方法": "availability",
+    "属性": "attribute",
+}
+DETAIL_COLUMN_PREFIX = "detail_"
+# 詳細ページの属性表記 → CSVの attribute 列の値 (update_csv_with_attributes.py と同じ表記)
+ATTRIBUTE_LABELS = {
+    "キュート": "Cu",
+    "クール": "Co",
+    "パッション": "Pa",
+}
 # --- ここまで設定項目 ---
 
-def get_soup(url, session=None):
-    """指定されたURLからHTMLを取得し、BeautifulSoupオブジェクトを返す"""
+def extract_detail_fields(detail_soup):
+    """詳細ページの ul.tblbox 内にある全ての 項目名 (li.h) → 値 (li.d) を1回の走査で辞書にする"""
+    fields = {}
+    for tblbox in detail_soup.select('ul.tblbox.flexbox.flexwrap'):
+        for li_h_tag in tblbox.find_all('li', class_='h'):
+            label = li_h_tag.get_text(strip=True)
+            # li.h の次の li 要素が li.d であることを期待
+            li_d_tag = li_h_tag.find_next_sibling('li')
+            if label and label not in fields and li_d_tag and 'd' in li_d_tag.get('class', []):
+                # get_text() で取得。もし <br> があれば separator='\n' を検討
+                fields[label] = li_d_tag.get_text(strip=True)
+    return fields
+
+def detail_fields_to_columns(fields):
+    """extract_detail_fields の結果を CSV の列名 → 値 の辞書に変換する"""
+    columns = {}
+    for label, value in fields.items():
+        column = DETAIL_FIELD_COLUMNS.get(label)
+        if column is None:
+            column = DETAIL_COLUMN_PREFIX + label
+        elif column == 'attribute':
+            value = ATTRIBUTE_LABELS.get(value, value)
+        columns.setdefault(column, value)
+    return columns
+
+def parse_detail_page(detail_soup):
+    """詳細ページのSoupから CSV に書き込む列の辞書を作る。availability は必ず含む"""
+    if not detail_soup:
+        return {'availability': "取得失敗"}
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        if session:
-            response = session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
-        else:
-            response = requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
-        response.raise_for_status() # HTTPエラーがあれば例外を発生
-        soup = BeautifulSoup(response.content, 'html.parser')
-        return soup
-    except requests.exceptions.RequestException as e:
-        print(f"  Error fetching {url}: {e}")
-        return None
+        columns = detail_fields_to_columns(extract_detail_fields(detail_soup))
     except Exception as e:
-        print(f"  Unexpected error fetching {url}: {e}")
-        return None
+        print(f"    詳細ページの解析中にエラー: {e}")
+        return {'availability': "解析エラー"}
+    # 見つからなかった場合 (情報なし、または想定外の構造)
+    columns.setdefault('availability', "情報なし")
+    return columns
 
 def extract_availability(detail_soup):
     """詳細ページのSoupオブジェクトから「主な入手方法」を抽出する"""
-    if not detail_soup:
-        return "取得失敗" # もしくは pd.NA
+    return parse_detail_page(detail_soup)['availability']
+
+def set_row_columns(df, index, columns):
+    """columns (列名 → 値) を df の index 行に書き込む。まだない列は追加する"""
+    for column, value in columns.items():
+        if column not in df.columns:
+            df[column] = pd.Series(pd.NA, index=df.index, dtype=object)
+        elif df[column].dtype != object:
+            df[column] = df[column].astype(object)
+        df.loc[index, column] = value
 
+def fetch_detail_page(client, url):
+    """詳細ページを1回だけ取得する
+
+    (ボディ, 再試行すべきか, Retry-After の秒数, エラーメッセージ) を返す。成功時のボディ以外は None。
+    例外は送出しない (キャッシュの書き込みエラーなど想定外のエラーは、再試行しない失敗として返す)。
+    """
+    # User-Agent は client (PoliteClient) のセッションが http_client.USER_AGENT を送る
     try:
-        # ul.tblbox.flexbox.flexwrap の中から探す
-        tblboxes = detail_soup.select('ul.tblbox.flexbox.flexwrap')
-        
-        for tblbox in tblboxes:
-            # 現在のtblbox内で "主な入手方法" のli.hを探す
-            li_h_tag = tblbox.find('li', class_='h', string=lambda text: text and "主な入手方法" in text.strip())
-            
-            if li_h_tag:
-                # li.h の次の li 要素が li.d であることを期待
-                li_d_tag = li_h_tag.find_next_sibling('li')
-                if li_d_tag and 'd' in li_d_tag.get('class', []): # クラス'd'が含まれるか確認
-                    # get_text() で取得。もし <br> があれば separator='\n' を検討
-                    availability_text = li_d_tag.get_text(strip=True)
-                    return availability_text
-        
-        # 上記で見つからなかった場合 (情報なし、または想定外の構造)
-        return "情報なし" # もしくは pd.NA
-            
+        with profiling.stage('fetch_detail_page'):
+            response = client.get(url, timeout=REQUEST_TIMEOUT)
+            if response.status_code == 200:
+                return response.content, False, None, None
+    except CacheMissError as e:
+        return None, False, None, str(e)
+    except requests.exceptions.RequestException as e:
+        return None, True, None, str(e)
     except Exception as e:
-        print(f"    「主な入手方法」の解析中にエラー: {e}")
-        return "解析エラー" # もしくは pd.NA
+        return None, False, None, f"予期しないエラー: {type(e).__name__}: {e}"
 
-def main():
-    # HTTPセッションを使い回す
-    with requests.Session() as session:
-        for csv_filename in RARITY_CSV_FILES:
-            csv_filepath = os.path.join(CSV_DIRECTORY, csv_filename)
-            
-            if not os.path.exists(csv_filepath):
-                print(f"CSVファイルが見つかりません: {csv_filepath}。スキップします。")
-                continue
+    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+    return None, is_retryable_response(response), retry_after, f"HTTP {response.status_code}"
 
-            print(f"\n--- {csv_filename} の「主な入手方法」情報を処理中 ---")
+def enrich_availability(jobs, client, on_result, workers=DETAIL_FETCH_WORKERS, max_retries=MAX_FETCH_RETRIES):
+    """詳細ページの取得 → 解析 をパイプラインで処理する
+
+    jobs は (index, card_id, detail_url) のリスト。
+    - 取得ステージ: workers 本のスレッドが client (レート制限付き) で詳細ページを取得する
+    - 解析ステージ: 専用スレッドが取得済みのページを解析し、on_result(index, card_id, columns) を呼ぶ
+      (columns は parse_detail_page の結果。取得に最終的に失敗したカードは columns=None で呼ぶ)
+    一時的なエラーは再試行キューに入り、指数バックオフ + ジッター (Retry-After があればそれ以上) の後に再取得する。
+    on_result は解析ステージのスレッドからのみ呼ばれる。
+    """
+    parse_queue = queue.Queue(maxsize=workers * 2)
+
+    def parse_stage():
+        while True:
+            item = parse_queue.get()
+            if item is None:
+                break
+            index, card_id, content = item
             try:
-                df = pd.read_csv(csv_filepath)
+                columns = None
+                if content is not None:
+                    with profiling.stage('extract_availability'):
+                        soup = make_soup(content, page_kind='detail')
+                        with metrics.timer('extract_ms', page_kind='detail'):
+                            columns = parse_detail_page(soup)
+                on_result(index, card_id, columns)
             except Exception as e:
-                print(f"  エラー: CSVファイルの読み込みに失敗 ({csv_filepath}): {e}")
-                continue
-            
-            if 'detail_url' not in df.columns:
-                print(f"  エラー: CSVファイルに 'detail_url' 列が見つかりません: {csv_filename}。スキップします。")
+                print(f"    ID {card_id}: 結果の反映中にエラー: {e}")
+
+    parser_thread = threading.Thread(target=parse_stage, name="availability-parser", daemon=True)
+    parser_thread.start()
+    try:
+        fetch_stage(jobs, client, parse_queue, workers, max_retries)
+    finally:
+        # 取得ステージが例外で止まった場合も、解析ステージを止めてから戻る
+        parse_queue.put(None)
+        parser_thread.join()
+
+def fetch_stage(jobs, client, parse_queue, workers, max_retries):
+    """enrich_availability の取得ステージ。取得できたページと最終的に失敗したカードを parse_queue に入れる"""
+    total = len(jobs)
+    pending = deque((job, 1) for job in jobs)
+    retry_heap = [] # (再試行可能になる時刻, 連番, job, 試行回数)
+    sequence = itertools.count()
+    in_flight = {}
+    fetched_count = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or retry_heap or in_flight:
+            now = time.monotonic()
+            while retry_heap and retry_heap[0][0] <= now:
+                _, _, job, attempt = heapq.heappop(retry_heap)
+                pending.append((job, attempt))
+
+            while pending and len(in_flight) < workers:
+                job, attempt = pending.popleft()
+                in_flight[executor.submit(fetch_detail_page, client, job[2])] = (job, attempt)
+
+            if not in_flight:
+                metrics.sleep(max(0.0, retry_heap[0][0] - time.monotonic()), reason='retry_backoff')
                 continue
 
-            # 「availability」列がなければ作成し、pd.NA (または他の初期値) で初期化
-            if 'availability' not in df.columns:
-                df['availability'] = pd.NA
-            else:
-                # 既存の列がある場合、空文字列などをpd.NAに変換しておくと後続の判定がしやすい
-                df['availability'] = df['availability'].replace('', pd.NA)
-
-
-            updated_count = 0
-            total_rows = len(df)
-
-            for index, row in df.iterrows():
-                current_availability = row.get('availability')
-                
-                # 既に有効な情報がある場合はスキップ (エラーや未取得状態ではない場合)
-                # pd.NA もしくはエラーを示す特定の文字列であれば再試行
-                should_skip = False
-                if pd.notna(current_availability): # NAではない場合
-                    if current_availability not in ["取得失敗", "情報なし", "解析エラー", "未取得", "URL無効", "ページ取得失敗"]:
-                        should_skip = True
-                
-                if should_skip:
-                    # print(f"  ID {row.get('id', index)}: 既に有効な入手方法あり。スキップ。")
-                    continue
+            timeout = max(0.0, retry_heap[0][0] - now) if retry_heap else None
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
 
-                detail_url = row['detail_url']
-                card_id = row.get('id', f"index_{index}") 
+            for future in done:
+                job, attempt = in_flight.pop(future)
+                index, card_id, detail_url = job
+                content, retryable, retry_after, error = future.result()
 
-                if pd.isna(detail_url) or not isinstance(detail_url, str):
-                    print(f"  ID {card_id}: detail_urlが無効です。スキップ。")
-                    # detail_url が無効な場合、availability を更新 (元がNAの場合のみ)
-                    if pd.isna(df.loc[index, 'availability']):
-                        df.loc[index, 'availability'] = "URL無効"
-                    continue
-                
-                print(f"  処理中 ({index+1}/{total_rows}) ID: {card_id} - URL: {detail_url}")
-                
-                detail_soup = get_soup(detail_url, session=session)
-                
-                if detail_soup:
-                    availability_info = extract_availability(detail_soup)
-                    df.loc[index, 'availability'] = availability_info
-                    if availability_info not in ["取得失敗", "情報なし", "解析エラー"]:
-                        updated_count += 1
-                        print(f"    -> 入手方法: {str(availability_info)[:60]}...") # 長い場合があるので一部表示
+                if content is not None:
+                    fetched_count += 1
+                    metrics.inc('detail_pages_total', result='fetched')
+                    print(f"  取得完了 ({fetched_count}/{total}) ID: {card_id} - URL: {detail_url}")
+                    parse_queue.put((index, card_id, content))
+                elif retryable and attempt <= max_retries:
+                    delay = backoff_delay(attempt, retry_after=retry_after)
+                    metrics.inc('http_retries_total', stage='availability')
+                    print(f"  ID {card_id}: 取得失敗 ({error})。{delay:.1f} 秒後に再試行します ({attempt}/{max_retries})。")
+                    heapq.heappush(retry_heap, (time.monotonic() + delay, next(sequence), job, attempt + 1))
                 else:
-                    # get_soupでNoneが返ってきた場合 (ページ取得失敗)
-                    # availability を更新 (元がNAの場合のみ)
-                    if pd.isna(df.loc[index, 'availability']):
-                        df.loc[index, 'availability'] = "ページ取得失敗"
+                    print(f"  ID {card_id}: 取得失敗 ({error})。このカードは諦めます。")
+                    metrics.inc('detail_pages_total', result='failed')
+                    parse_queue.put((index, card_id, None))
 
-                time.sleep(DETAIL_PAGE_WAIT_TIME) 
+def enrich_dataframe(df, client, journal, workers=DETAIL_FETCH_WORKERS, max_retries=MAX_FETCH_RETRIES, refresh_fields=False):
+    """df の各カードの詳細ページを取得して availability などの列を更新し、入手方法を新規/更新割り当てした件数を返す
 
-            # 更新されたDataFrameをCSVに上書き保存
-            try:
-                df.to_csv(csv_filepath, index=False, encoding='utf-8-sig')
-                print(f"  {csv_filename} を更新しました。{updated_count} 件のカードに「主な入手方法」を新規/更新割り当てしました。")
-            except Exception as e:
-                print(f"  CSVファイルへの書き込みエラー ({csv_filepath}): {e}")
+    journal (CheckpointJournal) から前回の途中結果を復元し、新しい結果も journal に追記する。
+    df の保存と journal の削除は呼び出し側で行う。
+    """
+    # 「availability」列がなければ作成し、pd.NA (または他の初期値) で初期化
+    if 'availability' not in df.columns:
+        df['availability'] = pd.NA
+    else:
+        # 既存の列がある場合、空文字列などをpd.NAに変換しておくと後続の判定がしやすい
+        # (全行が空だと float 列として読まれるため、文字列を書き込めるよう object 型にする)
+        df['availability'] = df['availability'].astype(object).replace('', pd.NA)
+
+    # 前回の実行が途中で止まっていれば、ジャーナルから完了済みの結果を復元する
+    journaled = journal.load()
+    if journaled:
+        for index, card_id_str in df['id'].astype(str).items():
+            if card_id_str in journaled:
+                set_row_columns(df, index, journaled[card_id_str])
+        print(f"  ジャーナル ({journal.path}) から {len(journaled)} 件の結果を復元しました。続きから再開します。")
+
+    # 既に有効な情報がある行はスキップ (pd.NA もしくはエラーを示す特定の文字列であれば再試行)
+    # 対象行は列単位で先に絞り込み、対象の行だけを1行ずつ処理する
+    if refresh_fields:
+        candidates = df
+    else:
+        candidates = df[df['availability'].isna() | df['availability'].isin(RETRY_AVAILABILITY_VALUES)]
+
+    jobs = []
+    for index, row in candidates.iterrows():
+        detail_url = row['detail_url']
+        card_id = row.get('id', f"index_{index}") 
+
+        if pd.isna(detail_url) or not isinstance(detail_url, str):
+            print(f"  ID {card_id}: detail_urlが無効です。スキップ。")
+            # detail_url が無効な場合、availability を更新 (元がNAの場合のみ)
+            if pd.isna(df.loc[index, 'availability']):
+                df.loc[index, 'availability'] = "URL無効"
+                journal.append(card_id, {'availability': "URL無効"})
+            continue
+
+        jobs.append((index, card_id, detail_url))
+
+    print(f"  取得対象: {len(jobs)} 件 / 全 {len(df)} 件 (並列数: {workers})")
+
+    counts = {'updated': 0}
+
+    def on_result(index, card_id, columns):
+        if columns is not None:
+            availability_info = columns['availability']
+            set_row_columns(df, index, columns)
+            journal.append(card_id, columns)
+            if availability_info not in ["取得失敗", "情報なし", "解析エラー"]:
+                counts['updated'] += 1
+                print(f"    ID {card_id} -> 入手方法: {str(availability_info)[:60]}...") # 長い場合があるので一部表示
+        else:
+            # 再試行しても取得できなかった場合 (ページ取得失敗)
+            # availability を更新 (元がNAの場合のみ)
+            if pd.isna(df.loc[index, 'availability']):
+                df.loc[index, 'availability'] = "ページ取得失敗"
+                journal.append(card_id, {'availability': "ページ取得失敗"})
+
+    enrich_availability(jobs, client, on_result, workers=workers, max_retries=max_retries)
+    return counts['updated']
+
+def enrich_database(db, rarity, client, workers=DETAIL_FETCH_WORKERS, max_retries=MAX_FETCH_RETRIES, refresh_fields=False):
+    """enrich_dataframe のカードデータベース (card_db.CardDatabase) 版。入手方法を新規/更新割り当てした件数を返す
+
+    取得対象のカードは全件を読み込まずに索引 (availability_status) で引き、結果は1件ずつ
+    トランザクションで行を更新する。途中で止まっても完了済みの結果はデータベースに残る。
+    """
+    candidates = db.availability_jobs(rarity, include_done=refresh_fields)
+    pending_ids = set()
+    jobs = []
+    for card_id, detail_url, availability in candidates:
+        if availability is None:
+            pending_ids.add(card_id)
+        if not isinstance(detail_url, str) or not detail_url:
+            print(f"  ID {card_id}: detail_urlが無効です。スキップ。")
+            if availability is None:
+                db.update_card(card_id, {'availability': "URL無効"})
+            continue
+        jobs.append((card_id, card_id, detail_url))
+
+    print(f"  取得対象: {len(jobs)} 件 (並列数: {workers})")
+
+    counts = {'updated': 0}
+
+    def on_result(index, card_id, columns):
+        if columns is not None:
+            availability_info = columns['availability']
+            db.update_card(card_id, columns)
+            if availability_info not in ["取得失敗", "情報なし", "解析エラー"]:
+                counts['updated'] += 1
+                print(f"    ID {card_id} -> 入手方法: {str(availability_info)[:60]}...")
+        elif card_id in pending_ids:
+            # 再試行しても取得できなかった場合 (元が未取得の場合のみ更新)
+            db.update_card(card_id, {'availability': "ページ取得失敗"})
+
+    enrich_availability(jobs, client, on_result, workers=workers, max_retries=max_retries)
+    return counts['updated']
+
+def main():
+    parser = argparse.ArgumentParser(description="各カードの詳細ページから「主な入手方法」や属性などの詳細項目を取得し、CSVの列に書き込みます。")
+    parser.add_argument(
+        "-w", "--workers",
+        type=int,
+        default=DETAIL_FETCH_WORKERS,
+        help=f"詳細ページを同時に取得するスレッド数 (デフォルト: {DETAIL_FETCH_WORKERS})"
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=None,
+        help=f"全スレッド合計のリクエスト数/秒の上限 (デフォルト: {DETAIL_REQUESTS_PER_SECOND}、--workers 1 の場合は 1/{DETAIL_PAGE_WAIT_TIME})"
+    )
+    parser.add_argument(
+        "--refresh-fields",
+        action="store_true",
+        help="有効な入手方法が既にあるカードも詳細ページを取得し直し、全ての詳細項目 (属性など) を更新します。"
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=MAX_FETCH_RETRIES,
+        help=f"一時的なエラー (タイムアウト, 429, 5xx) の再試行回数の上限 (デフォルト: {MAX_FETCH_RETRIES})"
+    )
+    add_database_argument(parser)
+    add_cache_arguments(parser)
+    add_parser_argument(parser)
+    add_adaptive_arguments(parser)
+    add_metrics_arguments(parser)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    set_parser_backend(args.parser)
+    start_profile_from_args(args, 'add_availability_to_csv')
+
+    workers = max(1, args.workers)
+    if args.rate is not None:
+        rate = args.rate
+    elif workers == 1:
+        rate = 1 / DETAIL_PAGE_WAIT_TIME
+    else:
+        rate = DETAIL_REQUESTS_PER_SECOND
+    if rate <= 0:
+        parser.error("--rate には正の値を指定してください。")
+
+    # HTTPセッションを使い回し、実際にネットワークへ出るリクエストだけをレート制限する
+    with PoliteClient(rate=rate, max_per_host=workers, pool_size=workers, **adaptive_options_from_args(args)) as polite_client:
+        client = wrap_client_from_args(args, polite_client)
+        # 自動調整で同時接続数を上げられるよう、スレッドは上限の数だけ用意する (同時接続数は client が制限する)
+        threads = polite_client.max_concurrency
+        print(f"並列数: {workers}, レート上限: {rate:.2f} リクエスト/秒" + ("" if args.no_adaptive else " (サーバーの応答に合わせて自動調整します)"))
+        database = open_database_from_args(args)
+        if database is not None:
+            with database:
+                for rarity in database.import_csvs(CSV_DIRECTORY):
+                    print(f"{rarity} のCSVをデータベース ({database.path}) に取り込みました。")
+                for rarity in database.rarities():
+                    print(f"\n--- {rarity} の「主な入手方法」情報を処理中 (データベース: {database.path}) ---")
+                    updated_count = enrich_database(
+                        database, rarity, client,
+                        workers=threads, max_retries=args.max_retries, refresh_fields=args.refresh_fields,
+                    )
+                    for csv_path in database.export_csvs(CSV_DIRECTORY, [rarity]):
+                        print(f"  {csv_path} を書き出しました。{updated_count} 件のカードに「主な入手方法」を新規/更新割り当てしました。")
+        else:
+            for csv_filename in RARITY_CSV_FILES:
+                csv_filepath = os.path.join(CSV_DIRECTORY, csv_filename)
+            
+                if not os.path.exists(csv_filepath):
+                    print(f"CSVファイルが見つかりません: {csv_filepath}。スキップします。")
+                    continue
+
+                print(f"\n--- {csv_filename} の「主な入手方法」情報を処理中 ---")
+                try:
+                    df = read_csv(csv_filepath)
+                except Exception as e:
+                    print(f"  エラー: CSVファイルの読み込みに失敗 ({csv_filepath}): {e}")
+                    continue
+            
+                if 'detail_url' not in df.columns:
+                    print(f"  エラー: CSVファイルに 'detail_url' 列が見つかりません: {csv_filename}。スキップします。")
+                    continue
+
+                journal = CheckpointJournal.for_csv(csv_filepath)
+                updated_count = enrich_dataframe(
+                    df, client, journal,
+                    workers=threads, max_retries=args.max_retries, refresh_fields=args.refresh_fields,
+                )
+
+                # 更新されたDataFrameを一時ファイル経由でCSVに上書き保存し、反映できたらジャーナルを削除する
+                try:
+                    write_csv_atomic(df, csv_filepath)
+                    journal.discard()
+                    print(f"  {csv_filename} を更新しました。{updated_count} 件のカードに「主な入手方法」を新規/更新割り当てしました。")
+                except Exception as e:
+                    journal.close()
+                    print(f"  CSVファイルへの書き込みエラー ({csv_filepath}): {e}")
+                    print(f"  取得済みの結果はジャーナル ({journal.path}) に残っているため、次回の実行で再利用されます。")
 
     print("\n全てのCSVファイルの「主な入手方法」情報更新処理が完了しました。")
+    dump_metrics_from_args(args, 'add_availability_to_csv')
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
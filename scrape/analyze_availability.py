@@ -1,8 +1,15 @@
 import pandas as pd
+import argparse
+import json
 import os
 import re
+import sys
 from collections import Counter
 
+from filter_rules import KeywordAutomaton
+import profiling
+from profiling import add_profile_arguments, start_profile_from_args
+
 # --- 設定項目 ---
 CSV_DIRECTORY = '.'
 # 分析対象のCSVファイルリスト (全レアリティ分)
@@ -12,8 +19,48 @@ RARITY_CSV_FILES = [
     "cgss_r_card_list.csv",
     "cgss_n_card_list.csv",
 ]
+# CSVを一度に読み込む行数 (メモリ使用量はこの行数と入手方法の種類数で決まる)
+CHUNK_SIZE = 50000
+# 表示するユニークな入手方法の件数
+TOP_N = 50
 # --- ここまで設定項目 ---
 
+# 分析から除外する値 (取得できなかったことを示す値)
+EXCLUDED_VALUES = ["情報なし", "取得失敗", "解析エラー", "url無効", "ページ取得失敗"]
+
+KEYWORDS_TO_CHECK = {
+    "ガシャ": ["ガシャ", "gacha"], # "ガシャ"を含むもの
+    "フェス": ["フェス", "fes"],
+    "限定": ["限定"], # "期間限定"も含む
+    "恒常": ["恒常"], # これはおそらく "プラチナガシャ" のみなどで判断が必要
+    "イベント": ["イベント", "event"],
+    "報酬": ["報酬"],
+    "ランキング": ["ランキング", "ranking"],
+    "ポイント": ["ポイント", "pt"],
+    "シンデレラキャラバン": ["シンデレラキャラバン", "キャラバン"],
+    "live groove": ["live groove"],
+    "live parade": ["live parade"],
+    "live party": ["live party"],
+    "live carnival": ["live carnival"],
+    "ススメ！シンデレラロード": ["ススメ！シンデレラロード", "シンデレラロード"],
+    "アイドルプロデュース": ["アイドルプロデュース"],
+    "live infinity": ["live infinity"],
+    "ローカル": ["ローカル"],
+    "コラボ": ["コラボ"]
+}
+
+# 判定用キーワード（優先度順に）
+# より詳細なルールが必要（例：「プラチナガシャ」だけなら恒常だが、「期間限定プラチナガシャ」なら限定）
+LIMITED_KEYWORDS = ["限定", "シンデレラフェス", "フェス限定", "期間限定"] # 期間が書かれているものも限定
+EVENT_KEYWORDS = ["イベント", "報酬", "ランキング", "ポイント", "シンデレラキャラバン", "live groove", "live parade", "live party", "live carnival", "シンデレラロード", "アイドルプロデュース", "live infinity"]
+# 恒常と判断できる明確なキーワードは少ないので、消去法で考える
+# 「プラチナガシャ」のみ、かつ上記限定/イベントキーワードを含まない、かつ日付情報が曖昧なもの
+OTHER_KEYWORDS = ["復刻", "プラチナガシャ", "ローカルガシャ", "初期選択"]
+
+# 簡易判定の種類と、表示する例の件数
+TYPE_EXAMPLE_LIMITS = {"限定": 5, "イベント限定": 5, "恒常っぽい": 5, "不明": 10}
+DATE_PATTERN = re.compile(r'\d{4}年|\d{1,2}月\d{1,2}日|\d{1,2}/\d{1,2}') # 簡単な日付判定
+
 def normalize_text(text):
     """簡単なテキスト正規化（小文字化、余分なスペース削除など）"""
     if pd.isna(text):
@@ -26,126 +73,195 @@ def normalize_text(text):
     text = text.replace("ライブ", "live") # カタカナ英語の統一など
     return text
 
-def main():
-    all_availability_texts = []
+def classify_type(text, found):
+    """正規化した入手方法を 限定 / イベント限定 / 恒常っぽい / 不明 に簡易判定する (found はテキスト中のキーワードの集合)"""
+    is_limited = any(kw in found for kw in LIMITED_KEYWORDS)
+    is_event = any(kw in found for kw in EVENT_KEYWORDS)
+    has_date = bool(DATE_PATTERN.search(text))
+
+    if "復刻" in found: # 復刻は元のカテゴリに準ずるが、ここでは一旦「限定」扱い
+        is_limited = True
+
+    if is_limited or (has_date and "プラチナガシャ" in found and "シンデレラフェス" not in found): # 日付付きガシャは限定とみなす
+        return "限定"
+    if is_event:
+        return "イベント限定"
+    if "プラチナガシャ" in found and not has_date:
+        return "恒常っぽい"
+    if "ローカルガシャ" in found or "初期選択" in found:
+        return "恒常っぽい"
+    return "不明"
+
+
+class AvailabilityAnalyzer:
+    """入手方法の文字列をチャンク単位で受け取り、1回の走査で集計する
+
+    正規化・キーワード検索・簡易判定は異なる文字列ごとに1回だけ行い、結果を出現回数分だけ数える。
+    保持するのは異なる文字列ごとの集計だけなので、メモリ使用量はレコード数によらない。
+    キーワードは全て1つの KeywordAutomaton にまとめ、文字列を1回走査するだけで全キーワードを調べる。
+    """
+
+    def __init__(self):
+        patterns = [pattern for patterns in KEYWORDS_TO_CHECK.values() for pattern in patterns]
+        self.automaton = KeywordAutomaton(patterns + LIMITED_KEYWORDS + EVENT_KEYWORDS + OTHER_KEYWORDS)
+        self.record_count = 0
+        self.text_counts = Counter()
+        self.keyword_counts = Counter()
+        self.type_counts = Counter()
+        self.type_examples = {type_name: [] for type_name in TYPE_EXAMPLE_LIMITS}
+        # 元の文字列 → 正規化した文字列 (除外する値は None)
+        self._normalized = {}
+        # 正規化した文字列 → (該当するキーワードの一覧, 簡易判定)
+        self._verdicts = {}
+
+    def _normalize(self, raw):
+        if raw not in self._normalized:
+            excluded = not raw.strip() or raw.lower() in EXCLUDED_VALUES
+            self._normalized[raw] = None if excluded else normalize_text(raw)
+        return self._normalized[raw]
+
+    def _verdict(self, text):
+        if text not in self._verdicts:
+            found = self.automaton.find_all(text)
+            keys = [key for key, patterns in KEYWORDS_TO_CHECK.items() if any(pattern in found for pattern in patterns)]
+            self._verdicts[text] = (keys, classify_type(text, found))
+        return self._verdicts[text]
+
+    def update(self, series):
+        """入手方法の Series (1チャンク分) を集計に加える"""
+        values = series.dropna().astype(str)
+        self.record_count += len(values)
+        if values.empty:
+            return
+        # 異なる文字列 (出現順) と各行の番号、出現回数
+        codes, uniques = pd.factorize(values)
+        counts = pd.Series(codes).value_counts(sort=False)
+        texts = [self._normalize(raw) for raw in uniques]
+        for code, text in enumerate(texts):
+            if text is None:
+                continue
+            count = int(counts[code])
+            keys, type_name = self._verdict(text)
+            self.text_counts[text] += count
+            for key in keys:
+                self.keyword_counts[key] += count
+            self.type_counts[type_name] += count
 
-    for csv_filename in RARITY_CSV_FILES:
-        csv_filepath = os.path.join(CSV_DIRECTORY, csv_filename)
+        # 判定の例は出現順に集める (例が揃えば以降の行は見ない)
+        for code in codes:
+            if all(len(examples) >= TYPE_EXAMPLE_LIMITS[type_name] for type_name, examples in self.type_examples.items()):
+                break
+            text = texts[code]
+            if text is None:
+                continue
+            type_name = self._verdicts[text][1]
+            if len(self.type_examples[type_name]) < TYPE_EXAMPLE_LIMITS[type_name]:
+                self.type_examples[type_name].append(text)
+
+    def report(self, top_n=TOP_N):
+        """集計結果を JSON にできる辞書で返す"""
+        return {
+            'record_count': self.record_count,
+            'analyzed_count': sum(self.text_counts.values()),
+            'unique_count': len(self.text_counts),
+            'top_availability': [{'text': text, 'count': count} for text, count in self.text_counts.most_common(top_n)],
+            'keyword_counts': dict(self.keyword_counts.most_common()),
+            'type_counts': {type_name: self.type_counts[type_name] for type_name in TYPE_EXAMPLE_LIMITS},
+            'type_examples': self.type_examples,
+        }
+
+
+def iter_availability_chunks(csv_paths, chunksize=CHUNK_SIZE):
+    """各CSVの availability 列を chunksize 行ずつ Series として返す"""
+    for csv_filepath in csv_paths:
         if not os.path.exists(csv_filepath):
             print(f"CSVファイルが見つかりません: {csv_filepath}。スキップします。")
             continue
 
-        print(f"\n--- {csv_filename} を読み込み中 ---")
+        print(f"\n--- {os.path.basename(csv_filepath)} を読み込み中 ---")
         try:
-            df = pd.read_csv(csv_filepath)
-            if 'availability' in df.columns:
-                # NaNや空でないものだけをリストに追加
-                all_availability_texts.extend(df['availability'].dropna().astype(str).tolist())
-            else:
-                print(f"  警告: {csv_filename} に 'availability' 列がありません。")
+            reader = pd.read_csv(csv_filepath, usecols=lambda column: column == 'availability', dtype=str, chunksize=chunksize)
+            for chunk in reader:
+                if 'availability' not in chunk.columns:
+                    print(f"  警告: {os.path.basename(csv_filepath)} に 'availability' 列がありません。")
+                    break
+                yield chunk['availability']
         except Exception as e:
             print(f"  エラー: CSVファイルの読み込みに失敗 ({csv_filepath}): {e}")
             continue
-    
-    if not all_availability_texts:
-        print("入手方法の情報がどのCSVからも取得できませんでした。")
-        return
 
-    print(f"\n--- 全 {len(all_availability_texts)} 件の入手方法情報を分析 ---")
-
-    # 正規化したテキストのリストを作成
-    normalized_texts = [normalize_text(text) for text in all_availability_texts if text.strip() and text.lower() not in ["情報なし", "取得失敗", "解析エラー", "url無効", "ページ取得失敗"]]
+def print_report(report):
+    """集計結果をテキストで表示する"""
+    print(f"\n--- 全 {report['record_count']} 件の入手方法情報を分析 ---")
 
     # ユニークな入手方法とその出現回数
-    print("\n--- ユニークな入手方法 (正規化後、トップ50) ---")
-    unique_availability_counts = Counter(normalized_texts)
-    for item, count in unique_availability_counts.most_common(50):
-        print(f"- \"{item}\" ({count}回)")
+    print(f"\n--- ユニークな入手方法 (正規化後、トップ{len(report['top_availability'])}) ---")
+    for item in report['top_availability']:
+        print(f"- \"{item['text']}\" ({item['count']}回)")
 
     # キーワードによる分析
     print("\n--- 主要キーワードの出現回数 ---")
-    keywords_to_check = {
-        "ガシャ": ["ガシャ", "gacha"], # "ガシャ"を含むもの
-        "フェス": ["フェス", "fes"],
-        "限定": ["限定"], # "期間限定"も含む
-        "恒常": ["恒常"], # これはおそらく "プラチナガシャ" のみなどで判断が必要
-        "イベント": ["イベント", "event"],
-        "報酬": ["報酬"],
-        "ランキング": ["ランキング", "ranking"],
-        "ポイント": ["ポイント", "pt"],
-        "シンデレラキャラバン": ["シンデレラキャラバン", "キャラバン"],
-        "live groove": ["live groove"],
-        "live parade": ["live parade"],
-        "live party": ["live party"],
-        "live carnival": ["live carnival"],
-        "ススメ！シンデレラロード": ["ススメ！シンデレラロード", "シンデレラロード"],
-        "アイドルプロデュース": ["アイドルプロデュース"],
-        "live infinity": ["live infinity"],
-        "ローカル": ["ローカル"],
-        "コラボ": ["コラボ"]
-    }
-    
-    keyword_counts = Counter()
-    for text in normalized_texts:
-        for key, patterns in keywords_to_check.items():
-            if any(pattern in text for pattern in patterns):
-                keyword_counts[key] += 1
-    
-    for key, count in keyword_counts.most_common():
+    for key, count in report['keyword_counts'].items():
         print(f"- 「{key}」関連: {count}回")
 
     # 恒常/限定の簡易判定の試み
     print("\n--- 恒常/限定/期間限定の簡易判定試行 (キーワードベース) ---")
-    limited_count = 0
-    permanent_ish_count = 0 # 「恒常」と明記されていないが、そう思われるもの
-    event_limited_count = 0
-    unknown_type_count = 0
-    
-    # 判定用キーワード（優先度順に）
-    # より詳細なルールが必要（例：「プラチナガシャ」だけなら恒常だが、「期間限定プラチナガシャ」なら限定）
-    limited_keywords = ["限定", "シンデレラフェス", "フェス限定", "期間限定"] # 期間が書かれているものも限定
-    event_keywords = ["イベント", "報酬", "ランキング", "ポイント", "シンデレラキャラバン", "live groove", "live parade", "live party", "live carnival", "シンデレラロード", "アイドルプロデュース", "live infinity"]
-    # 恒常と判断できる明確なキーワードは少ないので、消去法で考える
-    # 「プラチナガシャ」のみ、かつ上記限定/イベントキーワードを含まない、かつ日付情報が曖昧なもの
-    
-    categorized_examples = {"限定": [], "イベント限定": [], "恒常っぽい": [], "不明": []}
-
-    for text in normalized_texts:
-        text_lower = text.lower() # 判定用に小文字化
-        is_limited = any(kw in text_lower for kw in limited_keywords)
-        is_event = any(kw in text_lower for kw in event_keywords)
-        has_date = bool(re.search(r'\d{4}年|\d{1,2}月\d{1,2}日|\d{1,2}/\d{1,2}', text)) # 簡単な日付判定
-
-        if "復刻" in text_lower: # 復刻は元のカテゴリに準ずるが、ここでは一旦「限定」扱い
-            is_limited = True
-
-        if is_limited or (has_date and "プラチナガシャ" in text_lower and "シンデレラフェス" not in text_lower): # 日付付きガシャは限定とみなす
-            limited_count += 1
-            if len(categorized_examples["限定"]) < 5: categorized_examples["限定"].append(text)
-        elif is_event:
-            event_limited_count += 1
-            if len(categorized_examples["イベント限定"]) < 5: categorized_examples["イベント限定"].append(text)
-        elif "プラチナガシャ" in text_lower and not has_date and not is_limited and not is_event:
-            permanent_ish_count += 1
-            if len(categorized_examples["恒常っぽい"]) < 5: categorized_examples["恒常っぽい"].append(text)
-        elif "ローカルガシャ" in text_lower or "初期選択" in text_lower:
-             permanent_ish_count += 1
-             if len(categorized_examples["恒常っぽい"]) < 5: categorized_examples["恒常っぽい"].append(text)
-        else:
-            unknown_type_count += 1
-            if len(categorized_examples["不明"]) < 10: categorized_examples["不明"].append(text)
-
-
-    print(f"  限定（ガシャ等）と判定される可能性: {limited_count} 件")
-    for ex in categorized_examples["限定"]: print(f"    例: {ex}")
-    print(f"  イベント限定/報酬と判定される可能性: {event_limited_count} 件")
-    for ex in categorized_examples["イベント限定"]: print(f"    例: {ex}")
-    print(f"  恒常ガシャ/その他と判定される可能性: {permanent_ish_count} 件")
-    for ex in categorized_examples["恒常っぽい"]: print(f"    例: {ex}")
-    print(f"  上記以外・分類不明: {unknown_type_count} 件")
-    for ex in categorized_examples["不明"]: print(f"    例: {ex}")
+    labels = {
+        "限定": "限定（ガシャ等）と判定される可能性",
+        "イベント限定": "イベント限定/報酬と判定される可能性",
+        "恒常っぽい": "恒常ガシャ/その他と判定される可能性",
+        "不明": "上記以外・分類不明",
+    }
+    for type_name, label in labels.items():
+        print(f"  {label}: {report['type_counts'][type_name]} 件")
+        for ex in report['type_examples'][type_name]: print(f"    例: {ex}")
 
     print("\n分析完了。上記を元にフィルター条件を検討してください。")
 
+def main():
+    parser = argparse.ArgumentParser(description="カードCSVの入手方法 (availability 列) をチャンク単位で読み込み、出現回数・キーワード・簡易判定を集計します。")
+    parser.add_argument(
+        "csv_files",
+        nargs='*',
+        help="分析するCSVファイル (過去のスナップショットなども指定可能, デフォルト: 全レアリティのCSV)"
+    )
+    parser.add_argument("--chunksize", type=int, default=CHUNK_SIZE, help=f"一度に読み込む行数 (デフォルト: {CHUNK_SIZE})")
+    parser.add_argument("--top", type=int, default=TOP_N, help=f"表示するユニークな入手方法の件数 (デフォルト: {TOP_N})")
+    parser.add_argument("--json", metavar="PATH", default=None, help="集計結果を JSON で書き出します (- を指定すると標準出力に出力し、テキストの表示は省略します)。")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    start_profile_from_args(args, 'analyze_availability')
+
+    csv_paths = args.csv_files or [os.path.join(CSV_DIRECTORY, csv_filename) for csv_filename in RARITY_CSV_FILES]
+    analyzer = AvailabilityAnalyzer()
+    if args.json == '-':
+        # JSON を標準出力に出す場合は、進捗メッセージを標準エラーに回す
+        stdout, sys.stdout = sys.stdout, sys.stderr
+        try:
+            for series in iter_availability_chunks(csv_paths, args.chunksize):
+                with profiling.stage('analyze_chunk'):
+                    analyzer.update(series)
+        finally:
+            sys.stdout = stdout
+    else:
+        for series in iter_availability_chunks(csv_paths, args.chunksize):
+            with profiling.stage('analyze_chunk'):
+                analyzer.update(series)
+
+    if not analyzer.record_count:
+        print("入手方法の情報がどのCSVからも取得できませんでした。", file=sys.stderr if args.json == '-' else sys.stdout)
+        return
+
+    report = analyzer.report(top_n=args.top)
+    if args.json == '-':
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+        return
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"集計結果を {args.json} に書き出しました。")
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
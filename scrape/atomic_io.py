@@ -0,0 +1,61 @@
+import os
+import stat
+import tempfile
+from contextlib import contextmanager
+
+
+def _current_umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+# 新しく作るファイルの権限 (open() で作った場合と同じく umask を適用したもの)
+# umask は書き換えないと読めないため、スレッドが動き出す前の import 時に1回だけ読む
+DEFAULT_FILE_MODE = 0o666 & ~_current_umask()
+
+
+def file_mode_for(path):
+    """path を置き換えるときの権限 (既存のファイルがあればその権限, なければ DEFAULT_FILE_MODE)"""
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        return DEFAULT_FILE_MODE
+
+
+def replace_atomic(tmp_path, path):
+    """一時ファイル tmp_path の権限を整えてから、rename で path を置き換える
+
+    mkstemp は所有者のみ読み書き可能 (0600) でファイルを作るため、そのまま rename すると
+    公開するCSVや配信するファイルが他のユーザーから読めなくなる。
+    """
+    os.chmod(tmp_path, file_mode_for(path))
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def atomic_write(path, mode='wb', encoding=None, newline=None):
+    """path と同じディレクトリの一時ファイルを開いて返し、with ブロックが正常に終わったら path を置き換える
+
+    書き込み途中で処理が止まっても、既存のファイルが中途半端な内容になることはない。
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode, encoding=encoding, newline=newline) as f:
+            yield f
+        replace_atomic(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_bytes_atomic(path, data):
+    with atomic_write(path, 'wb') as f:
+        f.write(data)
+
+
+def write_text_atomic(path, text, encoding='utf-8'):
+    with atomic_write(path, 'w', encoding=encoding) as f:
+        f.write(text)
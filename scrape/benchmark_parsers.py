@@ -0,0 +1,125 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+from html_parsing import make_soup, available_backends, DEFAULT_PARSER_BACKEND
+from http_cache import CACHE_DIRECTORY
+from scrape_cgss import parse_listing_page
+from collect_attribute_card_ids import parse_card_ids
+from add_availability_to_csv import parse_detail_page
+
+# 詳細ページのURLに含まれるパス (これ以外は一覧ページとして扱う)
+DETAIL_PATH_MARKER = '/cgss/card/detail/'
+
+
+def load_cached_pages(cache_dir):
+    """HTTPキャッシュ (http_cache.HttpCache) から (url, ページ種別, ボディ) のリストを読み込む"""
+    pages = []
+    for entry_name in sorted(os.listdir(cache_dir)):
+        if not entry_name.endswith('.json'):
+            continue
+        meta_path = os.path.join(cache_dir, entry_name)
+        body_path = meta_path[:-len('.json')] + '.body'
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                url = json.load(f)['url']
+            with open(body_path, 'rb') as f:
+                body = f.read()
+        except (OSError, KeyError, json.JSONDecodeError):
+            continue
+        page_kind = 'detail' if DETAIL_PATH_MARKER in url else 'listing'
+        pages.append((url, page_kind, body))
+    return pages
+
+
+def extract_records(soup, url, page_kind):
+    """ページ種別に応じて各スクリプトと同じ抽出処理を行い、比較可能な値を返す"""
+    if page_kind == 'detail':
+        return {'detail_columns': parse_detail_page(soup)}
+    cards, next_url = parse_listing_page(soup, url, 'benchmark')
+    card_ids, next_url_for_ids = parse_card_ids(soup, url)
+    return {
+        'cards': cards,
+        'next_url': next_url,
+        'card_ids': sorted(card_ids),
+        'next_url_for_ids': next_url_for_ids,
+    }
+
+
+def run_backend(backend, pages, repeat):
+    """1バックエンドで全ページを解析し、(ページごとの最小解析時間[ms]のリスト, 抽出結果のリスト) を返す"""
+    timings_ms = []
+    records = []
+    for url, page_kind, body in pages:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            soup = make_soup(body, page_kind=page_kind, backend=backend)
+            result = extract_records(soup, url, page_kind)
+            elapsed = (time.perf_counter() - start) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        timings_ms.append(best)
+        records.append(result)
+    return timings_ms, records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="キャッシュ済みの一覧/詳細ページを使い、HTMLパーサーバックエンドごとの解析時間と抽出結果の一致を確認します。")
+    parser.add_argument("--cache-dir", default=CACHE_DIRECTORY, help=f"HTTPキャッシュのディレクトリ (デフォルト: {CACHE_DIRECTORY})")
+    parser.add_argument("--repeat", type=int, default=3, help="1ページあたりの計測回数 (最小値を採用, デフォルト: 3)")
+    parser.add_argument("--limit", type=int, default=None, help="計測するページ数の上限")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.cache_dir):
+        print(f"キャッシュディレクトリが見つかりません: {args.cache_dir}")
+        print("先に --cache を付けてスクレイピングスクリプトを実行してください。")
+        return 1
+
+    pages = load_cached_pages(args.cache_dir)
+    if args.limit:
+        pages = pages[:args.limit]
+    if not pages:
+        print(f"キャッシュにページがありません: {args.cache_dir}")
+        return 1
+
+    num_detail = sum(1 for _, page_kind, _ in pages if page_kind == 'detail')
+    print(f"計測対象: {len(pages)} ページ (一覧 {len(pages) - num_detail}, 詳細 {num_detail}), 各 {args.repeat} 回")
+
+    backends = available_backends()
+    reference_timings, reference_records = run_backend(DEFAULT_PARSER_BACKEND, pages, args.repeat)
+    results = {DEFAULT_PARSER_BACKEND: reference_timings}
+    parity_ok = True
+
+    for backend in backends:
+        if backend == DEFAULT_PARSER_BACKEND:
+            continue
+        timings, records = run_backend(backend, pages, args.repeat)
+        results[backend] = timings
+        mismatches = [
+            pages[i][0] for i, (expected, actual) in enumerate(zip(reference_records, records))
+            if expected != actual
+        ]
+        if mismatches:
+            parity_ok = False
+            print(f"\n[不一致] {backend}: {len(mismatches)} ページで抽出結果が {DEFAULT_PARSER_BACKEND} と異なります")
+            for url in mismatches[:10]:
+                print(f"  - {url}")
+
+    print(f"\n{'backend':<22}{'mean ms':>10}{'median ms':>12}{'total ms':>12}{'speedup':>10}")
+    reference_total = sum(reference_timings)
+    for backend, timings in results.items():
+        total = sum(timings)
+        speedup = reference_total / total if total else float('nan')
+        print(f"{backend:<22}{statistics.mean(timings):>10.2f}{statistics.median(timings):>12.2f}{total:>12.1f}{speedup:>9.2f}x")
+
+    if parity_ok:
+        print(f"\n全バックエンドの抽出結果が {DEFAULT_PARSER_BACKEND} と一致しました。")
+        return 0
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
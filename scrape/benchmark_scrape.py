@@ -0,0 +1,254 @@
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+from card_store import CardStore, RARITY_INFO, CSV_DIRECTORY
+from http_client import PoliteClient
+from image_store import ImageStore
+from mock_gamedbs import MockGamedbsServer, LISTING_PAGE_SIZE
+import scrape_cgss
+import add_availability_to_csv
+import download_cgss_images_cli
+
+# --- 設定項目 ---
+# 計測時のクライアント側のリクエスト数/秒の上限 (モックサーバーなので実サイトより高くしてよい)
+BENCHMARK_RATE_PER_SECOND = 200.0
+# 詳細ページ取得・画像ダウンロードの並列数
+BENCHMARK_WORKERS = 4
+# --- ここまで設定項目 ---
+
+SCENARIOS = ['scrape', 'availability', 'images']
+
+
+class NullJournal:
+    """計測用の何もしないジャーナル (CheckpointJournal と同じメソッドを持つ)"""
+
+    path = '(benchmark)'
+
+    def load(self):
+        return {}
+
+    def append(self, key, values):
+        pass
+
+    def close(self):
+        pass
+
+    def discard(self):
+        pass
+
+
+class ParseTimer:
+    """モジュールの解析関数を置き換えて、解析にかかった時間とページ数を集計する
+
+    soup_function (make_soup) の呼び出し回数をページ数として数え、
+    extract_functions (parse_listing_page など) の時間も解析時間に含める。
+    """
+
+    def __init__(self, module, soup_function, extract_functions):
+        self.module = module
+        self.names = [soup_function] + list(extract_functions)
+        self.soup_function = soup_function
+        self.seconds = 0.0
+        self.pages = 0
+        self._lock = threading.Lock()
+
+    def _wrap(self, name, function):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self.seconds += elapsed
+                    if name == self.soup_function:
+                        self.pages += 1
+        return timed
+
+    @contextlib.contextmanager
+    def patch(self):
+        originals = {name: getattr(self.module, name) for name in self.names}
+        for name, function in originals.items():
+            setattr(self.module, name, self._wrap(name, function))
+        try:
+            yield self
+        finally:
+            for name, function in originals.items():
+                setattr(self.module, name, function)
+
+    def ms_per_page(self):
+        return self.seconds * 1000 / self.pages if self.pages else None
+
+
+def mock_card_frame(store, server, rarities, limit=None):
+    """モックサーバーを指すURLに置き換えたカードの DataFrame (availability は未取得の状態)"""
+    frames = [store.get(rarity).head(limit) if limit else store.get(rarity) for rarity in rarities]
+    df = pd.concat(frames, ignore_index=True)[['id', 'name', 'rarity']].copy()
+    df['detail_url'] = [f"{server.base_url}/cgss/card/detail/{card_id}/{card_id}#card-{card_id}" for card_id in df['id']]
+    df['image_url'] = [f"{server.base_url}/cgss/images/{card_id}.jpg" for card_id in df['id']]
+    df['availability'] = pd.NA
+    return df
+
+
+def run_scrape_scenario(server, client, rarities, _store, _limit, _workers, _max_retries):
+    """scrape_cgss.py の一覧ページのクロール"""
+    timer = ParseTimer(scrape_cgss, 'make_soup', ['parse_listing_page'])
+    with timer.patch():
+        found = 0
+        for rarity in rarities:
+            target_info = {'url': server.listing_url(rarity), 'rarity_label': scrape_cgss.RARITY_TARGETS[rarity]['rarity_label']}
+            found += len(scrape_cgss.crawl_rarity(rarity, target_info, client=client))
+    expected = sum(len(server.cards_by_rarity[rarity]) for rarity in rarities)
+    return timer, {'cards_found': found, 'cards_expected': expected}
+
+
+def run_availability_scenario(server, client, rarities, store, limit, workers, max_retries):
+    """add_availability_to_csv.py の詳細ページの取得と解析"""
+    df = mock_card_frame(store, server, rarities, limit)
+    timer = ParseTimer(add_availability_to_csv, 'make_soup', ['parse_detail_page'])
+    with timer.patch():
+        updated = add_availability_to_csv.enrich_dataframe(df, client, NullJournal(), workers=workers, max_retries=max_retries)
+    return timer, {'cards_updated': updated, 'cards_expected': len(df)}
+
+
+def run_images_scenario(server, client, rarities, store, limit, workers, _max_retries):
+    """download_cgss_images_cli.py の画像ダウンロード (一時ディレクトリに保存する)"""
+    df = mock_card_frame(store, server, rarities, limit)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        image_dir = os.path.join(tmp_dir, 'images')
+        image_store = ImageStore(os.path.join(tmp_dir, 'store'), image_dir)
+        save_dir = os.path.join(image_dir, 'benchmark')
+        os.makedirs(save_dir)
+        counts = download_cgss_images_cli.download_rarity_images(df, 'benchmark', save_dir, client, workers=workers, store=image_store)
+    return None, {'images_downloaded': counts['downloaded'], 'images_failed': counts['failed'], 'cards_expected': len(df)}
+
+
+SCENARIO_RUNNERS = {
+    'scrape': run_scrape_scenario,
+    'availability': run_availability_scenario,
+    'images': run_images_scenario,
+}
+
+
+def run_scenario(name, server, store, rarities, args):
+    """1つのシナリオを実行し、計測結果の辞書を返す"""
+    server.stats.reset()
+    if args.memory:
+        tracemalloc.start()
+    client = PoliteClient(rate=args.rate, burst=args.workers, max_per_host=args.workers, pool_size=args.workers,
+                          adaptive=args.adaptive, max_rate=args.max_rate, max_concurrency=args.max_concurrency)
+    output = sys.stdout if args.verbose else open(os.devnull, 'w', encoding='utf-8')
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(output):
+            # 自動調整で同時接続数を上げられるよう、スレッドは同時接続数の上限の数だけ用意する
+            timer, items = SCENARIO_RUNNERS[name](server, client, rarities, store, args.limit, client.max_concurrency, args.max_retries)
+    finally:
+        elapsed = time.perf_counter() - start
+        client.close()
+        if output is not sys.stdout:
+            output.close()
+    peak_bytes = None
+    if args.memory:
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    stats = server.stats.snapshot()
+    final_rate = client.controller.rate if client.controller else args.rate
+    final_concurrency = client.controller.concurrency if client.controller else args.workers
+    return {
+        'scenario': name,
+        'seconds': round(elapsed, 3),
+        'requests': stats['requests'],
+        'pages': stats['pages'],
+        'pages_per_sec': round(stats['pages'] / elapsed, 2) if elapsed else None,
+        'parse_ms_per_page': round(timer.ms_per_page(), 3) if timer and timer.ms_per_page() is not None else None,
+        'bytes': stats['bytes'],
+        'errors': stats['errors'],
+        'rate_limited': stats['rate_limited'],
+        'peak_memory_mb': round(peak_bytes / (1024 * 1024), 2) if peak_bytes is not None else None,
+        'final_rate': round(final_rate, 2),
+        'final_concurrency': final_concurrency,
+        **items,
+    }
+
+
+def print_results(results, settings):
+    print(f"\n=== 計測結果 ({', '.join(f'{key}={value}' for key, value in settings.items())}) ===")
+    print(f"{'scenario':<14} {'sec':>8} {'pages':>7} {'pages/s':>9} {'parse ms':>9} {'KB':>9} {'5xx':>5} {'429':>5} {'peak MB':>8} {'rate':>7} {'conc':>5}  結果")
+    for result in results:
+        parse_ms = f"{result['parse_ms_per_page']:.3f}" if result['parse_ms_per_page'] is not None else '-'
+        peak_mb = f"{result['peak_memory_mb']:.2f}" if result['peak_memory_mb'] is not None else '-'
+        extra = ', '.join(f"{key}={value}" for key, value in result.items() if key.startswith(('cards_', 'images_')))
+        print(
+            f"{result['scenario']:<14} {result['seconds']:>8.2f} {result['pages']:>7} {result['pages_per_sec']:>9.1f} "
+            f"{parse_ms:>9} {result['bytes'] / 1024:>9.1f} {result['errors']:>5} {result['rate_limited']:>5} {peak_mb:>8} {result['final_rate']:>7.2f} {result['final_concurrency']:>5}  {extra}"
+        )
+    print("(parse ms: 1ページあたりの HTML 解析 + 抽出の時間, peak MB: tracemalloc で計測した Python のメモリ使用量のピーク, "
+          "rate / conc: 終了時のクライアントのリクエスト数/秒・同時接続数の上限)")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="カードCSVの内容を返すローカルのモックサーバー (mock_gamedbs.py) に対して、一覧クロール・詳細ページ取得・画像ダウンロードを実行し、"
+                    "ページ数/秒・1ページあたりの解析時間・転送量・メモリ使用量のピークを計測します。imas.gamedbs.jp にはアクセスしません。"
+    )
+    parser.add_argument("--scenarios", nargs='+', choices=SCENARIOS, default=SCENARIOS, help="計測するシナリオ (デフォルト: 全て)")
+    parser.add_argument("-r", "--rarity", nargs='+', choices=RARITY_INFO.keys(), default=list(RARITY_INFO.keys()), help="対象のレアリティ (デフォルト: 全て)")
+    parser.add_argument("--limit", type=int, default=None, help="availability / images で使うカード数の上限 (レアリティごと)")
+    parser.add_argument("-w", "--workers", type=int, default=BENCHMARK_WORKERS, help=f"並列数 (デフォルト: {BENCHMARK_WORKERS})")
+    parser.add_argument("--rate", type=float, default=BENCHMARK_RATE_PER_SECOND, help=f"クライアント側のリクエスト数/秒の上限 (デフォルト: {BENCHMARK_RATE_PER_SECOND})")
+    parser.add_argument("--adaptive", action="store_true", help="クライアントのレート・同時接続数をサーバーの応答に合わせて自動調整します (AIMD)。")
+    parser.add_argument("--max-rate", type=float, default=None, help="--adaptive で上げるリクエスト数/秒の上限 (デフォルト: --rate の数倍)")
+    parser.add_argument("--max-concurrency", type=int, default=None, help="--adaptive で上げる同時接続数の上限 (デフォルト: --workers の2倍)")
+    parser.add_argument("--max-retries", type=int, default=add_availability_to_csv.MAX_FETCH_RETRIES, help="詳細ページ取得の再試行回数の上限")
+    parser.add_argument("--page-size", type=int, default=LISTING_PAGE_SIZE, help=f"一覧ページ1ページあたりのカード数 (デフォルト: {LISTING_PAGE_SIZE})")
+    parser.add_argument("--latency", type=float, default=0.0, help="モックサーバーの応答の遅延 (秒)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="応答の遅延の揺らぎ (秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="モックサーバーが 503 を返す割合 (0〜1)")
+    parser.add_argument("--server-rate-limit", type=float, default=None, help="モックサーバー側のリクエスト数/秒の上限 (超えたら 429 + Retry-After)")
+    parser.add_argument("--seed", type=int, default=0, help="エラーと遅延の乱数の種 (デフォルト: 0)")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="tracemalloc によるメモリ計測を行いません (計測のオーバーヘッドを除く場合)。")
+    parser.add_argument("--json", metavar="PATH", default=None, help="計測結果を JSON で書き出します。")
+    parser.add_argument("--verbose", action="store_true", help="各スクリプトの進捗メッセージを表示します。")
+    args = parser.parse_args()
+    args.workers = max(1, args.workers)
+
+    with contextlib.redirect_stdout(open(os.devnull, 'w', encoding='utf-8')):
+        store = CardStore.load(CSV_DIRECTORY, rarities=args.rarity)
+    rarities = store.rarities()
+    server = MockGamedbsServer(
+        store, page_size=args.page_size, latency=args.latency, jitter=args.jitter,
+        error_rate=args.error_rate, rate_limit=args.server_rate_limit, seed=args.seed,
+    )
+    settings = {
+        'workers': args.workers, 'rate': args.rate, 'latency': args.latency, 'jitter': args.jitter,
+        'error_rate': args.error_rate, 'server_rate_limit': args.server_rate_limit, 'page_size': args.page_size,
+        'adaptive': args.adaptive,
+    }
+    print(f"モックサーバー: {server.base_url} ({', '.join(f'{rarity} {len(server.cards_by_rarity[rarity])} 件' for rarity in rarities)})")
+
+    results = []
+    with server:
+        for name in [scenario for scenario in SCENARIOS if scenario in args.scenarios]:
+            print(f"計測中: {name} ...")
+            results.append(run_scenario(name, server, store, rarities, args))
+
+    print_results(results, settings)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'settings': settings, 'results': results}, f, ensure_ascii=False, indent=2)
+        print(f"計測結果を {args.json} に書き出しました。")
+
+
+if __name__ == "__main__":
+    main()
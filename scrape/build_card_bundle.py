@@ -0,0 +1,186 @@
+import argparse
+import glob
+import gzip
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+try:
+    import brotli
+    HAS_BROTLI = True
+except ImportError:
+    HAS_BROTLI = False
+
+from atomic_io import write_bytes_atomic
+from card_store import CardStore, RARITY_INFO, CARD_SCHEMA, CSV_DIRECTORY
+from profiling import add_profile_arguments, start_profile_from_args
+
+# --- 設定項目 ---
+# バンドルの出力先 (フロントエンドの public/data 以下)
+BUNDLE_DIRECTORY = os.path.join('..', 'public', 'data', 'bundle')
+# バンドルのファイル名の接頭辞 (実際のファイル名は cards.<ハッシュ>.json)
+BUNDLE_BASENAME = 'cards'
+# 最新のバンドルのファイル名とハッシュを記録するマニフェスト (こちらはファイル名が固定)
+BUNDLE_MANIFEST_FILENAME = 'cards.manifest.json'
+# --- ここまで設定項目 ---
+
+BUNDLE_FORMAT_VERSION = 1
+# 値の種類が少ない列は、値の一覧 (codes) への添字で保存する
+INTERNED_COLUMNS = ['rarity', 'attribute', 'filter_category', 'availability']
+# 全カードで「接頭辞 + 残り」の形になっている列は、接頭辞を1回だけ保存する
+URL_PREFIXES = {
+    'image_url': 'https://imas.gamedbs.jp/cgss/images/',
+}
+# 全カードで id から組み立てられる列は、列ごと省略してテンプレートだけを保存する
+URL_TEMPLATES = {
+    'detail_url': 'https://imas.gamedbs.jp/cgss/card/detail/{id}/{id}#card-{id}',
+}
+# バンドルに含める列 (detail_* などの列はフロントエンドで使わないため含めない)
+BUNDLE_COLUMNS = list(CARD_SCHEMA)
+
+
+def _values(series):
+    """Series を JSON にできる値のリストにする (NA は None)"""
+    return [None if pd.isna(value) else value for value in series.astype(object)]
+
+
+def build_bundle(store, rarities=None):
+    """ストアのカードから列指向のバンドル (dict) を作る
+
+    rarities.<レアリティ>.columns.<列名> が全カード分の値の配列になる。
+    INTERNED_COLUMNS の列は codes.<列名> への添字 (NA は null)、
+    URL_PREFIXES の列は prefixes.<列名> を除いた残り、
+    URL_TEMPLATES の列は省略され、templates.<列名> の {id} をカードIDで置き換えて復元する。
+    """
+    rarities = rarities or store.rarities()
+    frames = {rarity: store.get(rarity) for rarity in rarities}
+    all_cards = pd.concat([df[BUNDLE_COLUMNS] for df in frames.values()], ignore_index=True)
+
+    codes = {}
+    for column in INTERNED_COLUMNS:
+        # 出現回数の多い値ほど小さい添字にする (数字の桁数が減る)
+        codes[column] = all_cards[column].dropna().astype(str).value_counts(sort=True).index.tolist()
+
+    prefixes = {
+        column: prefix for column, prefix in URL_PREFIXES.items()
+        if all_cards[column].dropna().astype(str).str.startswith(prefix).all()
+    }
+    templates = {
+        column: template for column, template in URL_TEMPLATES.items()
+        if (all_cards[column].astype(object) == all_cards['id'].map(lambda card_id: template.format(id=card_id))).all()
+    }
+
+    bundle = {
+        'version': BUNDLE_FORMAT_VERSION,
+        'codes': codes,
+        'prefixes': prefixes,
+        'templates': templates,
+        'rarities': {},
+    }
+    for rarity, df in frames.items():
+        columns = {}
+        for column in BUNDLE_COLUMNS:
+            if column in templates:
+                continue
+            series = df[column]
+            if column == 'id':
+                columns[column] = [int(card_id) for card_id in series]
+            elif column in codes:
+                index = {value: i for i, value in enumerate(codes[column])}
+                columns[column] = [None if value is None else index[str(value)] for value in _values(series)]
+            elif column in prefixes:
+                prefix_length = len(prefixes[column])
+                columns[column] = [None if value is None else value[prefix_length:] for value in _values(series)]
+            else:
+                columns[column] = _values(series)
+        bundle['rarities'][rarity] = {
+            'folder': RARITY_INFO[rarity]['subdir'],
+            'count': len(df),
+            'columns': columns,
+        }
+    return bundle
+
+
+def serialize_bundle(bundle):
+    """空白なしの JSON (UTF-8) にする。同じ内容なら常に同じバイト列になる"""
+    return json.dumps(bundle, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def write_bundle(data, output_dir, keep_old=False):
+    """バンドルを cards.<ハッシュ>.json (+ .gz / .br) として書き出し、マニフェストを返す
+
+    ファイル名に内容のハッシュを含めるため、内容が変わらなければファイル名も変わらず、
+    ブラウザのキャッシュをそのまま使える。マニフェストは最後に書き換える。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    content_hash = hashlib.sha256(data).hexdigest()[:16]
+    filename = f"{BUNDLE_BASENAME}.{content_hash}.json"
+    manifest = {
+        'version': BUNDLE_FORMAT_VERSION,
+        'hash': content_hash,
+        'file': filename,
+        'bytes': len(data),
+    }
+
+    write_bytes_atomic(os.path.join(output_dir, filename), data)
+    # mtime=0 で、同じ内容なら同じ .gz になるようにする
+    gzip_data = gzip.compress(data, compresslevel=9, mtime=0)
+    write_bytes_atomic(os.path.join(output_dir, filename + '.gz'), gzip_data)
+    manifest['gzip_bytes'] = len(gzip_data)
+    if HAS_BROTLI:
+        brotli_data = brotli.compress(data, quality=11)
+        write_bytes_atomic(os.path.join(output_dir, filename + '.br'), brotli_data)
+        manifest['brotli_bytes'] = len(brotli_data)
+
+    write_bytes_atomic(
+        os.path.join(output_dir, BUNDLE_MANIFEST_FILENAME),
+        json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8'),
+    )
+
+    if not keep_old:
+        current = {filename, filename + '.gz', filename + '.br'}
+        for path in glob.glob(os.path.join(output_dir, f"{BUNDLE_BASENAME}.*.json*")):
+            if os.path.basename(path) not in current and os.path.basename(path) != BUNDLE_MANIFEST_FILENAME:
+                os.remove(path)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="レアリティ別CSVから、フロントエンド用の列指向・圧縮済みのカードバンドル (cards.<ハッシュ>.json と .gz / .br) を作成します。"
+    )
+    parser.add_argument("--out", default=BUNDLE_DIRECTORY, help=f"出力先ディレクトリ (デフォルト: {BUNDLE_DIRECTORY})")
+    parser.add_argument("--csv-dir", default=CSV_DIRECTORY, help=f"CSVのディレクトリ (デフォルト: {CSV_DIRECTORY})")
+    parser.add_argument("--db", default=None, help="CSVの代わりにカードデータベース (card_db.py) から読み込みます。")
+    parser.add_argument("--keep-old", action="store_true", help="以前のハッシュのバンドルを削除せずに残します。")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    start_profile_from_args(args, 'build_card_bundle')
+
+    database = None
+    if args.db:
+        from card_db import CardDatabase
+        database = CardDatabase(args.db)
+    store = CardStore.load(args.csv_dir, database=database)
+
+    data = serialize_bundle(build_bundle(store))
+    manifest = write_bundle(data, args.out, keep_old=args.keep_old)
+    if database is not None:
+        database.close()
+
+    csv_bytes = sum(
+        os.path.getsize(store.path_for(rarity)) for rarity in store.rarities() if os.path.exists(store.path_for(rarity))
+    )
+    print(f"バンドルを作成しました: {os.path.join(args.out, manifest['file'])}")
+    print(f"  カード数: {sum(len(store.get(rarity)) for rarity in store.rarities())}")
+    print(f"  CSV合計: {csv_bytes:,} bytes -> JSON: {manifest['bytes']:,} bytes, gzip: {manifest['gzip_bytes']:,} bytes", end='')
+    if HAS_BROTLI:
+        print(f", brotli: {manifest['brotli_bytes']:,} bytes")
+    else:
+        print(" (brotli は未インストールのため省略: pip install brotli)")
+
+
+if __name__ == "__main__":
+    main()
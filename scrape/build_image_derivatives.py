@@ -0,0 +1,230 @@
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+try:
+    from PIL import Image
+    HAS_PILLOW = True
+except ImportError:
+    HAS_PILLOW = False
+
+from atomic_io import atomic_write
+from file_hash import file_sha256
+from card_store import RARITY_INFO
+from profiling import add_profile_arguments, start_profile_from_args
+
+# --- 設定項目 ---
+# 元画像のディレクトリ (download_cgss_images_cli.py の保存先)
+SOURCE_DIRECTORY = 'cgss_images'
+# 派生画像の出力先
+DERIVATIVE_DIRECTORY = 'cgss_images_derived'
+# 縮小版の幅 (px)。カード一覧の狭い画面での表示幅 (80px)。元画像より小さい幅だけを生成する
+# (元画像と同じ大きさの WebP/AVIF 版は常に生成する)
+DERIVATIVE_WIDTHS = [80]
+# 生成する形式 (avif は Pillow が AVIF に対応している場合のみ)
+DERIVATIVE_FORMATS = ['jpg', 'webp', 'avif']
+# 形式ごとの画質
+DERIVATIVE_QUALITY = {'jpg': 85, 'webp': 80, 'avif': 60}
+# 元画像のハッシュと生成済みファイルを記録するマニフェスト (DERIVATIVE_DIRECTORY 内)
+DERIVATIVE_MANIFEST_FILENAME = 'derivatives_manifest.json'
+# --- ここまで設定項目 ---
+
+SOURCE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+PILLOW_FORMATS = {'jpg': 'JPEG', 'webp': 'WEBP', 'avif': 'AVIF'}
+
+
+def supported_formats(formats):
+    """Pillow で書き出せる形式だけを返す"""
+    Image.init()
+    return [fmt for fmt in formats if PILLOW_FORMATS[fmt] in Image.SAVE]
+
+
+def derivative_targets(relative_source, output_dir, widths, formats):
+    """元画像 (SOURCE_DIRECTORY からの相対パス) の派生画像の (幅, 形式, パス) のリスト
+
+    元画像と同じ大きさのものは <名前>.<形式> (幅は None)、縮小版は <名前>.w<幅>.<形式>。
+    元画像と同じ形式・同じ大きさのもの (元画像の複製になるもの) は含めない。
+    """
+    stem, ext = os.path.splitext(relative_source)
+    source_format = 'jpg' if ext.lower() in ('.jpg', '.jpeg') else ext.lower().lstrip('.')
+    targets = [(None, fmt, os.path.join(output_dir, f"{stem}.{fmt}")) for fmt in formats if fmt != source_format]
+    targets += [
+        (width, fmt, os.path.join(output_dir, f"{stem}.w{width}.{fmt}"))
+        for width in widths for fmt in formats
+    ]
+    return targets
+
+
+def render_derivatives(source_path, targets, quality):
+    """1枚の元画像から派生画像を生成する (プロセスプールのワーカーで実行される)
+
+    targets は (幅, 形式, 出力パス) のリスト。元画像の幅以上の縮小版は (拡大になるため) 生成しない。
+    生成したパスのリストを返す。
+    """
+    written = []
+    with Image.open(source_path) as image:
+        image.load()
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGB')
+        for width, fmt, output_path in targets:
+            if width is None:
+                resized = image
+            elif image.width > width:
+                height = max(1, round(image.height * width / image.width))
+                resized = image.resize((width, height), Image.LANCZOS)
+            else:
+                continue
+            if fmt == 'jpg' and resized.mode == 'RGBA':
+                resized = resized.convert('RGB')
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            with atomic_write(output_path, 'wb') as f:
+                resized.save(f, format=PILLOW_FORMATS[fmt], quality=quality[fmt])
+            written.append(output_path)
+    return written
+
+
+def settings_key(widths, formats, quality):
+    """生成設定が変わったら全画像を作り直すための識別子"""
+    return json.dumps({'widths': widths, 'formats': formats, 'quality': {fmt: quality[fmt] for fmt in formats}}, sort_keys=True)
+
+
+def load_manifest(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def save_manifest(path, manifest):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with atomic_write(path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+
+
+def list_sources(source_dir, rarities):
+    """(SOURCE_DIRECTORY からの相対パス, 絶対パス) のリスト"""
+    sources = []
+    for rarity in rarities:
+        rarity_dir = os.path.join(source_dir, RARITY_INFO[rarity]["subdir"])
+        if not os.path.isdir(rarity_dir):
+            continue
+        for name in sorted(os.listdir(rarity_dir)):
+            if name.lower().endswith(SOURCE_EXTENSIONS):
+                sources.append((os.path.join(RARITY_INFO[rarity]["subdir"], name), os.path.join(rarity_dir, name)))
+    return sources
+
+
+def build_derivatives(source_dir=SOURCE_DIRECTORY, output_dir=DERIVATIVE_DIRECTORY, rarities=None,
+                      widths=DERIVATIVE_WIDTHS, formats=DERIVATIVE_FORMATS, quality=DERIVATIVE_QUALITY,
+                      workers=None, force=False):
+    """元画像の派生画像 (縮小版 + WebP/AVIF) をプロセスプールで並列に生成し、件数の辞書を返す
+
+    元画像のハッシュがマニフェストと同じで派生画像が揃っているものはスキップする。
+    元画像がなくなったものは派生画像とマニフェストの記録を削除する。
+    """
+    formats = supported_formats(formats)
+    manifest_path = os.path.join(output_dir, DERIVATIVE_MANIFEST_FILENAME)
+    manifest = load_manifest(manifest_path)
+    key = settings_key(widths, formats, quality)
+    if manifest.get('settings') != key:
+        if manifest:
+            print("生成設定 (幅・形式・画質) が変わったため、全ての派生画像を作り直します。")
+        manifest = {'settings': key, 'images': {}}
+    entries = manifest['images']
+
+    counts = {'generated': 0, 'skipped': 0, 'failed': 0, 'removed': 0}
+    jobs = {}
+    sources = list_sources(source_dir, rarities or list(RARITY_INFO))
+    for relative_source, source_path in sources:
+        targets = derivative_targets(relative_source, output_dir, widths, formats)
+        source_hash = file_sha256(source_path)
+        entry = entries.get(relative_source)
+        up_to_date = (
+            not force and entry and entry.get('sha256') == source_hash
+            and all(os.path.exists(os.path.join(output_dir, path)) for path in entry.get('outputs', []))
+        )
+        if up_to_date:
+            counts['skipped'] += 1
+            continue
+        jobs[relative_source] = (source_path, source_hash, targets)
+
+    # 元画像が削除されたものの派生画像を片付ける (対象レアリティのもののみ)
+    current = {relative_source for relative_source, _ in sources}
+    target_subdirs = {RARITY_INFO[rarity]["subdir"] for rarity in (rarities or RARITY_INFO)}
+    for relative_source in list(entries):
+        if relative_source in current or relative_source.split(os.sep)[0] not in target_subdirs:
+            continue
+        for path in entries[relative_source].get('outputs', []):
+            if os.path.exists(os.path.join(output_dir, path)):
+                os.remove(os.path.join(output_dir, path))
+        del entries[relative_source]
+        counts['removed'] += 1
+
+    print(f"派生画像: 対象 {len(sources)} 枚, 生成 {len(jobs)} 枚, スキップ {counts['skipped']} 枚 (幅: {widths}, 形式: {formats})")
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(render_derivatives, source_path, targets, quality): relative_source
+                for relative_source, (source_path, _, targets) in jobs.items()
+            }
+            for future in as_completed(futures):
+                relative_source = futures[future]
+                source_path, source_hash, _ = jobs[relative_source]
+                try:
+                    written = future.result()
+                except Exception as e:
+                    print(f"  派生画像の生成に失敗しました ({source_path}): {e}")
+                    counts['failed'] += 1
+                    entries.pop(relative_source, None)
+                    continue
+                entries[relative_source] = {
+                    'sha256': source_hash,
+                    'outputs': [os.path.relpath(path, output_dir) for path in written],
+                }
+                counts['generated'] += 1
+                if counts['generated'] % 100 == 0:
+                    print(f"  {counts['generated']}/{len(jobs)} 枚 生成済み")
+
+    save_manifest(manifest_path, manifest)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ダウンロード済みのカード画像から、一覧表示用の縮小版と WebP/AVIF 版をCPUコア数分のプロセスで並列に生成します。")
+    parser.add_argument(
+        "-r", "--rarity",
+        nargs='+',
+        choices=RARITY_INFO.keys(),
+        default=list(RARITY_INFO.keys()),
+        help="処理するレアリティ (デフォルト: 全て)"
+    )
+    parser.add_argument("--source-dir", default=SOURCE_DIRECTORY, help=f"元画像のディレクトリ (デフォルト: {SOURCE_DIRECTORY})")
+    parser.add_argument("--out", default=DERIVATIVE_DIRECTORY, help=f"出力先ディレクトリ (デフォルト: {DERIVATIVE_DIRECTORY})")
+    parser.add_argument("--widths", type=int, nargs='+', default=DERIVATIVE_WIDTHS, help=f"生成する幅 (px, デフォルト: {DERIVATIVE_WIDTHS})")
+    parser.add_argument("--formats", nargs='+', choices=list(PILLOW_FORMATS), default=DERIVATIVE_FORMATS, help=f"生成する形式 (デフォルト: {DERIVATIVE_FORMATS})")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="プロセス数 (デフォルト: CPUコア数)")
+    parser.add_argument("--force", action="store_true", help="元画像が変わっていなくても全て作り直します。")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    start_profile_from_args(args, 'build_image_derivatives')
+
+    if not HAS_PILLOW:
+        print("エラー: 派生画像の生成には Pillow が必要です (pip install Pillow)。")
+        sys.exit(1)
+    unsupported = [fmt for fmt in args.formats if fmt not in supported_formats(args.formats)]
+    if unsupported:
+        print(f"この環境の Pillow は {', '.join(unsupported)} の書き出しに対応していないため省略します。")
+
+    counts = build_derivatives(
+        source_dir=args.source_dir, output_dir=args.out, rarities=args.rarity,
+        widths=sorted(set(args.widths)), formats=args.formats, workers=args.workers, force=args.force,
+    )
+    print(f"\n生成: {counts['generated']} 枚, スキップ (変更なし): {counts['skipped']} 枚, 失敗: {counts['failed']} 枚, 削除 (元画像なし): {counts['removed']} 枚")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import argparse
+import glob
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+
+try:
+    from PIL import Image
+    HAS_PILLOW = True
+except ImportError:
+    HAS_PILLOW = False
+
+from atomic_io import write_bytes_atomic
+from card_store import RARITY_INFO
+from file_hash import file_sha256
+from profiling import add_profile_arguments, start_profile_from_args
+
+# --- 設定項目 ---
+# 元画像のディレクトリ (download_cgss_images_cli.py の保存先)
+SOURCE_DIRECTORY = 'cgss_images'
+# アトラスの出力先。フロントエンドはまだアトラスを読み込まないため、デプロイされる public/ には書き出さない
+# (カード一覧がアトラスを使うようになったら ../public/data/atlas に変える)
+ATLAS_DIRECTORY = 'cgss_atlas'
+# 1枚のアトラスに並べるカード数と列数 (10列 x 10行)
+CARDS_PER_ATLAS = 100
+ATLAS_COLUMNS = 10
+# 1枚あたりの大きさ (px)。カード画像 (100x100) と異なる場合は縮小/拡大する
+CELL_SIZE = 100
+# アトラスの形式と画質
+ATLAS_FORMAT = 'webp'
+ATLAS_QUALITY = {'jpg': 85, 'webp': 80, 'png': None}
+# アトラスのファイル名と座標を記録するマニフェスト (ATLAS_DIRECTORY 内、ファイル名は固定)
+ATLAS_MANIFEST_FILENAME = 'atlas_manifest.json'
+# --- ここまで設定項目 ---
+
+PILLOW_FORMATS = {'jpg': 'JPEG', 'webp': 'WEBP', 'png': 'PNG'}
+CARD_IMAGE_PATTERN = re.compile(r'^(\d+)_.*\.(jpg|jpeg|png)$', re.IGNORECASE)
+
+
+def list_card_images(source_dir, rarity):
+    """レアリティの画像を (カードID, パス) のリストとしてID順に返す (ファイル名の先頭の <id>_ からIDを取る)"""
+    rarity_dir = os.path.join(source_dir, RARITY_INFO[rarity]["subdir"])
+    if not os.path.isdir(rarity_dir):
+        return []
+    images = {}
+    for name in os.listdir(rarity_dir):
+        match = CARD_IMAGE_PATTERN.match(name)
+        if match:
+            images[int(match.group(1))] = os.path.join(rarity_dir, name)
+    return sorted(images.items())
+
+
+def plan_pages(card_images, per_atlas=CARDS_PER_ATLAS):
+    """ID順のカードを per_atlas 枚ずつのページに分ける
+
+    新しいカードはIDが大きいため最後のページに追加され、それ以前のページの構成は変わらない。
+    """
+    return [card_images[i:i + per_atlas] for i in range(0, len(card_images), per_atlas)]
+
+
+def page_key(page, source_hashes, settings):
+    """ページの構成 (カードID・元画像のハッシュ) と設定から、ページを作り直す必要があるかを判定するキー"""
+    digest = hashlib.sha256(settings.encode('utf-8'))
+    for card_id, path in page:
+        digest.update(f"{card_id}:{source_hashes[path]}\n".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def render_page(page, cell_size, columns, fmt, quality):
+    """1ページ分のアトラス画像を作り、(エンコード済みのバイト列, {カードID: [x, y, w, h]}) を返す"""
+    rows = (len(page) + columns - 1) // columns
+    atlas = Image.new('RGB', (cell_size * min(columns, len(page)), cell_size * rows), (255, 255, 255))
+    frames = {}
+    for position, (card_id, path) in enumerate(page):
+        x, y = (position % columns) * cell_size, (position // columns) * cell_size
+        with Image.open(path) as image:
+            image = image.convert('RGB')
+            if image.size != (cell_size, cell_size):
+                image = image.resize((cell_size, cell_size), Image.LANCZOS)
+            atlas.paste(image, (x, y))
+        frames[str(card_id)] = [x, y, cell_size, cell_size]
+    buffer = io.BytesIO()
+    save_options = {'quality': quality} if quality is not None else {}
+    atlas.save(buffer, format=PILLOW_FORMATS[fmt], **save_options)
+    return buffer.getvalue(), frames
+
+
+def load_manifest(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def build_atlases(source_dir=SOURCE_DIRECTORY, output_dir=ATLAS_DIRECTORY, rarities=None,
+                  per_atlas=CARDS_PER_ATLAS, columns=ATLAS_COLUMNS, cell_size=CELL_SIZE, fmt=ATLAS_FORMAT):
+    """レアリティごとにカード画像をアトラスにまとめ、マニフェストを書き出して件数の辞書を返す
+
+    マニフェスト (ATLAS_MANIFEST_FILENAME) の形式:
+      {"cell_size": 100, "format": "webp",
+       "rarities": {"SSR": {"pages": [{"file": "SSR_000.<ハッシュ>.webp", "key": ..., "frames": {"<カードID>": [x, y, w, h]}}]}}}
+    構成と元画像が前回と同じページは作り直さない。使われなくなったアトラス画像は削除する。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, ATLAS_MANIFEST_FILENAME)
+    previous = load_manifest(manifest_path)
+    if (previous.get('cell_size'), previous.get('format')) != (cell_size, fmt):
+        # 大きさや形式が違うアトラスは混在させない (対象外のレアリティの記録も引き継がない)
+        previous = {}
+    settings = json.dumps({'per_atlas': per_atlas, 'columns': columns, 'cell_size': cell_size, 'format': fmt, 'quality': ATLAS_QUALITY[fmt]}, sort_keys=True)
+    manifest = {
+        'cell_size': cell_size,
+        'format': fmt,
+        'rarities': dict(previous.get('rarities', {})),
+    }
+    counts = {'rendered': 0, 'reused': 0}
+
+    for rarity in rarities or list(RARITY_INFO):
+        card_images = list_card_images(source_dir, rarity)
+        source_hashes = {path: file_sha256(path) for _, path in card_images}
+        previous_pages = {page['key']: page for page in previous.get('rarities', {}).get(rarity, {}).get('pages', [])}
+        pages = []
+        for number, page in enumerate(plan_pages(card_images, per_atlas)):
+            key = page_key(page, source_hashes, settings)
+            reusable = previous_pages.get(key)
+            if reusable and reusable['file'].startswith(f"{rarity}_{number:03d}.") and os.path.exists(os.path.join(output_dir, reusable['file'])):
+                pages.append(reusable)
+                counts['reused'] += 1
+                continue
+            data, frames = render_page(page, cell_size, columns, fmt, ATLAS_QUALITY[fmt])
+            filename = f"{rarity}_{number:03d}.{hashlib.sha256(data).hexdigest()[:12]}.{fmt}"
+            write_bytes_atomic(os.path.join(output_dir, filename), data)
+            pages.append({'file': filename, 'key': key, 'frames': frames})
+            counts['rendered'] += 1
+            print(f"  {rarity}: {filename} ({len(page)} 枚, {len(data):,} bytes) を作成しました。")
+        manifest['rarities'][rarity] = {'pages': pages}
+
+    write_bytes_atomic(manifest_path, json.dumps(manifest, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+    # マニフェストから参照されなくなったアトラス画像を削除する
+    referenced = {page['file'] for info in manifest['rarities'].values() for page in info['pages']}
+    for path in glob.glob(os.path.join(output_dir, f"*.{fmt}")):
+        if os.path.basename(path) not in referenced:
+            os.remove(path)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ダウンロード済みのカード画像をレアリティごとのアトラス画像 (スプライトシート) にまとめ、座標のマニフェストを書き出します。")
+    parser.add_argument(
+        "-r", "--rarity",
+        nargs='+',
+        choices=RARITY_INFO.keys(),
+        default=list(RARITY_INFO.keys()),
+        help="処理するレアリティ (デフォルト: 全て)"
+    )
+    parser.add_argument("--source-dir", default=SOURCE_DIRECTORY, help=f"元画像のディレクトリ (デフォルト: {SOURCE_DIRECTORY})")
+    parser.add_argument("--out", default=ATLAS_DIRECTORY, help=f"出力先ディレクトリ (デフォルト: {ATLAS_DIRECTORY})")
+    parser.add_argument("--per-atlas", type=int, default=CARDS_PER_ATLAS, help=f"1枚のアトラスに並べるカード数 (デフォルト: {CARDS_PER_ATLAS})")
+    parser.add_argument("--columns", type=int, default=ATLAS_COLUMNS, help=f"アトラスの列数 (デフォルト: {ATLAS_COLUMNS})")
+    parser.add_argument("--cell-size", type=int, default=CELL_SIZE, help=f"1枚あたりの大きさ (px, デフォルト: {CELL_SIZE})")
+    parser.add_argument("--format", choices=list(PILLOW_FORMATS), default=ATLAS_FORMAT, help=f"アトラスの形式 (デフォルト: {ATLAS_FORMAT})")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    start_profile_from_args(args, 'build_sprite_atlas')
+
+    if not HAS_PILLOW:
+        print("エラー: アトラスの作成には Pillow が必要です (pip install Pillow)。")
+        sys.exit(1)
+    if args.per_atlas <= 0 or args.columns <= 0 or args.cell_size <= 0:
+        parser.error("--per-atlas / --columns / --cell-size には正の値を指定してください。")
+
+    counts = build_atlases(
+        source_dir=args.source_dir, output_dir=args.out, rarities=args.rarity,
+        per_atlas=args.per_atlas, columns=args.columns, cell_size=args.cell_size, fmt=args.format,
+    )
+    print(f"\nアトラス: 作成 {counts['rendered']} 枚, 変更なし {counts['reused']} 枚 ({os.path.join(args.out, ATLAS_MANIFEST_FILENAME)})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+
+from card_store import RARITY_INFO, CARD_SCHEMA, CSV_DIRECTORY, RETRY_AVAILABILITY_VALUES, apply_schema
+from csv_io import write_csv_atomic, read_csv
+from profiling import add_profile_arguments, start_profile_from_args
+
+# --- 設定項目 ---
+# カードデータベース (SQLite) のデフォルトのパス
+CARD_DATABASE_FILE = 'cgss_cards.sqlite3'
+# --- ここまで設定項目 ---
+
+# availability から求める取得状況 (availability_status 列)
+#   pending: 未取得 (空欄)
+#   retry  : 取得・解析に失敗しており、次回再取得する (RETRY_AVAILABILITY_VALUES)
+#   done   : 取得済み
+STATUS_PENDING = 'pending'
+STATUS_RETRY = 'retry'
+STATUS_DONE = 'done'
+
+# cards テーブルの列として持つ CARD_SCHEMA の列 (それ以外の detail_* などの列は extra に JSON で保存する)
+CARD_COLUMNS = list(CARD_SCHEMA)
+# write_frame が1行として書き込む列 (この順の tuple で比較・書き込みする)
+ROW_COLUMNS = ['id', 'rarity_key', 'position'] + CARD_COLUMNS[1:] + ['availability_status', 'extra']
+UPSERT_SQL = (
+    f"INSERT INTO cards ({', '.join(ROW_COLUMNS)}) VALUES ({', '.join('?' for _ in ROW_COLUMNS)})"
+    f" ON CONFLICT(id) DO UPDATE SET {', '.join(f'{column} = excluded.{column}' for column in ROW_COLUMNS[1:])}"
+)
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS cards (
+    id INTEGER PRIMARY KEY,
+    rarity_key TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT,
+    rarity TEXT,
+    image_url TEXT,
+    detail_url TEXT,
+    attribute TEXT,
+    availability TEXT,
+    availability_status TEXT NOT NULL,
+    filter_category TEXT,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_cards_rarity ON cards (rarity_key, position);
+CREATE INDEX IF NOT EXISTS idx_cards_attribute ON cards (attribute);
+CREATE INDEX IF NOT EXISTS idx_cards_filter_category ON cards (filter_category);
+CREATE INDEX IF NOT EXISTS idx_cards_availability_status ON cards (availability_status, rarity_key);
+CREATE TABLE IF NOT EXISTS frame_columns (
+    rarity_key TEXT PRIMARY KEY,
+    columns TEXT NOT NULL
+);
+"""
+
+
+def availability_status(availability):
+    if availability is None or pd.isna(availability) or availability == '':
+        return STATUS_PENDING
+    if availability in RETRY_AVAILABILITY_VALUES:
+        return STATUS_RETRY
+    return STATUS_DONE
+
+
+def _to_sql_value(value):
+    if value is None or pd.isna(value):
+        return None
+    return value.item() if hasattr(value, 'item') else value
+
+
+class CardDatabase:
+    """カードデータを SQLite に保存する
+
+    cards テーブルはカードIDを主キーとし、レアリティ・属性・フィルターカテゴリ・取得状況に索引を持つ。
+    「入手方法が未取得のカード」などの検索は全件走査ではなく索引で引ける。
+    書き込みは全てトランザクション内で行い、複数スレッドから同時に呼び出してよい。
+    """
+
+    def __init__(self, path=CARD_DATABASE_FILE):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA_SQL)
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            with self._conn:
+                yield self._conn
+
+    def rarities(self):
+        with self._lock:
+            stored = [row[0] for row in self._conn.execute('SELECT rarity_key FROM frame_columns')]
+        return [rarity for rarity in RARITY_INFO if rarity in stored]
+
+    def write_frame(self, rarity, df):
+        """レアリティのカードを df の内容にそろえ、(書き込んだ行数, 削除した行数) を返す (1トランザクション)
+
+        保存済みの行と比べ、変わった行と新しい行だけを書き込み、df にない行を削除する。
+        """
+        extra_columns = [column for column in df.columns if column not in CARD_COLUMNS]
+        rows = {}
+        for position, record in enumerate(df.to_dict('records')):
+            extra = {column: _to_sql_value(record[column]) for column in extra_columns}
+            card_id = int(record['id'])
+            rows[card_id] = (
+                card_id, rarity, position,
+                *(_to_sql_value(record.get(column)) for column in CARD_COLUMNS[1:]),
+                availability_status(record.get('availability')),
+                json.dumps({k: v for k, v in extra.items() if v is not None}, ensure_ascii=False),
+            )
+        with self.transaction() as conn:
+            stored = {
+                values[0]: values
+                for values in conn.execute(f"SELECT {', '.join(ROW_COLUMNS)} FROM cards WHERE rarity_key = ?", (rarity,))
+            }
+            changed = [row for card_id, row in rows.items() if stored.get(card_id) != row]
+            removed = [(card_id,) for card_id in stored if card_id not in rows]
+            conn.executemany('DELETE FROM cards WHERE id = ?', removed)
+            conn.executemany(UPSERT_SQL, changed)
+            conn.execute(
+                'INSERT OR REPLACE INTO frame_columns (rarity_key, columns) VALUES (?, ?)',
+                (rarity, json.dumps(list(df.columns), ensure_ascii=False)),
+            )
+        return len(changed), len(removed)
+
+    def import_csvs(self, directory=CSV_DIRECTORY, rarities=None, replace=False):
+        """レアリティ別CSVを取り込み、取り込んだレアリティのリストを返す
+
+        replace=False なら、データベースに既にあるレアリティは取り込まない (CSVの代わりにデータベースを使い始めるとき用)。
+        """
+        stored_rarities = set(self.rarities())
+        imported = []
+        for rarity in rarities or RARITY_INFO:
+            if rarity in stored_rarities and not replace:
+                continue
+            csv_path = os.path.join(directory, RARITY_INFO[rarity]["filename"])
+            if not os.path.exists(csv_path):
+                continue
+            self.write_frame(rarity, apply_schema(read_csv(csv_path)))
+            imported.append(rarity)
+        return imported
+
+    def read_frame(self, rarity):
+        """レアリティの全カードを CSV と同じ列順の DataFrame として返す"""
+        with self._lock:
+            row = self._conn.execute('SELECT columns FROM frame_columns WHERE rarity_key = ?', (rarity,)).fetchone()
+            if row is None:
+                raise KeyError(f"データベースに {rarity} のカードがありません: {self.path}")
+            columns = json.loads(row[0])
+            cursor = self._conn.execute(
+                f"SELECT {', '.join(CARD_COLUMNS)}, extra FROM cards WHERE rarity_key = ? ORDER BY position",
+                (rarity,),
+            )
+            records = []
+            for values in cursor:
+                record = dict(zip(CARD_COLUMNS, values[:-1]))
+                record.update(json.loads(values[-1]))
+                records.append(record)
+        df = pd.DataFrame(records, columns=columns)
+        return apply_schema(df.astype(object).where(df.notna(), pd.NA))[columns]
+
+    def update_card(self, card_id, columns):
+        """1枚のカードの列を更新する (columns は 列名 → 値)。まだない detail_* などの列は extra に追加する"""
+        card_columns = {column: value for column, value in columns.items() if column in CARD_COLUMNS[1:]}
+        extra_columns = {column: value for column, value in columns.items() if column not in CARD_COLUMNS}
+        with self.transaction() as conn:
+            row = conn.execute('SELECT rarity_key, extra FROM cards WHERE id = ?', (int(card_id),)).fetchone()
+            if row is None:
+                raise KeyError(f"データベースにカード {card_id} がありません")
+            rarity, extra_json = row
+            assignments = [f"{column} = ?" for column in card_columns]
+            params = [_to_sql_value(value) for value in card_columns.values()]
+            if 'availability' in card_columns:
+                assignments.append('availability_status = ?')
+                params.append(availability_status(card_columns['availability']))
+            if extra_columns:
+                extra = json.loads(extra_json)
+                extra.update({column: _to_sql_value(value) for column, value in extra_columns.items()})
+                assignments.append('extra = ?')
+                params.append(json.dumps(extra, ensure_ascii=False))
+                self._add_frame_columns(conn, rarity, extra_columns)
+            if assignments:
+                conn.execute(f"UPDATE cards SET {', '.join(assignments)} WHERE id = ?", (*params, int(card_id)))
+
+    def _add_frame_columns(self, conn, rarity, new_columns):
+        columns = json.loads(conn.execute('SELECT columns FROM frame_columns WHERE rarity_key = ?', (rarity,)).fetchone()[0])
+        missing = [column for column in new_columns if column not in columns]
+        if missing:
+            conn.execute('UPDATE frame_columns SET columns = ? WHERE rarity_key = ?', (json.dumps(columns + missing, ensure_ascii=False), rarity))
+
+    def card_ids(self, rarity=None, **filters):
+        """条件に合うカードIDのリストを返す (例: card_ids('SSR', availability_status='pending', attribute='Unknown'))
+
+        条件に使える列は attribute / filter_category / availability_status で、いずれも索引がある。
+        """
+        allowed = {'attribute', 'filter_category', 'availability_status'}
+        unknown = set(filters) - allowed
+        if unknown:
+            raise ValueError(f"検索に使えない列です: {', '.join(sorted(unknown))}")
+        clauses, params = [], []
+        if rarity is not None:
+            clauses.append('rarity_key = ?')
+            params.append(rarity)
+        for column, value in filters.items():
+            if isinstance(value, (list, tuple, set)):
+                clauses.append(f"{column} IN ({', '.join('?' for _ in value)})")
+                params.extend(value)
+            else:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+        with self._lock:
+            return [row[0] for row in self._conn.execute(f'SELECT id FROM cards{where} ORDER BY id', params)]
+
+    def pending_availability_ids(self, rarity=None):
+        """入手方法が未取得または再取得対象のカードID"""
+        return self.card_ids(rarity, availability_status=[STATUS_PENDING, STATUS_RETRY])
+
+    def availability_jobs(self, rarity, include_done=False):
+        """詳細ページの取得対象のカードの (id, detail_url, availability) のリストを、CSVと同じ並び順で返す
+
+        未取得・再取得対象のカードは availability_status の索引で引く。include_done=True なら取得済みのカードも含める。
+        """
+        if include_done:
+            where, params = 'rarity_key = ?', (rarity,)
+        else:
+            where, params = 'availability_status IN (?, ?) AND rarity_key = ?', (STATUS_PENDING, STATUS_RETRY, rarity)
+        with self._lock:
+            return [
+                (card_id, detail_url, availability)
+                for card_id, detail_url, availability in self._conn.execute(
+                    f'SELECT id, detail_url, availability FROM cards WHERE {where} ORDER BY position', params
+                )
+            ]
+
+    def count_by(self, column):
+        """列の値ごとの件数 {(rarity_key, 値): 件数} を返す"""
+        if column not in {'attribute', 'filter_category', 'availability_status'}:
+            raise ValueError(f"集計に使えない列です: {column}")
+        with self._lock:
+            cursor = self._conn.execute(f'SELECT rarity_key, {column}, COUNT(*) FROM cards GROUP BY rarity_key, {column}')
+            return {(rarity, value): count for rarity, value, count in cursor}
+
+    def export_csvs(self, directory=CSV_DIRECTORY, rarities=None):
+        """データベースの内容からレアリティ別CSVを書き出し、書き出したパスのリストを返す"""
+        os.makedirs(directory, exist_ok=True)
+        written = []
+        for rarity in rarities or self.rarities():
+            csv_path = os.path.join(directory, RARITY_INFO[rarity]["filename"])
+            write_csv_atomic(self.read_frame(rarity), csv_path)
+            written.append(csv_path)
+        return written
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def add_database_argument(parser):
+    """各スクリプト共通の --db オプションを追加する"""
+    parser.add_argument(
+        "--db", default=None,
+        help="カードデータベース (SQLite, card_db.py) を読み書きします。データベースにないレアリティはCSVから取り込み、"
+             "CSVはデータベースの内容から書き出します。"
+    )
+
+
+def open_database_from_args(args):
+    """--db が指定されていれば CardDatabase を開いて返す (指定がなければ None)"""
+    return CardDatabase(args.db) if args.db else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="カードデータベース (SQLite) の作成・CSVへの書き出し・状況確認を行います。")
+    parser.add_argument("--db", default=CARD_DATABASE_FILE, help=f"データベースのパス (デフォルト: {CARD_DATABASE_FILE})")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="レアリティ別CSVをデータベースに取り込みます (CSVのあるレアリティは既存の内容を置き換えます)。")
+    import_parser.add_argument("--csv-dir", default=CSV_DIRECTORY, help=f"CSVのディレクトリ (デフォルト: {CSV_DIRECTORY})")
+    export_parser = subparsers.add_parser("export", help="データベースの内容からレアリティ別CSVを書き出します。")
+    export_parser.add_argument(
+        "--out", nargs='+', default=[CSV_DIRECTORY],
+        help=f"書き出し先のディレクトリ (複数指定可, 例: . ../public/data/csv, デフォルト: {CSV_DIRECTORY})"
+    )
+    subparsers.add_parser("status", help="レアリティ別の入手方法の取得状況・属性・カテゴリの件数を表示します。")
+    pending_parser = subparsers.add_parser("pending", help="入手方法が未取得または再取得対象のカードIDを表示します。")
+    pending_parser.add_argument("-r", "--rarity", choices=RARITY_INFO.keys(), default=None)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    start_profile_from_args(args, 'card_db')
+
+    if args.command != "import" and not os.path.exists(args.db):
+        print(f"データベースが見つかりません: {args.db}。先に import を実行してください。")
+        return
+
+    with CardDatabase(args.db) as db:
+        if args.command == "import":
+            # CSVが見つからないレアリティは取り込まない (保存済みの行はそのまま残す)
+            imported = db.import_csvs(args.csv_dir, replace=True)
+            if not imported:
+                print(f"エラー: {args.csv_dir} にレアリティ別CSVが見つかりません。")
+                sys.exit(1)
+            for rarity in imported:
+                print(f"{rarity}: {len(db.card_ids(rarity))} 件を取り込みました。")
+        elif args.command == "export":
+            for directory in args.out:
+                for csv_path in db.export_csvs(directory):
+                    print(f"{csv_path} を書き出しました。")
+        elif args.command == "status":
+            for column in ('availability_status', 'attribute', 'filter_category'):
+                print(f"\n--- {column} ---")
+                for (rarity, value), count in sorted(db.count_by(column).items(), key=lambda item: (item[0][0], str(item[0][1]))):
+                    print(f"  {rarity:<4} {value}: {count} 件")
+        elif args.command == "pending":
+            card_ids = db.pending_availability_ids(args.rarity)
+            print(f"入手方法が未取得または再取得対象のカード: {len(card_ids)} 件")
+            for card_id in card_ids:
+                print(card_id)
+
+
+if __name__ == "__main__":
+    main()
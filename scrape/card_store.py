@@ -0,0 +1,123 @@
+import os
+
+import pandas as pd
+
+from csv_io import write_csv_atomic, read_csv
+
+# --- 設定項目 ---
+# CSVファイルが保存されているディレクトリ
+CSV_DIRECTORY = '.'
+# --- ここまで設定項目 ---
+
+# レアリティごとのCSVファイル・画像ディレクトリ・表記 (各スクリプトの設定と同じ値)
+RARITY_INFO = {
+    "SSR": {"filename": "cgss_ssr_card_list.csv", "subdir": "SSR", "rarity_label": "SSレア", "is_N_or_R": False},
+    "SR": {"filename": "cgss_sr_card_list.csv", "subdir": "SR", "rarity_label": "Sレア", "is_N_or_R": False},
+    "R": {"filename": "cgss_r_card_list.csv", "subdir": "R", "rarity_label": "レア", "is_N_or_R": True},
+    "N": {"filename": "cgss_n_card_list.csv", "subdir": "N", "rarity_label": "ノーマル", "is_N_or_R": True},
+}
+
+# カードCSVの列定義 (列名 → dtype)。この順で並べ、ここにない列 (detail_* など) はその後ろに残す
+#   id は整数、それ以外は文字列 (未設定は pd.NA) として扱う
+CARD_SCHEMA = {
+    'id': 'int64',
+    'name': object,
+    'rarity': object,
+    'image_url': object,
+    'detail_url': object,
+    'attribute': object,
+    'availability': object,
+    'filter_category': object,
+}
+# スクレイピング直後から必ず存在する列
+REQUIRED_COLUMNS = ['id', 'name', 'rarity', 'image_url', 'detail_url']
+# 再取得の対象とする availability の値 (未取得・エラーを表す)
+RETRY_AVAILABILITY_VALUES = ["取得失敗", "情報なし", "解析エラー", "未取得", "URL無効", "ページ取得失敗"]
+
+
+def apply_schema(df):
+    """DataFrame を CARD_SCHEMA の型と列順にそろえる (足りない列は pd.NA で追加する)"""
+    df = df.copy()
+    for column, dtype in CARD_SCHEMA.items():
+        if column not in df.columns:
+            if column in REQUIRED_COLUMNS:
+                raise ValueError(f"カードデータに必須の列 '{column}' がありません")
+            df[column] = pd.Series(pd.NA, index=df.index, dtype=object)
+        elif dtype == 'int64':
+            df[column] = pd.to_numeric(df[column]).astype('int64')
+        else:
+            values = df[column].astype(object)
+            df[column] = values.where(values.notna(), pd.NA)
+    extra_columns = [column for column in df.columns if column not in CARD_SCHEMA]
+    return df[list(CARD_SCHEMA) + extra_columns]
+
+
+class CardStore:
+    """全レアリティのカードデータをメモリ上に保持する
+
+    load() で各CSVを1回だけ読み込み、各処理ステージは frames の DataFrame を直接更新する。
+    更新したレアリティは mark_dirty() しておき、最後に save() で変更のあったCSVだけを1回ずつ書き出す。
+    database (card_db.CardDatabase) を渡した場合はCSVの代わりにデータベースから読み込み、データベースに保存する。
+    """
+
+    def __init__(self, directory=CSV_DIRECTORY, database=None):
+        self.directory = directory
+        self.database = database
+        self.frames = {}
+        self._dirty = set()
+
+    def path_for(self, rarity):
+        return os.path.join(self.directory, RARITY_INFO[rarity]["filename"])
+
+    @classmethod
+    def load(cls, directory=CSV_DIRECTORY, rarities=None, database=None):
+        store = cls(directory, database=database)
+        stored_rarities = set(database.rarities()) if database is not None else set()
+        for rarity in rarities or RARITY_INFO:
+            if rarity in stored_rarities:
+                store.frames[rarity] = database.read_frame(rarity)
+                continue
+            csv_path = store.path_for(rarity)
+            if not os.path.exists(csv_path):
+                print(f"CSVファイルが見つかりません: {csv_path}。空のデータから始めます。")
+                store.frames[rarity] = apply_schema(pd.DataFrame(columns=REQUIRED_COLUMNS))
+            else:
+                store.frames[rarity] = apply_schema(read_csv(csv_path))
+            if database is not None:
+                # データベースにまだないレアリティはCSVから取り込んでおく
+                database.write_frame(rarity, store.frames[rarity])
+        return store
+
+    def rarities(self):
+        return list(self.frames)
+
+    def get(self, rarity):
+        return self.frames[rarity]
+
+    def set(self, rarity, df):
+        """レアリティの DataFrame を差し替える (行の追加などで新しい DataFrame になった場合)"""
+        self.frames[rarity] = df
+        self.mark_dirty(rarity)
+
+    def mark_dirty(self, rarity):
+        self._dirty.add(rarity)
+
+    def save(self):
+        """変更のあったレアリティを書き出し、書き出したCSVのパスのリストを返す
+
+        CSVは一時ファイル経由で置き換える。database がある場合はデータベースに保存してから
+        データベースの内容でCSVを書き出す (フロントエンドが読み込むのはCSV)。
+        """
+        written = []
+        for rarity in self.frames:
+            if rarity not in self._dirty:
+                continue
+            csv_path = self.path_for(rarity)
+            if self.database is not None:
+                self.database.write_frame(rarity, self.frames[rarity])
+                self.database.export_csvs(self.directory, rarities=[rarity])
+            else:
+                write_csv_atomic(self.frames[rarity], csv_path)
+            written.append(csv_path)
+        self._dirty.clear()
+        return written
@@ -1,8 +1,18 @@
 import pandas as pd
 import os
-import re
+import sys
+import argparse
+import json
 from collections import Counter
 
+from filter_rules import load_rule_table, RULE_TABLE_FILE
+import legacy_filter_category
+from csv_io import read_csv, write_csv_atomic
+from card_db import add_database_argument, open_database_from_args
+from atomic_io import atomic_write
+import profiling
+from profiling import add_profile_arguments, start_profile_from_args
+
 # --- 設定項目 ---
 CSV_DIRECTORY = '.'
 RARITY_CSV_FILES_INFO = {
@@ -12,152 +22,126 @@ RARITY_CSV_FILES_INFO = {
     "N": {"filename": "cgss_n_card_list.csv", "is_N_or_R": True},
 }
 OUTPUT_COLUMN_NAME = 'filter_category'
+# 入手方法の文字列ごとの判定結果を保存するキャッシュファイル (CSV_DIRECTORY 内)
+CATEGORY_CACHE_FILENAME = 'filter_category_cache.json'
 # --- ここまで設定項目 ---
 
+_rule_table = None
+
+def use_rule_table(path=RULE_TABLE_FILE):
+    """判定に使うルール表 (JSON) を読み込んで切り替える"""
+    global _rule_table
+    _rule_table = load_rule_table(path)
+    return _rule_table
+
+def get_rule_table():
+    """判定に使うルール表を返す (未読み込みならデフォルトのルール表を読み込む)"""
+    if _rule_table is None:
+        return use_rule_table()
+    return _rule_table
+
 def normalize_text_for_filter(text):
-    if pd.isna(text):
-        return ""
-    text = str(text)
-    text = text.lower()
-    text = re.sub(r'\s+', ' ', text).strip()
-    text = text.replace("プラチナオーディションガシャ", "プラチナガシャ")
-    text = text.replace("ライブ", "live")
-    return text
+    return get_rule_table().normalize(text)
 
 def determine_filter_category(availability_text_original, is_card_N_or_R):
-    if pd.isna(availability_text_original) or not str(availability_text_original).strip():
-        # availabilityが空またはNaNの場合、レアリティに関わらず「恒常」（初期カード等と想定）
-        return "恒常"
-
-    text = normalize_text_for_filter(availability_text_original)
-    original_text_for_gacha_name_check = str(availability_text_original)
-
-    # --- 優先的に判定する特殊ケース ---
-    collab_event_names = [
-        "ハーモニクス", "ももクロ×デレステコラボイベント", "星街すいせい×デレステコラボ"
-    ]
-    if any(collab_event.lower() in text for collab_event in collab_event_names):
-        return "イベント報酬(コラボ)"
-    if "stage for cinderellaガシャ" in text:
-        return "期間限定ガシャ"
-    if "4/1限定コミュ" in text:
-        return "イベント報酬"
-    if "＜イベント限定アイドル＞" in availability_text_original:
-        return "イベント報酬"
-    if "コラボガシャ" in text and "＜期間限定アイドル＞" in availability_text_original:
-        return "期間限定ガシャ(コラボ)"
-
-    # --- 通常の判定ロジック ---
-    fes_keywords = ["シンデレラフェス", "フェス限定", "ノワール限定", "ブラン限定", "ドミナントガシャ"]
-    if any(kw in text for kw in fes_keywords):
-        if "復刻" in text:
-            return "フェス限定(復刻)"
-        return "フェス限定"
-
-    event_keywords = [
-        "イベント", "報酬", "ランキング", "ポイント", "メダル", "live carnival", "live groove",
-        "live parade", "シンデレラキャラバン", "ススメ！シンデレラロード", "アイドルプロデュース",
-        "live infinity"
-    ]
-    specific_event_reward_patterns = ["＜カーニバルメダルチャンス報酬＞", "ポイント報酬", "ランキング報酬", "メダル交換", "期間中のlive報酬", "達成pt報酬", "動員数報酬", "map報酬", "課題クリア報酬", "イベントpt報酬", "イベント参加報酬"]
-    event_name_pattern_general = r'イベント「.*?」'
-    is_gacha_by_keyword = "ガシャ" in text or "gacha" in text or "スカウト" in text
-
-    if not is_gacha_by_keyword and \
-       (any(kw in text for kw in event_keywords) or \
-        any(specific_event_reward_pattern in availability_text_original for specific_event_reward_pattern in specific_event_reward_patterns) or \
-        (re.search(event_name_pattern_general, original_text_for_gacha_name_check, re.IGNORECASE) and not is_gacha_by_keyword) ):
-        return "イベント報酬"
-
-    limited_gacha_keywords = ["期間限定アイドル", "限定ガシャ", "期間限定"]
-    date_period_pattern = r'\d{4}/\d{1,2}/\d{1,2}\s*～\s*\d{4}/\d{1,2}/\d{1,2}|\d{4}年\d{1,2}月\d{1,2}日\s*～\s*\d{1,2}月\d{1,2}日|\(\s*\d{1,2}月\d{1,2}日\s*～\s*\d{1,2}月\d{1,2}日\s*\)|（\s*\d{1,2}月\d{1,2}日\s*～\s*\d{1,2}月\d{1,2}日\s*）|（初回：\d{4}年\d{1,2}月\d{1,2}日\s*～\s*\d{1,2}月\d{1,2}日\s*14:59）'
-    specific_gacha_name_patterns = [
-        "アニバーサリーパーティーガシャ", "バレンタイン", "クリスマス", "ハロウィン", "温泉ガシャ", "振袖ガシャ", "ブライダル", "サマーガシャ", "水着",
-        "ナイトタイムガシャ", "放課後タイムガシャ", "トラベルガシャ", "ストーリーガシャ", "セッションガシャ", "ギフトガシャ"
-    ]
-    is_limited_by_keyword_in_gacha_context = is_gacha_by_keyword and any(kw in text for kw in limited_gacha_keywords)
-    is_limited_by_date_period_in_gacha_context = is_gacha_by_keyword and bool(re.search(date_period_pattern, text))
-    is_limited_by_specific_gacha_name = is_gacha_by_keyword and any(pat.lower() in original_text_for_gacha_name_check.lower() for pat in specific_gacha_name_patterns)
-    if is_limited_by_keyword_in_gacha_context or is_limited_by_date_period_in_gacha_context or is_limited_by_specific_gacha_name:
-        if "復刻" in text:
-            return "期間限定ガシャ(復刻)"
-        return "期間限定ガシャ"
-
-    if "初期選択" in text or "ローカルガシャ" in text:
-        return "恒常"
-    if "プラチナガシャ" in text:
-        return "恒常"
-        
-    # N/R CSV のカードで、availability が空でなく、かつ上記ルールに合致しなかった場合も「恒常」
-    if is_card_N_or_R:
-        return "恒常"
+    """1件の入手方法からフィルターカテゴリを判定する (ルール表 filter_rules.json に従う)"""
+    category, _ = get_rule_table().classify(availability_text_original, is_card_N_or_R)
+    return category
 
-    return "不明"
+def classify_filter_categories(availability, is_card_N_or_R):
+    """determine_filter_category を列単位にしたもの
 
+    異なる入手方法の文字列ごとに1回だけ判定し、結果を各行に展開する。
+    is_card_N_or_R は bool または availability と同じ長さの bool の Series。
+    """
+    categories, _ = get_rule_table().classify_series(availability, is_card_N_or_R)
+    return categories
 
-def main():
-    for rarity_key, file_info in RARITY_CSV_FILES_INFO.items():
-        csv_filename = file_info["filename"]
-        is_N_or_R_file = file_info["is_N_or_R"]
 
-        csv_filepath = os.path.join(CSV_DIRECTORY, csv_filename)
-        if not os.path.exists(csv_filepath):
-            print(f"CSVファイルが見つかりません: {csv_filepath}。スキップします。")
-            continue
+def compute_rules_hash():
+    """判定ルールのバージョンを表すハッシュ
 
-        print(f"\n--- {csv_filename} のフィルターカテゴリを処理中 ---")
-        try:
-            df = pd.read_csv(csv_filepath)
-        except Exception as e:
-            print(f"  エラー: CSVファイルの読み込みに失敗 ({csv_filepath}): {e}")
-            continue
-        
-        if 'availability' not in df.columns:
-            print(f"  エラー: CSVファイルに 'availability' 列が見つかりません: {csv_filename}。スキップします。")
-            continue
+    ルール表と判定エンジンのハッシュ (filter_rules.load_rule_table 参照)。
+    ルールを変更すると値が変わり、保存済みの判定結果は自動的に破棄される。
+    """
+    return get_rule_table().version_hash
 
-        if OUTPUT_COLUMN_NAME not in df.columns:
-            df[OUTPUT_COLUMN_NAME] = "不明"
-        else:
-            df[OUTPUT_COLUMN_NAME] = df[OUTPUT_COLUMN_NAME].replace('', "不明").fillna("不明")
 
-        applied_count = 0
-        changed_to_specific_count = 0
+class CategoryMemo:
+    """入手方法の文字列 + N/Rフラグ をキーに判定結果をメモ化し、ファイルに保存する
 
-        for index, row in df.iterrows():
-            availability_text = row['availability']
-            current_category_in_df = df.loc[index, OUTPUT_COLUMN_NAME]
-            
-            new_category = determine_filter_category(availability_text, is_N_or_R_file)
-            
-            if current_category_in_df != new_category:
-                df.loc[index, OUTPUT_COLUMN_NAME] = new_category
-                applied_count += 1
-                if new_category != "不明" and (current_category_in_df == "不明" or pd.isna(current_category_in_df)):
-                    changed_to_specific_count +=1
-                elif new_category != "不明" and current_category_in_df != "不明" and current_category_in_df != new_category :
-                    changed_to_specific_count +=1
+    キーは正規化前の文字列そのもの (NAは空文字列) とする。
+    一部のルールは正規化前の文字列を見るため、正規化後の文字列をキーにすると結果が変わりうるため。
+    """
 
+    def __init__(self, path, rules_hash=None):
+        self.path = path
+        self.rules_hash = rules_hash or compute_rules_hash()
+        self.verdicts = {"N_or_R": {}, "SSR_or_SR": {}}
+        self.evaluated_count = 0
+        self.hit_count = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
         try:
-            df.to_csv(csv_filepath, index=False, encoding='utf-8-sig')
-            print(f"  {csv_filename} を更新しました。{applied_count} 件のカテゴリが変更され、うち {changed_to_specific_count} 件が具体的なカテゴリに設定/更新されました。")
-        except Exception as e:
-            print(f"  CSVファイルへの書き込みエラー ({csv_filepath}): {e}")
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"  判定キャッシュの読み込みに失敗したため作り直します ({self.path}): {e}")
+            return
+        if data.get('rules_hash') != self.rules_hash:
+            print(f"  判定ルールが変更されているため、判定キャッシュ ({self.path}) を破棄します。")
+            return
+        for group in self.verdicts:
+            self.verdicts[group].update(data.get('verdicts', {}).get(group, {}))
 
-    print("\n全てのCSVファイルのフィルターカテゴリ割り当て処理が完了しました。")
+    def categorize(self, availability, is_card_N_or_R):
+        """classify_filter_categories と同じ結果を返す。キャッシュにない文字列だけを判定する"""
+        keys = availability.astype(object).where(availability.notna(), "").astype(str)
+        table = self.verdicts["N_or_R" if is_card_N_or_R else "SSR_or_SR"]
+        unique_keys = pd.unique(keys)
+        missing = [key for key in unique_keys if key not in table]
+        if missing:
+            results = classify_filter_categories(pd.Series(missing, dtype=object), is_card_N_or_R)
+            table.update(zip(missing, results))
+        self.evaluated_count += len(missing)
+        self.hit_count += len(unique_keys) - len(missing)
+        return keys.map(table).astype(object)
+
+    def save(self):
+        data = {'rules_hash': self.rules_hash, 'verdicts': self.verdicts}
+        with atomic_write(self.path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
 
+
+def categorize_dataframe(df, is_card_N_or_R, memo=None):
+    """df の filter_category 列を availability 列から判定し直す
+
+    (変更されたカテゴリの件数, そのうち具体的なカテゴリ (「不明」以外) になった件数) を返す。
+    memo (CategoryMemo) を渡した場合は保存済みの判定結果を使う。
+    """
+    if OUTPUT_COLUMN_NAME not in df.columns:
+        df[OUTPUT_COLUMN_NAME] = "不明"
+    else:
+        df[OUTPUT_COLUMN_NAME] = df[OUTPUT_COLUMN_NAME].replace('', "不明").fillna("不明")
+
+    with profiling.stage('determine_filter_category'):
+        if memo:
+            new_categories = memo.categorize(df['availability'], is_card_N_or_R)
+        else:
+            new_categories = classify_filter_categories(df['availability'], is_card_N_or_R)
+    changed = df[OUTPUT_COLUMN_NAME].astype(object).to_numpy() != new_categories.to_numpy()
+    applied_count = int(changed.sum())
+    changed_to_specific_count = int((changed & (new_categories.to_numpy() != "不明")).sum())
+    df[OUTPUT_COLUMN_NAME] = new_categories
+    return applied_count, changed_to_specific_count
+
+def print_category_summary(frames):
+    """カテゴリ別件数と「不明」カテゴリの詳細などを表示する (frames は DataFrame のリスト)"""
     print("\n--- カテゴリ別件数 (全CSV合計) ---")
-    all_df_list = []
-    for file_info in RARITY_CSV_FILES_INFO.values():
-        csv_filepath = os.path.join(CSV_DIRECTORY, file_info["filename"])
-        if os.path.exists(csv_filepath):
-            try:
-                df_temp = pd.read_csv(csv_filepath)
-                if OUTPUT_COLUMN_NAME in df_temp.columns:
-                    all_df_list.append(df_temp)
-            except Exception as e:
-                print(f"  集計用CSV読み込みエラー ({file_info['filename']}): {e}")
-    
+    all_df_list = [df for df in frames if OUTPUT_COLUMN_NAME in df.columns]
     if all_df_list:
         combined_df = pd.concat(all_df_list, ignore_index=True)
         print(combined_df[OUTPUT_COLUMN_NAME].value_counts(dropna=False))
@@ -193,5 +177,155 @@ def main():
     else:
         print("集計できるCSVデータがありませんでした。")
 
+def trace_rules():
+    """全CSVの全カードについて、どのルールが適用されたかを表示する (CSVは更新しない)"""
+    rule_counts = Counter()
+    for rarity_key, file_info in RARITY_CSV_FILES_INFO.items():
+        csv_filepath = os.path.join(CSV_DIRECTORY, file_info["filename"])
+        if not os.path.exists(csv_filepath):
+            continue
+        df = read_csv(csv_filepath)
+        if 'availability' not in df.columns:
+            continue
+        print(f"\n--- {file_info['filename']} ---")
+        categories, rule_names = get_rule_table().classify_series(df['availability'], file_info["is_N_or_R"])
+        for index, availability_text in df['availability'].items():
+            rule_counts[(rule_names[index], categories[index])] += 1
+            print(f"- ID: {df.loc[index, 'id']}, ルール: {rule_names[index]}, カテゴリ: {categories[index]}, Availability: {str(availability_text)[:60]}")
+
+    print("\n--- ルール別の適用件数 ---")
+    for (rule_name, category), count in rule_counts.most_common():
+        print(f"- {rule_name} -> {category}: {count} 件")
+
+def check_parity():
+    """全CSVの全行で、ルール表による判定 (列単位の classify_filter_categories と1件ずつの determine_filter_category) が
+    ルール表に移す前のハードコードされた判定 (legacy_filter_category) と一致するか確認する"""
+    total_rows = 0
+    mismatches = []
+    for rarity_key, file_info in RARITY_CSV_FILES_INFO.items():
+        csv_filepath = os.path.join(CSV_DIRECTORY, file_info["filename"])
+        if not os.path.exists(csv_filepath):
+            continue
+        df = read_csv(csv_filepath)
+        if 'availability' not in df.columns:
+            continue
+        vectorized = classify_filter_categories(df['availability'], file_info["is_N_or_R"])
+        for index, availability_text in df['availability'].items():
+            expected = legacy_filter_category.determine_filter_category(availability_text, file_info["is_N_or_R"])
+            scalar = determine_filter_category(availability_text, file_info["is_N_or_R"])
+            if vectorized[index] != expected or scalar != expected:
+                mismatches.append((rarity_key, df.loc[index, 'id'], availability_text, expected, vectorized[index], scalar))
+        total_rows += len(df)
+
+    print(f"{total_rows} 行を比較しました。不一致: {len(mismatches)} 件")
+    for rarity_key, card_id, availability_text, expected, vectorized, scalar in mismatches[:20]:
+        print(f"- {rarity_key} ID: {card_id}, 期待値: {expected}, 列単位: {vectorized}, 1件ずつ: {scalar}, Availability: {availability_text}")
+    return not mismatches
+
+def main():
+    parser = argparse.ArgumentParser(description="availability 列からフィルター用のカテゴリ (filter_category 列) を割り当てます。")
+    parser.add_argument(
+        "--check-parity",
+        action="store_true",
+        help="CSVを更新せず、ルール表による判定 (列単位・1件ずつ) がルール表に移す前のハードコードされた判定 "
+             "(legacy_filter_category.py) と全行で一致するか確認します。"
+    )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="CSVを更新せず、各カードにどの判定ルールが適用されたかを表示します。"
+    )
+    parser.add_argument(
+        "--rules",
+        default=RULE_TABLE_FILE,
+        help=f"判定ルール表 (JSON) のパス (デフォルト: {RULE_TABLE_FILE})"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help=f"保存済みの判定結果 ({CATEGORY_CACHE_FILENAME}) を使わずに全行を判定し直します。"
+    )
+    add_database_argument(parser)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    start_profile_from_args(args, 'categorize_availability')
+    try:
+        use_rule_table(args.rules)
+    except (OSError, ValueError) as e:
+        print(f"エラー: 判定ルール表の読み込みに失敗しました ({args.rules}): {e}")
+        sys.exit(1)
+
+    if args.check_parity:
+        sys.exit(0 if check_parity() else 1)
+    if args.trace:
+        trace_rules()
+        return
+
+    memo = None
+    if not args.no_cache:
+        memo = CategoryMemo(os.path.join(CSV_DIRECTORY, CATEGORY_CACHE_FILENAME))
+
+    # --db 指定時はデータベースから読み込み、判定結果が変わった行だけをデータベースに書き込む
+    database = open_database_from_args(args)
+    stored_rarities = set()
+    if database is not None:
+        database.import_csvs(CSV_DIRECTORY)
+        stored_rarities = set(database.rarities())
+
+    processed_frames = []
+    for rarity_key, file_info in RARITY_CSV_FILES_INFO.items():
+        csv_filename = file_info["filename"]
+        is_N_or_R_file = file_info["is_N_or_R"]
+
+        csv_filepath = os.path.join(CSV_DIRECTORY, csv_filename)
+        if database is not None:
+            if rarity_key not in stored_rarities:
+                print(f"データベースに {rarity_key} のカードがありません: {database.path}。スキップします。")
+                continue
+            print(f"\n--- {rarity_key} のフィルターカテゴリを処理中 (データベース: {database.path}) ---")
+            df = database.read_frame(rarity_key)
+        else:
+            if not os.path.exists(csv_filepath):
+                print(f"CSVファイルが見つかりません: {csv_filepath}。スキップします。")
+                continue
+
+            print(f"\n--- {csv_filename} のフィルターカテゴリを処理中 ---")
+            try:
+                df = read_csv(csv_filepath)
+            except Exception as e:
+                print(f"  エラー: CSVファイルの読み込みに失敗 ({csv_filepath}): {e}")
+                continue
+        
+        if 'availability' not in df.columns:
+            print(f"  エラー: CSVファイルに 'availability' 列が見つかりません: {csv_filename}。スキップします。")
+            continue
+
+        applied_count, changed_to_specific_count = categorize_dataframe(df, is_N_or_R_file, memo)
+        processed_frames.append(df)
+
+        try:
+            if database is not None:
+                database.write_frame(rarity_key, df)
+                database.export_csvs(CSV_DIRECTORY, [rarity_key])
+            else:
+                write_csv_atomic(df, csv_filepath)
+            print(f"  {csv_filename} を更新しました。{applied_count} 件のカテゴリが変更され、うち {changed_to_specific_count} 件が具体的なカテゴリに設定/更新されました。")
+        except Exception as e:
+            print(f"  CSVファイルへの書き込みエラー ({csv_filepath}): {e}")
+
+    if database is not None:
+        database.close()
+
+    if memo:
+        try:
+            memo.save()
+            print(f"\n判定キャッシュ: 新規判定 {memo.evaluated_count} 件, キャッシュ利用 {memo.hit_count} 件 ({memo.path})")
+        except Exception as e:
+            print(f"\n判定キャッシュの保存に失敗しました ({memo.path}): {e}")
+
+    print("\n全てのCSVファイルのフィルターカテゴリ割り当て処理が完了しました。")
+
+    print_category_summary(processed_frames)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
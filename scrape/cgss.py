@@ -0,0 +1,144 @@
+import importlib
+import sys
+
+# サブコマンドを連結するときの区切り (例: python cgss.py availability -w 8 + categorize + analyze)
+CHAIN_SEPARATOR = '+'
+
+# サブコマンド → (実行するモジュール, 説明)
+# モジュールはそのサブコマンドを実行するときに初めて import する (pandas / requests / bs4 の読み込みを遅らせる)
+COMMANDS = {
+    'scrape': ('scrape_cgss', "一覧ページからレアリティ別CSVを作成・更新します (scrape_cgss.py)"),
+    'attributes': ('collect_attribute_card_ids', "属性別一覧からカードIDを集め、CSVの attribute 列を更新します "
+                                                 "(collect_attribute_card_ids.py → update_csv_with_attributes.py)"),
+    'availability': ('add_availability_to_csv', "詳細ページから入手方法などを取得します (add_availability_to_csv.py)"),
+    'categorize': ('categorize_availability', "入手方法からフィルターカテゴリを判定します (categorize_availability.py)"),
+    'images': ('download_cgss_images_cli', "カード画像をダウンロードします (download_cgss_images_cli.py)"),
+    'analyze': ('analyze_availability', "入手方法を集計します (analyze_availability.py)"),
+    'all': ('run_pipeline', "全ステージをCSVの読み書き1回で続けて実行します (run_pipeline.py)"),
+}
+
+
+def usage():
+    lines = [
+        "使い方: python cgss.py <サブコマンド> [オプション...] [+ <サブコマンド> [オプション...] ...]",
+        "",
+        "サブコマンド:",
+    ]
+    lines += [f"  {name:<13} {description}" for name, (_, description) in COMMANDS.items()]
+    lines += [
+        "",
+        "各サブコマンドのオプションは python cgss.py <サブコマンド> --help で表示します (元のスクリプトと同じオプション)。",
+        f"'{CHAIN_SEPARATOR}' で区切ると複数のサブコマンドを1つのプロセスで順に実行します。",
+    ]
+    return '\n'.join(lines)
+
+
+def call_main(module, name, argv):
+    """module.main() を、コマンドライン引数が argv であるかのように呼び出し、終了コードを返す"""
+    saved_argv = sys.argv
+    sys.argv = [f"cgss.py {name}"] + list(argv)
+    try:
+        module.main()
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        print(e.code, file=sys.stderr)
+        return 1
+    finally:
+        sys.argv = saved_argv
+    return 0
+
+
+def profile_arguments(argv):
+    """argv から --profile / --profile-dir だけを取り出す"""
+    return pick_arguments(argv, ['--profile'], ['--profile-dir'])[0]
+
+
+def pick_arguments(argv, flags, value_options):
+    """argv を (flags・value_options のオプション, それ以外) に分ける (value_options は値を1つ取る)"""
+    picked, rest = [], []
+    index = 0
+    while index < len(argv):
+        arg = argv[index]
+        if arg in flags or any(arg.startswith(option + '=') for option in value_options):
+            picked.append(arg)
+        elif arg in value_options and index + 1 < len(argv):
+            picked += [arg, argv[index + 1]]
+            index += 1
+        else:
+            rest.append(arg)
+        index += 1
+    return picked, rest
+
+
+def run_attributes(argv):
+    """属性別一覧の収集 (--reuse-attribute-map で省略) と、CSVへの属性の割り当てを続けて実行する
+
+    オプションは収集側 (collect_attribute_card_ids.py) のもの。割り当て側には --profile 関連と --db だけを渡す。
+    """
+    reuse_map = '--reuse-attribute-map' in argv
+    argv = [arg for arg in argv if arg != '--reuse-attribute-map']
+    database_argv, argv = pick_arguments(argv, [], ['--db'])
+    if '-h' in argv or '--help' in argv:
+        print("attributes 独自のオプション:\n  --reuse-attribute-map  属性別一覧をクロールせず、保存済みの attribute_card_ids.json を使います。\n"
+              "  --db DB                カードデータベース (card_db.py) の attribute 列を更新し、CSVを書き出します。\n")
+        return call_main(importlib.import_module('collect_attribute_card_ids'), 'attributes', ['--help'])
+    if not reuse_map:
+        status = call_main(importlib.import_module('collect_attribute_card_ids'), 'attributes', argv)
+        if status:
+            return status
+    return call_main(importlib.import_module('update_csv_with_attributes'), 'attributes', profile_arguments(argv) + database_argv)
+
+
+def run_command(name, argv):
+    if name == 'attributes':
+        return run_attributes(argv)
+    module = importlib.import_module(COMMANDS[name][0])
+    return call_main(module, name, argv)
+
+
+def split_chain(argv):
+    """'+' で区切られたコマンドラインを [(サブコマンド, 引数のリスト), ...] に分ける"""
+    chain = []
+    current = []
+    for arg in list(argv) + [CHAIN_SEPARATOR]:
+        if arg != CHAIN_SEPARATOR:
+            current.append(arg)
+            continue
+        if current:
+            chain.append((current[0], current[1:]))
+        current = []
+    return chain
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage())
+        return 0 if argv else 2
+
+    chain = split_chain(argv)
+    unknown = [name for name, _ in chain if name not in COMMANDS]
+    if unknown:
+        print(f"不明なサブコマンドです: {', '.join(unknown)}\n", file=sys.stderr)
+        print(usage(), file=sys.stderr)
+        return 2
+
+    for index, (name, command_argv) in enumerate(chain):
+        if len(chain) > 1:
+            print(f"\n===== cgss {name} ({index + 1}/{len(chain)}) =====")
+            # 各スクリプトが書き出すメトリクスを、そのサブコマンドの分だけにする
+            importlib.import_module('metrics').REGISTRY.reset()
+        status = run_command(name, command_argv)
+        if 'profiling' in sys.modules:
+            # --profile の結果もサブコマンドごとに書き出す
+            sys.modules['profiling'].finish_profile()
+        if status:
+            if len(chain) > 1:
+                print(f"cgss {name} が終了コード {status} で終了したため、残りのサブコマンドは実行しません。", file=sys.stderr)
+            return status
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+import json
+import os
+import threading
+
+# ジャーナルファイルの拡張子 (対象CSVのパスの後ろに付ける)
+JOURNAL_SUFFIX = '.journal.jsonl'
+
+
+class CheckpointJournal:
+    """処理結果を1件ずつ追記する先行書き込みジャーナル (append-only JSONL)
+
+    1行が1件の結果 {"key": ..., "values": {...}}。同じキーが複数回あれば後の行が優先される。
+    処理が途中で止まっても、次回は load() で完了済みの結果を復元して続きから再開できる。
+    途中で切れた最終行 (書き込み中の強制終了) は読み込み時に無視する。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    @classmethod
+    def for_csv(cls, csv_path):
+        return cls(csv_path + JOURNAL_SUFFIX)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        """ジャーナルの内容を {key: values} の辞書として返す"""
+        entries = {}
+        if not self.exists():
+            return entries
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                entries[str(record['key'])] = record['values']
+        return entries
+
+    def append(self, key, values):
+        """1件の結果を追記し、ディスクまで書き出す"""
+        line = json.dumps({'key': str(key), 'values': values}, ensure_ascii=False)
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(line + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def discard(self):
+        """CSVへの反映が完了したジャーナルを削除する"""
+        self.close()
+        if self.exists():
+            os.remove(self.path)
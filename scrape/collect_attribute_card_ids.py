@@ -1,11 +1,22 @@
 import requests
-from bs4 import BeautifulSoup
 import time
 import pandas as pd
 from urllib.parse import urljoin, urlparse
 import json # JSON保存用
+import argparse
+
+import metrics
+from metrics import add_metrics_arguments, dump_metrics_from_args
+import profiling
+from profiling import add_profile_arguments, start_profile_from_args
+from http_client import PoliteClient, USER_AGENT, record_response, record_request_error, add_adaptive_arguments, adaptive_options_from_args
+from http_cache import add_cache_arguments, wrap_client_from_args
+from html_parsing import make_soup, add_parser_argument, set_parser_backend
 
 BASE_URL = "https://imas.gamedbs.jp"
+ATTRIBUTE_ID_MAP_FILE = "attribute_card_ids.json"
+# 一覧ページのリクエスト数/秒 (ページ間1秒の待機に相当, 自動調整ではその初期値)
+CRAWL_RATE_PER_SECOND = 1.0
 
 # 属性ごとの情報を定義 (URLを更新)
 ATTRIBUTE_TARGETS = {
@@ -23,22 +34,36 @@ ATTRIBUTE_TARGETS = {
     }
 }
 
-def get_soup(url):
-    try:
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-        response = requests.get(url, headers=headers, timeout=15)
-        response.raise_for_status()
-        return BeautifulSoup(response.content, 'html.parser')
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching {url}: {e}")
-        return None
-
-def extract_card_ids_from_page(page_url):
+def get_soup(url, client=None, page_kind=None):
+    with profiling.stage('get_soup'):
+        try:
+            # client (PoliteClient) のセッションは User-Agent に http_client.USER_AGENT を送る
+            if client:
+                response = client.get(url, timeout=15)
+            else:
+                start = time.perf_counter()
+                try:
+                    response = requests.get(url, headers={'User-Agent': USER_AGENT}, timeout=15)
+                except requests.exceptions.RequestException as e:
+                    record_request_error(url, e)
+                    raise
+                record_response(url, response, (time.perf_counter() - start) * 1000)
+            response.raise_for_status()
+            return make_soup(response.content, page_kind=page_kind)
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching {url}: {e}")
+            return None
+
+def extract_card_ids_from_page(page_url, client=None):
     """1ページ分のカードID (またはユニークキー) を抽出する"""
-    soup = get_soup(page_url)
+    soup = get_soup(page_url, client=client, page_kind='listing')
     if not soup:
         return [], None
+    with metrics.timer('extract_ms', page_kind='listing'):
+        return parse_card_ids(soup, page_url)
 
+def parse_card_ids(soup, page_url):
+    """一覧ページのSoupから (カードIDのリスト, 次ページのURL) を抽出する"""
     card_ids = set()
     card_list_ul = soup.select_one('ul.dblst.flexbox.flexwrap')
     if not card_list_ul:
@@ -74,54 +99,83 @@ def extract_card_ids_from_page(page_url):
             next_page_url = urljoin(page_url, next_href)
     return list(card_ids), next_page_url
 
-def collect_attribute_card_ids():
+def collect_single_attribute(attr_key, target_info, client=None):
+    """1属性分の一覧ページをたどり、カードIDの集合を返す
+
+    client を渡した場合はページ間の固定待機を行わず、client のレート制限に任せる。
+    """
+    print(f"\n--- Collecting card IDs for Attribute: {attr_key} ---")
+    current_url = target_info["url"]
+    page_num = 1
+    attribute_card_set = set()
+
+    while current_url:
+        print(f"Scraping page {page_num} for {attr_key}: {current_url}")
+        ids_on_page, next_url = extract_card_ids_from_page(current_url, client=client)
+
+        if ids_on_page:
+            attribute_card_set.update(ids_on_page)
+            print(f"  Found {len(ids_on_page)} IDs on this page. Total unique IDs for {attr_key}: {len(attribute_card_set)}")
+        elif page_num == 1:
+            print(f"  No cards found on the first page for {attr_key}.")
+
+        current_url = next_url
+        page_num += 1
+        if current_url and client is None:
+            # テスト用にページ数制限をかける場合
+            # if page_num >= 3: # 各属性2ページまで（テスト用）
+            #     print(f"  Reached page limit for {attr_key} testing.")
+            #     break
+            metrics.sleep(1, reason='page_interval')
+
+    print(f"Finished collecting for {attr_key}. Total {len(attribute_card_set)} unique card IDs found.")
+    return attribute_card_set
+
+def collect_attribute_card_ids(client=None):
     """各属性の全カードIDを収集する"""
     all_attribute_ids = {}
 
     for attr_key, target_info in ATTRIBUTE_TARGETS.items():
-        print(f"\n--- Collecting card IDs for Attribute: {attr_key} ---")
-        current_url = target_info["url"]
-        page_num = 1
-        attribute_card_set = set()
-
-        while current_url:
-            print(f"Scraping page {page_num} for {attr_key}: {current_url}")
-            ids_on_page, next_url = extract_card_ids_from_page(current_url)
-            
-            if ids_on_page:
-                attribute_card_set.update(ids_on_page)
-                print(f"  Found {len(ids_on_page)} IDs on this page. Total unique IDs for {attr_key}: {len(attribute_card_set)}")
-            elif page_num == 1:
-                print(f"  No cards found on the first page for {attr_key}.")
-            
-            current_url = next_url
-            page_num += 1
-            if current_url:
-                # テスト用にページ数制限をかける場合
-                # if page_num >= 3: # 各属性2ページまで（テスト用）
-                #     print(f"  Reached page limit for {attr_key} testing.")
-                #     break
-                time.sleep(1) 
-        
-        all_attribute_ids[attr_key] = attribute_card_set
-        print(f"Finished collecting for {attr_key}. Total {len(attribute_card_set)} unique card IDs found.")
-        
-        if attr_key != list(ATTRIBUTE_TARGETS.keys())[-1]:
+        all_attribute_ids[attr_key] = collect_single_attribute(attr_key, target_info, client=client)
+
+        if client is None and attr_key != list(ATTRIBUTE_TARGETS.keys())[-1]:
             print("Waiting 3 seconds before next attribute...")
-            time.sleep(3)
+            metrics.sleep(3, reason='attribute_interval')
 
     return all_attribute_ids
 
-if __name__ == "__main__":
-    attribute_id_map = collect_attribute_card_ids()
-
-    for attr, ids in attribute_id_map.items():
-        print(f"\nAttribute {attr} has {len(ids)} cards. First 5: {list(ids)[:5]}")
-
+def save_attribute_card_ids(attribute_id_map, path=ATTRIBUTE_ID_MAP_FILE):
+    """属性ごとのカードIDマップをJSONに保存する"""
     try:
-        with open("attribute_card_ids.json", "w", encoding="utf-8") as f:
+        with open(path, "w", encoding="utf-8") as f:
             json_friendly_map = {k: list(v) for k, v in attribute_id_map.items()}
             json.dump(json_friendly_map, f, ensure_ascii=False, indent=2)
-        print("\nAttribute card ID map saved to attribute_card_ids.json")
+        print(f"\nAttribute card ID map saved to {path}")
     except Exception as e:
-        print(f"\nError saving attribute card ID map to JSON: {e}")
\ No newline at end of file
+        print(f"\nError saving attribute card ID map to JSON: {e}")
+
+def main():
+    parser = argparse.ArgumentParser(description="属性別の一覧ページから全カードIDを収集し、attribute_card_ids.json に保存します。")
+    add_cache_arguments(parser)
+    add_parser_argument(parser)
+    add_adaptive_arguments(parser)
+    add_metrics_arguments(parser)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    set_parser_backend(args.parser)
+    start_profile_from_args(args, 'collect_attribute_card_ids')
+
+    # 固定の待機ではなく、実際にネットワークへ出るリクエストだけをレート制限する
+    # (--no-adaptive なら従来どおり1秒に1リクエスト、それ以外はサーバーの応答に合わせて調整する)
+    with PoliteClient(rate=CRAWL_RATE_PER_SECOND, max_per_host=1, **adaptive_options_from_args(args)) as polite_client:
+        client = wrap_client_from_args(args, polite_client)
+        attribute_id_map = collect_attribute_card_ids(client=client)
+
+    for attr, ids in attribute_id_map.items():
+        print(f"\nAttribute {attr} has {len(ids)} cards. First 5: {list(ids)[:5]}")
+
+    save_attribute_card_ids(attribute_id_map)
+    dump_metrics_from_args(args, 'collect_attribute_card_ids')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+import pandas as pd
+
+import metrics
+import profiling
+from atomic_io import atomic_write
+
+# 各スクリプト共通のCSV書き込みエンコーディング (Excelで開けるようBOM付き)
+CSV_ENCODING = 'utf-8-sig'
+
+
+def write_csv_atomic(df, csv_path, encoding=CSV_ENCODING):
+    """DataFrameを一時ファイルに書き出してから rename で置き換える
+
+    書き込み途中で処理が止まっても、既存のCSVが中途半端な内容になることはない。
+    権限は既存のCSVのもの (新しく作る場合は umask に従った通常の権限) を引き継ぐ。
+    """
+    with metrics.timer('csv_write_ms'), profiling.stage('csv_write'):
+        with atomic_write(csv_path, 'w', encoding=encoding, newline='') as f:
+            df.to_csv(f, index=False)
+    metrics.inc('csv_rows_written_total', len(df))
+
+
+def read_csv(csv_path, **kwargs):
+    """pd.read_csv と同じ (--profile では csv_read の区間として集計する)"""
+    with profiling.stage('csv_read'):
+        return pd.read_csv(csv_path, **kwargs)
@@ -1,17 +1,30 @@
 import pandas as pd
 import requests
 import os
-import time
 from urllib.parse import urlparse
 import argparse # コマンドライン引数処理用
 import re # sanitize_filenameで使用
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import metrics
+from metrics import add_metrics_arguments, dump_metrics_from_args
+import profiling
+from profiling import add_profile_arguments, start_profile_from_args
+from csv_io import read_csv
+from http_client import PoliteClient, add_adaptive_arguments, adaptive_options_from_args
+from image_store import ImageStore, IncompleteImageError, looks_complete
 
 # --- 設定項目 ---
 CSV_DIRECTORY = '.'
 IMAGE_SAVE_DIRECTORY_BASE = 'cgss_images'
-DOWNLOAD_WAIT_TIME = 1.5
-SKIP_EXISTING_FILES = True
+DOWNLOAD_WAIT_TIME = 1.5 # --workers 1 の場合のリクエスト間隔 (秒, 自動調整ではその初期値)
+SKIP_EXISTING_FILES = True # ダウンロード済み (画像ストアのマニフェストに記録済み) の画像をスキップする
 REQUEST_TIMEOUT = 20
+# 並列ダウンロード設定 (--workers / --rate / --per-host で上書き可能)
+DOWNLOAD_WORKERS = 4
+DOWNLOAD_RATE_PER_SECOND = 2.0 # 全スレッド合計のリクエスト数/秒
+MAX_CONNECTIONS_PER_HOST = 4
 # ----------------
 
 # 全ての処理対象CSVファイルと情報
@@ -30,41 +43,261 @@ def sanitize_filename(name):
     name = re.sub(r'\s+', ' ', name).strip() # 連続スペースを1つに、前後のスペース削除
     return name
 
-def download_image(image_url, save_path, card_name="image"):
-    """指定されたURLから画像をダウンロードして保存する"""
-    last_message = "" # 最後にprintしたメッセージを保持 (スキップ判定用)
+def download_image(image_url, save_path, card_name="image", client=None, store=None, card_id=None):
+    """指定されたURLから画像をダウンロードし、画像ストア (ImageStore) に内容のハッシュで保存する
+
+    ダウンロードは一時ファイルに書き、サイズ (Content-Length) と画像の末尾を確かめてから保存する。
+    save_path (カード名付きのファイル) は保存した画像本体から作る。
+    マニフェストに同じURLで記録済みで画像本体が揃っているカードはダウンロードしない
+    (カード名が変わった場合もファイル名を付け直すだけで取得し直さない)。
+    client (PoliteClient) を渡した場合はそのセッションとレート制限を使う。
+    戻り値は (状態, メッセージ)。状態は 'downloaded' / 'skipped' / 'failed'。
+    """
+    last_message = "" # 最後にprintしたメッセージを保持
+    save_manifest = store is None
+    if store is None:
+        store = ImageStore(image_directory=IMAGE_SAVE_DIRECTORY_BASE)
     try:
         if not image_url or pd.isna(image_url) or not isinstance(image_url, str) or not image_url.startswith(('http://', 'https://')):
             last_message = f"無効なURLか、URLが空です。スキップします: {image_url}"
             print(last_message)
-            return False, last_message
-
-        if SKIP_EXISTING_FILES and os.path.exists(save_path):
-            last_message = f"ファイルが既に存在します。スキップ: {save_path}"
+            return 'failed', last_message
+
+        ext = os.path.splitext(save_path)[1].lower() or '.jpg'
+        key = card_id if card_id not in (None, '') else image_url
+        entry = store.entry(key)
+        if SKIP_EXISTING_FILES and entry and entry['url'] == image_url and store.has_object(entry):
+            if store.is_materialized(entry, save_path):
+                last_message = f"ダウンロード済みです。スキップ: {save_path}"
+            else:
+                # カード名の変更などでファイル名が変わった (またはファイルが消えた) ので、画像本体から作り直す
+                store.materialize(entry, save_path)
+                store.record(key, entry['sha256'], entry['size'], entry['ext'], image_url, save_path, entry.get('etag'), entry.get('last_modified'))
+                last_message = f"ダウンロード済みの画像からファイルを作り直しました。スキップ: {save_path}"
             print(last_message)
-            return True, last_message # 既に存在するので成功扱い
+            return 'skipped', last_message
+
+        if SKIP_EXISTING_FILES and entry is None and looks_complete(save_path):
+            # マニフェスト導入前にダウンロードした画像は、末尾まで揃っていればそのまま取り込む
+            sha256, size = store.ingest_file(save_path, ext)
+            store.materialize({'sha256': sha256, 'ext': ext}, save_path)
+            store.record(key, sha256, size, ext, image_url, save_path)
+            last_message = f"既存のファイルを画像ストアに取り込みました。スキップ: {save_path}"
+            print(last_message)
+            return 'skipped', last_message
 
-        print(f"ダウンロード中 ({card_name}): {image_url} -> {save_path}")
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(image_url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT)
-        response.raise_for_status()
+        if client is None:
+            client = PoliteClient(rate=1 / DOWNLOAD_WAIT_TIME, max_per_host=1)
 
-        with open(save_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        print(f"ダウンロード中 ({card_name}): {image_url} -> {save_path}")
+        fetch_into_store(image_url, save_path, key, client, store)
         last_message = f"ダウンロード完了: {save_path}"
         print(last_message)
-        return True, last_message
-    except requests.exceptions.RequestException as e:
+        return 'downloaded', last_message
+    except (requests.exceptions.RequestException, IncompleteImageError) as e:
         last_message = f"ダウンロードエラー ({card_name}, URL: {image_url}): {e}"
         print(last_message)
-        return False, last_message
+        return 'failed', last_message
+    except Exception as e:
+        last_message = f"予期せぬエラー ({card_name}, URL: {image_url}, Path: {save_path}): {e}"
+        print(last_message)
+        return 'failed', last_message
+    finally:
+        if save_manifest:
+            store.save()
+
+def fetch_into_store(image_url, save_path, key, client, store, headers=None):
+    """画像を取得して画像ストアに保存し、save_path を作ってマニフェストに記録する
+
+    headers に条件付きリクエストのヘッダーを渡し、304 Not Modified が返った場合は何もせず False を返す。
+    保存した場合は True。不完全な画像や画像ではないレスポンスは IncompleteImageError。
+    """
+    ext = os.path.splitext(save_path)[1].lower() or '.jpg'
+    # ボディを読み切るまでホスト別の接続枠を保持する
+    with client.request_slot(image_url) as session, profiling.stage('fetch_image'):
+        start = time.perf_counter()
+        try:
+            response = session.get(image_url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            client.record_error(image_url, e)
+            raise
+        latency_ms = (time.perf_counter() - start) * 1000
+        if response.status_code == 304:
+            response.close()
+            client.record(image_url, response, latency_ms, size=0)
+            return False
+        if response.status_code >= 400:
+            response.close()
+            client.record(image_url, response, latency_ms, size=0)
+        response.raise_for_status()
+        content_type = response.headers.get('Content-Type', '')
+        if content_type and not content_type.startswith(('image/', 'application/octet-stream')):
+            # 200 で返ったエラーページなども応答として記録し、接続をプールに返してから失敗にする
+            response.close()
+            client.record(image_url, response, latency_ms, size=0)
+            raise IncompleteImageError(f"画像ではないレスポンスです (Content-Type: {content_type})")
+        content_length = response.headers.get('Content-Length')
+        # 圧縮転送の場合は展開後の長さが Content-Length と異なるため確かめない
+        expected_size = int(content_length) if content_length and not response.headers.get('Content-Encoding') else None
+        sha256, size = store.ingest_chunks(response.iter_content(chunk_size=8192), ext, expected_size)
+        # 所要時間はボディを読み切るまでを含める (レート制御にはヘッダーまでの応答時間を渡す)
+        client.record(image_url, response, (time.perf_counter() - start) * 1000, size=size, latency_ms=latency_ms)
+    store.materialize({'sha256': sha256, 'ext': ext}, save_path)
+    store.record(
+        key, sha256, size, ext, image_url, save_path,
+        etag=response.headers.get('ETag'), last_modified=response.headers.get('Last-Modified'),
+    )
+    return True
+
+def revalidate_image(image_url, save_path, card_name="image", client=None, store=None, card_id=None):
+    """ダウンロード済みの画像が更新されていないかを条件付きリクエストで確かめ、変わっていれば取得し直す
+
+    マニフェストの ETag / Last-Modified を If-None-Match / If-Modified-Since として送り、
+    304 Not Modified なら本文を受け取らずにスキップする。
+    検証子が記録されていない画像 (マニフェスト導入前に取り込んだもの) は HEAD で検証子を取得して記録し、
+    サイズが記録と違う場合だけ取得し直す。
+    ダウンロード済みでない画像は download_image と同じく通常のダウンロードになる。
+    戻り値は download_image と同じ (状態, メッセージ)。
+    """
+    save_manifest = store is None
+    if store is None:
+        store = ImageStore(image_directory=IMAGE_SAVE_DIRECTORY_BASE)
+    key = card_id if card_id not in (None, '') else image_url
+    entry = store.entry(key)
+    if not (isinstance(image_url, str) and entry and entry['url'] == image_url and store.has_object(entry)):
+        return download_image(image_url, save_path, card_name, client, None if save_manifest else store, card_id)
+
+    if client is None:
+        client = PoliteClient(rate=1 / DOWNLOAD_WAIT_TIME, max_per_host=1)
+    try:
+        if not store.is_materialized(entry, save_path):
+            store.materialize(entry, save_path)
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        if not headers:
+            with client.request_slot(image_url) as session:
+                start = time.perf_counter()
+                try:
+                    response = session.head(image_url, timeout=REQUEST_TIMEOUT, allow_redirects=True)
+                except requests.exceptions.RequestException as e:
+                    client.record_error(image_url, e)
+                    raise
+                client.record(image_url, response, (time.perf_counter() - start) * 1000, size=0)
+            response.raise_for_status()
+            content_length = response.headers.get('Content-Length')
+            if content_length is None or int(content_length) == entry['size']:
+                store.record(
+                    key, entry['sha256'], entry['size'], entry['ext'], image_url, save_path,
+                    etag=response.headers.get('ETag'), last_modified=response.headers.get('Last-Modified'),
+                )
+                last_message = f"変更なし (HEAD, 検証子を記録しました): {save_path}"
+                print(last_message)
+                return 'skipped', last_message
+            changed = fetch_into_store(image_url, save_path, key, client, store)
+        else:
+            changed = fetch_into_store(image_url, save_path, key, client, store, headers=headers)
+
+        if not changed:
+            # ファイル名だけが変わった場合のために記録を更新する
+            store.record(key, entry['sha256'], entry['size'], entry['ext'], image_url, save_path, entry.get('etag'), entry.get('last_modified'))
+            last_message = f"変更なし (304): {save_path}"
+            print(last_message)
+            return 'skipped', last_message
+        if store.entry(key)['sha256'] == entry['sha256']:
+            # 条件付きリクエストに対応していないサーバーは本文を返すが、内容が同じなら変更なしとして数える
+            last_message = f"変更なし (内容が同じ): {save_path}"
+            print(last_message)
+            return 'skipped', last_message
+        last_message = f"更新された画像をダウンロードしました ({card_name}): {save_path}"
+        print(last_message)
+        return 'downloaded', last_message
+    except (requests.exceptions.RequestException, IncompleteImageError, ValueError) as e:
+        last_message = f"再検証エラー ({card_name}, URL: {image_url}): {e}"
+        print(last_message)
+        return 'failed', last_message
     except Exception as e:
         last_message = f"予期せぬエラー ({card_name}, URL: {image_url}, Path: {save_path}): {e}"
         print(last_message)
-        return False, last_message
+        return 'failed', last_message
+    finally:
+        if save_manifest:
+            store.save()
+
+def build_image_filename(image_url, card_id, card_name_original):
+    """カードIDと名前から保存用のファイル名を生成する"""
+    safe_card_name = sanitize_filename(card_name_original)
+    try:
+        parsed_url = urlparse(image_url)
+        original_filename = os.path.basename(parsed_url.path)
+        _, ext = os.path.splitext(original_filename)
+        if not ext or len(ext) > 5 : # 拡張子が長すぎる場合も考慮
+            ext = '.jpg'
+    except Exception:
+        ext = '.jpg'
+
+    if card_id:
+        # IDは数値のはずなので、文字列変換してファイル名に使う
+        filename_base = f"{str(card_id)}_{safe_card_name}"
+    else:
+        filename_base = safe_card_name
+
+    filename = filename_base + ext
+
+    max_filename_len = 100 # OSのファイル名長制限を考慮
+    if len(filename) > max_filename_len:
+        name_part = filename_base[:max_filename_len - len(ext) -1] # 拡張子と区切り文字の分を考慮
+        filename = name_part + "_" + ext if not name_part.endswith("_") else name_part + ext
+    return filename
+
+def download_rarity_images(df, rarity, save_dir, client, workers=DOWNLOAD_WORKERS, store=None, revalidate=False):
+    """df の各カードの画像を save_dir にダウンロードし、件数の辞書 (processed / downloaded / skipped / failed) を返す
+
+    画像は store (ImageStore, 省略時は既定のディレクトリ) に保存し、最後にマニフェストを書き出す。
+    revalidate=True の場合、ダウンロード済みの画像も条件付きリクエストで並列に再検証する (revalidate_image)。
+    """
+    fetch = revalidate_image if revalidate else download_image
+    if store is None:
+        store = ImageStore(image_directory=IMAGE_SAVE_DIRECTORY_BASE)
+    counts = {'processed': 0, 'downloaded': 0, 'skipped': 0, 'failed': 0}
+
+    # ダウンロード対象を先に組み立て、スレッドプールで並列に処理する
+    jobs = []
+    for index, row in df.iterrows():
+        counts['processed'] += 1
+
+        image_url = row.get('image_url')
+        card_id = row.get('id', '')
+        card_name_original = row.get('name', f'card_{index}')
+        safe_card_name = sanitize_filename(card_name_original)
+
+        if not image_url or pd.isna(image_url) or not isinstance(image_url, str):
+            print(f"無効な画像URLです。スキップします (ID: {card_id}, Name: {safe_card_name})")
+            counts['failed'] += 1
+            metrics.inc('images_total', status='failed')
+            continue
+
+        filename = build_image_filename(image_url, card_id, card_name_original)
+        save_path = os.path.join(save_dir, filename)
+        jobs.append((image_url, save_path, f"{rarity} ID:{card_id} Name:{safe_card_name}", card_id))
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(fetch, image_url, save_path, card_name, client, store, card_id)
+                for image_url, save_path, card_name, card_id in jobs
+            ]
+            for future in as_completed(futures):
+                status, _ = future.result()
+                counts[status] += 1
+                metrics.inc('images_total', status=status)
+    finally:
+        # 中断した場合もそこまでの結果を残す (画像本体は保存済みなので次回は取得し直さない)
+        store.save()
+    return counts
 
 def main():
     parser = argparse.ArgumentParser(description="デレステカード画像をCSVのURLリストに基づいてダウンロードします。")
@@ -75,7 +308,44 @@ def main():
         help=f"処理するレアリティを指定します (例: SSR SR)。指定しない場合は全てのレアリティが対象になります。選択肢: {', '.join(ALL_CSV_FILES_INFO.keys())}",
         default=list(ALL_CSV_FILES_INFO.keys()) # デフォルトは全レアリティ
     )
+    parser.add_argument(
+        "-w", "--workers",
+        type=int,
+        default=DOWNLOAD_WORKERS,
+        help=f"同時にダウンロードするスレッド数 (デフォルト: {DOWNLOAD_WORKERS})。1 を指定すると従来通り逐次処理になります。"
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=None,
+        help=f"全スレッド合計のリクエスト数/秒の上限 (デフォルト: {DOWNLOAD_RATE_PER_SECOND}、--workers 1 の場合は 1/{DOWNLOAD_WAIT_TIME})"
+    )
+    parser.add_argument(
+        "--per-host",
+        type=int,
+        default=MAX_CONNECTIONS_PER_HOST,
+        help=f"1ホストあたりの同時接続数の上限 (デフォルト: {MAX_CONNECTIONS_PER_HOST})"
+    )
+    parser.add_argument(
+        "--revalidate",
+        action="store_true",
+        help="ダウンロード済みの画像も、保存済みの ETag / Last-Modified を使った条件付きリクエストで更新を確かめ、変わった画像だけを取得し直します。"
+    )
+    add_adaptive_arguments(parser)
+    add_metrics_arguments(parser)
+    add_profile_arguments(parser)
     args = parser.parse_args()
+    start_profile_from_args(args, 'download_cgss_images')
+
+    workers = max(1, args.workers)
+    if args.rate is not None:
+        rate = args.rate
+    elif workers == 1:
+        rate = 1 / DOWNLOAD_WAIT_TIME
+    else:
+        rate = DOWNLOAD_RATE_PER_SECOND
+    if rate <= 0:
+        parser.error("--rate には正の値を指定してください。")
 
     if not os.path.exists(IMAGE_SAVE_DIRECTORY_BASE):
         os.makedirs(IMAGE_SAVE_DIRECTORY_BASE)
@@ -94,7 +364,15 @@ def main():
         return
 
     print(f"処理対象のレアリティ: {', '.join(selected_rarities_info.keys())}")
+    print(f"並列数: {workers}, レート上限: {rate:.2f} リクエスト/秒, ホスト別同時接続数: {args.per_host}"
+          + ("" if args.no_adaptive else " (サーバーの応答に合わせて自動調整します)"))
+    if args.revalidate:
+        print("再検証モード: ダウンロード済みの画像は条件付きリクエストで更新を確かめます。")
 
+    client = PoliteClient(rate=rate, max_per_host=args.per_host, pool_size=workers, **adaptive_options_from_args(args))
+    # 自動調整で同時接続数を上げられるよう、スレッドは同時接続数の上限以上用意する
+    workers = max(workers, client.max_concurrency)
+    store = ImageStore(image_directory=IMAGE_SAVE_DIRECTORY_BASE)
 
     for rarity, info in selected_rarities_info.items():
         csv_file_name = info["filename"]
@@ -112,7 +390,7 @@ def main():
 
         print(f"\n--- {rarity} の画像ダウンロード処理を開始します ({csv_file_name}) ---")
         try:
-            df = pd.read_csv(csv_file_path)
+            df = read_csv(csv_file_path)
         except FileNotFoundError:
             print(f"エラー: CSVファイルが見つかりません: {csv_file_path}")
             continue
@@ -127,75 +405,23 @@ def main():
             print(f"エラー: CSVファイルに 'id' または 'name' 列が見つかりません (ファイル名生成のため): {csv_file_name}")
             continue
 
-        rarity_processed = 0
-        rarity_downloaded = 0
-        rarity_skipped = 0
-        rarity_failed = 0
-
-        for index, row in df.iterrows():
-            total_images_processed += 1
-            rarity_processed += 1
-
-            image_url = row.get('image_url')
-            card_id = row.get('id', '')
-            card_name_original = row.get('name', f'card_{index}')
-            safe_card_name = sanitize_filename(card_name_original)
-
-            if not image_url or pd.isna(image_url) or not isinstance(image_url, str):
-                print(f"無効な画像URLです。スキップします (ID: {card_id}, Name: {safe_card_name})")
-                total_images_failed +=1
-                rarity_failed += 1
-                continue
-
-            try:
-                parsed_url = urlparse(image_url)
-                original_filename = os.path.basename(parsed_url.path)
-                _, ext = os.path.splitext(original_filename)
-                if not ext or len(ext) > 5 : # 拡張子が長すぎる場合も考慮
-                    ext = '.jpg'
-            except Exception:
-                ext = '.jpg'
-
-            if card_id:
-                # IDは数値のはずなので、文字列変換してファイル名に使う
-                filename_base = f"{str(card_id)}_{safe_card_name}"
-            else:
-                filename_base = safe_card_name
-            
-            filename = filename_base + ext
-
-            max_filename_len = 100 # OSのファイル名長制限を考慮
-            if len(filename) > max_filename_len:
-                name_part = filename_base[:max_filename_len - len(ext) -1] # 拡張子と区切り文字の分を考慮
-                filename = name_part + "_" + ext if not name_part.endswith("_") else name_part + ext
-
-
-            save_path = os.path.join(current_save_dir, filename)
-
-            success, message = download_image(image_url, save_path, card_name=f"{rarity} ID:{card_id} Name:{safe_card_name}")
-
-            if success:
-                if "ファイルが既に存在します" in message:
-                    total_images_skipped += 1
-                    rarity_skipped += 1
-                else:
-                    total_images_downloaded += 1
-                    rarity_downloaded += 1
-            else:
-                total_images_failed += 1
-                rarity_failed += 1
+        counts = download_rarity_images(df, rarity, current_save_dir, client, workers=workers, store=store, revalidate=args.revalidate)
+        total_images_processed += counts['processed']
+        total_images_downloaded += counts['downloaded']
+        total_images_skipped += counts['skipped']
+        total_images_failed += counts['failed']
 
-            time.sleep(DOWNLOAD_WAIT_TIME)
-        
         print(f"--- {rarity} の処理完了 ---")
-        print(f"  処理数: {rarity_processed}, ダウンロード成功: {rarity_downloaded}, スキップ: {rarity_skipped}, 失敗: {rarity_failed}")
+        print(f"  処理数: {counts['processed']}, ダウンロード成功: {counts['downloaded']}, スキップ: {counts['skipped']}, 失敗: {counts['failed']}")
 
+    client.close()
 
     print("\n\n--- 全ての指定された画像ダウンロード処理が完了しました ---")
     print(f"処理した総画像数 (指定レアリティ合計): {total_images_processed}")
     print(f"ダウンロード成功数 (指定レアリティ合計): {total_images_downloaded}")
-    print(f"スキップ数 (既存ファイル) (指定レアリティ合計): {total_images_skipped}")
+    print(f"スキップ数 (ダウンロード済み・変更なし) (指定レアリティ合計): {total_images_skipped}")
     print(f"ダウンロード失敗数 (指定レアリティ合計): {total_images_failed}")
+    dump_metrics_from_args(args, 'download_cgss_images')
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
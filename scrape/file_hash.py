@@ -0,0 +1,10 @@
+import hashlib
+
+
+def file_sha256(path):
+    """ファイルの内容の SHA-256 (16進数) を、全体をメモリに読み込まずに求める"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
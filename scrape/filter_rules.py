@@ -0,0 +1,252 @@
+import hashlib
+import json
+import os
+import re
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+# --- 設定項目 ---
+# 判定ルール表 (JSON) のデフォルトのパス
+RULE_TABLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'filter_rules.json')
+# --- ここまで設定項目 ---
+
+# 条件が参照できる文字列
+#   text          : ルール表の normalize 設定で正規化した文字列
+#   original      : 正規化前の文字列
+#   original_lower: 正規化前の文字列を小文字化したもの
+SCOPES = ('text', 'original', 'original_lower')
+# どのルールにも合致しなかった場合のルール名
+DEFAULT_RULE_NAME = 'default'
+
+
+class KeywordAutomaton:
+    """Aho-Corasick 法による複数キーワードの同時検索
+
+    登録したキーワードのうち文字列中に現れるもの (重なり合うものも含む) を、
+    キーワード数によらず文字列を1回走査するだけで全て求める。
+    """
+
+    def __init__(self, keywords):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [set()]
+        for keyword in keywords:
+            self._add(keyword)
+        self._build_fail_links()
+
+    def _add(self, keyword):
+        if not keyword:
+            return
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(set())
+            state = next_state
+        self._output[state].add(keyword)
+
+    def _build_fail_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] |= self._output[self._fail[next_state]]
+
+    def find_all(self, text):
+        """text に含まれる登録キーワードの集合を返す"""
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            if self._output[state]:
+                found |= self._output[state]
+        return found
+
+
+class Condition:
+    """1つの条件: 指定した scope の文字列がキーワードのいずれかを含む、または正規表現にマッチする"""
+
+    def __init__(self, spec, rule_name):
+        self.scope = spec.get('scope')
+        if self.scope not in SCOPES:
+            raise ValueError(f"ルール {rule_name}: 不明な scope です: {self.scope} (選択肢: {', '.join(SCOPES)})")
+        self.keywords = None
+        self.regex = None
+        if 'keywords' in spec:
+            keywords = spec['keywords']
+            # 小文字化された文字列に対する条件は、キーワードも小文字化して比較する
+            if self.scope != 'original':
+                keywords = [kw.lower() for kw in keywords]
+            self.keywords = frozenset(keywords)
+        elif 'regex' in spec:
+            flags = re.IGNORECASE if spec.get('ignore_case') else 0
+            self.regex = re.compile(spec['regex'], flags)
+        else:
+            raise ValueError(f"ルール {rule_name}: 条件には keywords か regex のどちらかが必要です")
+
+    def holds(self, views, matched):
+        if self.keywords is not None:
+            return not self.keywords.isdisjoint(matched[self.scope])
+        return self.regex.search(views[self.scope]) is not None
+
+
+class Rule:
+    def __init__(self, spec):
+        self.name = spec.get('name')
+        if not self.name:
+            raise ValueError(f"ルールに name がありません: {spec}")
+        if 'category' not in spec:
+            raise ValueError(f"ルール {self.name}: category がありません")
+        self.category = spec['category']
+        self.rerun_category = spec.get('rerun_category')
+        self.match_blank = bool(spec.get('match_blank'))
+        self.all_groups = [[Condition(c, self.name) for c in group] for group in spec.get('all', [])]
+        self.unless = [Condition(c, self.name) for c in spec.get('unless', [])]
+        if not self.match_blank and not self.all_groups:
+            raise ValueError(f"ルール {self.name}: all (または match_blank) が必要です")
+
+    def conditions(self):
+        for group in self.all_groups:
+            yield from group
+        yield from self.unless
+
+    def holds(self, is_blank, views, matched):
+        if self.match_blank:
+            return is_blank
+        return all(any(c.holds(views, matched) for c in group) for group in self.all_groups) \
+            and not any(c.holds(views, matched) for c in self.unless)
+
+
+class CompiledRuleTable:
+    """ルール表を読み込み、1件ずつの判定 (classify) と列単位の判定 (classify_series) を提供する
+
+    全ルールのキーワードを scope ごとに1つの KeywordAutomaton にまとめ、文字列を1回走査した
+    結果 (現れたキーワードの集合) を全ルールで共有する。ルール数が増えても走査回数は増えない。
+    """
+
+    def __init__(self, table, version_hash):
+        self.version_hash = version_hash
+        normalize = table.get('normalize', {})
+        self._lowercase = normalize.get('lowercase', False)
+        self._collapse_whitespace = normalize.get('collapse_whitespace', False)
+        self._replacements = [tuple(pair) for pair in normalize.get('replacements', [])]
+        self.rules = [Rule(spec) for spec in table.get('rules', [])]
+        self.rerun_marker = Condition(table['rerun_marker'], 'rerun_marker') if table.get('rerun_marker') else None
+        defaults = table.get('defaults', {})
+        self.default_N_or_R = defaults.get('N_or_R', '不明')
+        self.default_other = defaults.get('other', '不明')
+
+        keywords_by_scope = {scope: set() for scope in SCOPES}
+        for condition in self._all_conditions():
+            if condition.keywords is not None:
+                keywords_by_scope[condition.scope] |= condition.keywords
+        self._automata = {scope: KeywordAutomaton(keywords) for scope, keywords in keywords_by_scope.items()}
+
+    def _all_conditions(self):
+        for rule in self.rules:
+            yield from rule.conditions()
+        if self.rerun_marker:
+            yield self.rerun_marker
+
+    def normalize(self, text):
+        if pd.isna(text):
+            return ""
+        text = str(text)
+        if self._lowercase:
+            text = text.lower()
+        if self._collapse_whitespace:
+            text = re.sub(r'\s+', ' ', text).strip()
+        for old, new in self._replacements:
+            text = text.replace(old, new)
+        return text
+
+    def normalize_series(self, texts):
+        """normalize の Series 版 (NAは空文字列になる)"""
+        texts = texts.astype(object).where(texts.notna(), "").astype(str)
+        if self._lowercase:
+            texts = texts.str.lower()
+        if self._collapse_whitespace:
+            texts = texts.str.replace(r'\s+', ' ', regex=True).str.strip()
+        for old, new in self._replacements:
+            texts = texts.str.replace(old, new, regex=False)
+        return texts
+
+    def _resolve(self, rule, is_rerun):
+        if rule.rerun_category and is_rerun:
+            return rule.rerun_category
+        return rule.category
+
+    def _match(self, original):
+        """正規化前の文字列 (NAは空文字列) に合致した最初のルールの (カテゴリ, ルール名) を返す
+
+        どのルールにも合致しなければ (None, DEFAULT_RULE_NAME)。
+        """
+        views = {
+            'text': self.normalize(original),
+            'original': original,
+            'original_lower': original.lower(),
+        }
+        matched = {scope: self._automata[scope].find_all(views[scope]) for scope in SCOPES}
+        is_blank = not original.strip()
+        for rule in self.rules:
+            if rule.holds(is_blank, views, matched):
+                is_rerun = self.rerun_marker is not None and self.rerun_marker.holds(views, matched)
+                return self._resolve(rule, is_rerun), rule.name
+        return None, DEFAULT_RULE_NAME
+
+    def classify(self, availability_text, is_card_N_or_R):
+        """1件の入手方法を判定し、(カテゴリ, 適用されたルール名) を返す"""
+        category, rule_name = self._match("" if pd.isna(availability_text) else str(availability_text))
+        if category is None:
+            category = self.default_N_or_R if is_card_N_or_R else self.default_other
+        return category, rule_name
+
+    def classify_series(self, availability, is_card_N_or_R):
+        """列全体を判定し、(カテゴリの Series, 適用されたルール名の Series) を返す
+
+        異なる文字列ごとに1回だけ KeywordAutomaton で走査してルールを評価し、結果を各行に展開する。
+        is_card_N_or_R は bool または availability と同じ長さの bool の Series。
+        """
+        keys = availability.astype(object).where(availability.notna(), "").astype(str)
+        codes, uniques = pd.factorize(keys)
+        unique_categories = np.empty(len(uniques), dtype=object)
+        unique_rule_names = np.empty(len(uniques), dtype=object)
+        for position, original in enumerate(uniques):
+            unique_categories[position], unique_rule_names[position] = self._match(original)
+        categories = unique_categories[codes]
+        rule_names = unique_rule_names[codes]
+
+        is_default = rule_names == DEFAULT_RULE_NAME
+        if is_default.any():
+            default = np.where(np.asarray(is_card_N_or_R, dtype=bool), self.default_N_or_R, self.default_other)
+            categories[is_default] = np.broadcast_to(default, len(keys))[is_default]
+        return (
+            pd.Series(categories, index=availability.index, dtype=object),
+            pd.Series(rule_names, index=availability.index, dtype=object),
+        )
+
+
+def load_rule_table(path=RULE_TABLE_FILE):
+    """ルール表 (JSON) を読み込んでコンパイルする
+
+    version_hash はルール表とこの判定エンジンのソースのハッシュで、どちらかが変わると値が変わる。
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+    with open(os.path.abspath(__file__), 'rb') as f:
+        engine_source = f.read()
+    version_hash = hashlib.sha256(raw + b'\0' + engine_source).hexdigest()[:16]
+    return CompiledRuleTable(json.loads(raw.decode('utf-8')), version_hash)
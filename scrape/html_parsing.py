@@ -0,0 +1,89 @@
+from bs4 import BeautifulSoup, SoupStrainer
+
+import metrics
+
+try:
+    import lxml  # noqa: F401 (パーサーとして使えるかの確認のみ)
+    HAS_LXML = True
+except ImportError:
+    HAS_LXML = False
+
+# --- 設定項目 ---
+# 使用するパーサーバックエンド (各スクリプトの --parser で上書き可能)
+#   html.parser         : 標準ライブラリのパーサーで文書全体を解析 (従来の動作)
+#   lxml                : lxml で文書全体を解析 (要 lxml)
+#   html.parser-strainer: 標準パーサーで必要な要素 (一覧/詳細の表) だけを解析
+#   lxml-strainer       : lxml で必要な要素だけを解析 (要 lxml)
+DEFAULT_PARSER_BACKEND = 'html.parser'
+# --- ここまで設定項目 ---
+
+PARSER_BACKENDS = ['html.parser', 'lxml', 'html.parser-strainer', 'lxml-strainer']
+
+_current_backend = DEFAULT_PARSER_BACKEND
+
+
+def _class_filter(*class_names):
+    """class属性にいずれかのクラス名を含む要素にマッチする SoupStrainer 用の関数を返す"""
+    wanted = set(class_names)
+
+    def match(class_value):
+        if not class_value:
+            return False
+        if isinstance(class_value, str):
+            class_value = class_value.split()
+        return not wanted.isdisjoint(class_value)
+    return match
+
+
+# ページ種別ごとに、解析が必要な要素だけを残す SoupStrainer
+#   listing: カード一覧 (ul.dblst) とページ送り (div.pagination)
+#   detail : 詳細ページの表 (ul.tblbox)
+PAGE_STRAINERS = {
+    'listing': SoupStrainer(class_=_class_filter('dblst', 'pagination')),
+    'detail': SoupStrainer(class_=_class_filter('tblbox')),
+}
+
+
+def available_backends():
+    """この環境で使えるバックエンドの一覧を返す"""
+    if HAS_LXML:
+        return list(PARSER_BACKENDS)
+    return [backend for backend in PARSER_BACKENDS if not backend.startswith('lxml')]
+
+
+def set_parser_backend(backend):
+    """以降の make_soup で使うデフォルトのバックエンドを切り替える"""
+    global _current_backend
+    if backend not in PARSER_BACKENDS:
+        raise ValueError(f"不明なパーサーバックエンドです: {backend} (選択肢: {', '.join(PARSER_BACKENDS)})")
+    if backend.startswith('lxml') and not HAS_LXML:
+        raise ValueError(f"パーサーバックエンド {backend} には lxml が必要です (pip install lxml)")
+    _current_backend = backend
+
+
+def get_parser_backend():
+    return _current_backend
+
+
+def make_soup(content, page_kind=None, backend=None):
+    """HTMLを解析して BeautifulSoup オブジェクトを返す
+
+    page_kind ('listing' / 'detail') を渡すと、*-strainer バックエンドでは
+    そのページ種別の抽出に必要な要素だけを解析する。None の場合は常に文書全体を解析する。
+    """
+    backend = backend or _current_backend
+    parser_name, _, mode = backend.partition('-')
+    with metrics.timer('html_parse_ms', page_kind=page_kind or 'other'):
+        if mode == 'strainer' and page_kind in PAGE_STRAINERS:
+            return BeautifulSoup(content, parser_name, parse_only=PAGE_STRAINERS[page_kind])
+        return BeautifulSoup(content, parser_name)
+
+
+def add_parser_argument(parser):
+    """各スクリプト共通の --parser オプションを argparse に追加する (選択肢はこの環境で使えるバックエンドのみ)"""
+    parser.add_argument(
+        "--parser",
+        choices=available_backends(),
+        default=DEFAULT_PARSER_BACKEND,
+        help=f"HTMLパーサーバックエンド (デフォルト: {DEFAULT_PARSER_BACKEND})。lxml 系は lxml のインストールが必要です。"
+    )
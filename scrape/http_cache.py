@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import time
+
+import requests
+
+import metrics
+from atomic_io import write_bytes_atomic
+
+# --- 設定項目 ---
+# キャッシュの保存先ディレクトリ
+CACHE_DIRECTORY = '.http_cache'
+# キャッシュを再検証せずにそのまま使う期間 (秒)。過ぎたものは条件付きGETで再検証する
+CACHE_TTL_SECONDS = 24 * 60 * 60
+# --- ここまで設定項目 ---
+
+
+class CacheMissError(requests.exceptions.RequestException):
+    """オフライン (キャッシュ再生) モードでキャッシュに存在しないURLを要求した"""
+
+
+class CachedResponse:
+    """キャッシュから返すレスポンス。get_soup などが使う requests.Response の一部と同じ属性を持つ"""
+
+    def __init__(self, url, status_code, content, headers=None, from_cache=False):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+        self.from_cache = from_cache
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+
+class HttpCache:
+    """URLをキーにしてレスポンスボディ・ETag/Last-Modified・取得時刻をディスクに保存する
+
+    1エントリは <sha256(url)>.body (ボディ) と <sha256(url)>.json (メタデータ) の2ファイル。
+    書き込みは一時ファイル + rename で行うため、複数スレッドから同時に使ってよい。
+    """
+
+    def __init__(self, directory=CACHE_DIRECTORY, ttl=CACHE_TTL_SECONDS):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        base = os.path.join(self.directory, key)
+        return base + '.json', base + '.body'
+
+    def load(self, url):
+        """キャッシュ済みエントリ (メタデータ辞書, ボディ) を返す。なければ None"""
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(body_path, 'rb') as f:
+                body = f.read()
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return meta, body
+
+    def store(self, url, body, etag=None, last_modified=None, fetched_at=None):
+        meta_path, body_path = self._paths(url)
+        meta = {
+            'url': url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'fetched_at': fetched_at if fetched_at is not None else time.time(),
+        }
+        # ボディを先に書き、メタデータの存在をエントリ完成の目印にする
+        write_bytes_atomic(body_path, body)
+        write_bytes_atomic(meta_path, json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+
+    def touch(self, url, meta):
+        """304 Not Modified を受けたエントリの取得時刻だけを更新する"""
+        meta_path, _ = self._paths(url)
+        meta = dict(meta, fetched_at=time.time())
+        write_bytes_atomic(meta_path, json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+
+    def is_fresh(self, meta):
+        return time.time() - meta.get('fetched_at', 0) < self.ttl
+
+
+class CachedClient:
+    """HttpCache を挟んでGETするクライアント
+
+    inner には PoliteClient / requests.Session など get(url, **kwargs) を持つものを渡す
+    (None の場合は requests.get)。offline=True の場合はネットワークに一切アクセスせず、
+    キャッシュにないURLは CacheMissError になる。
+    """
+
+    def __init__(self, cache, inner=None, offline=False):
+        self.cache = cache
+        self.inner = inner
+        self.offline = offline
+
+    def _inner_get(self, url, **kwargs):
+        if self.inner is None:
+            return requests.get(url, **kwargs)
+        return self.inner.get(url, **kwargs)
+
+    def get(self, url, headers=None, **kwargs):
+        entry = self.cache.load(url)
+        if entry is not None:
+            meta, body = entry
+            if self.offline or self.cache.is_fresh(meta):
+                metrics.inc('http_cache_total', result='hit')
+                return CachedResponse(url, 200, body, from_cache=True)
+        elif self.offline:
+            metrics.inc('http_cache_total', result='miss')
+            raise CacheMissError(f"キャッシュにありません (オフラインモード): {url}")
+
+        request_headers = dict(headers or {})
+        if entry is not None:
+            if meta.get('etag'):
+                request_headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                request_headers['If-Modified-Since'] = meta['last_modified']
+
+        response = self._inner_get(url, headers=request_headers, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            metrics.inc('http_cache_total', result='revalidated')
+            self.cache.touch(url, meta)
+            return CachedResponse(url, 200, body, headers=response.headers, from_cache=True)
+
+        metrics.inc('http_cache_total', result='miss')
+        if response.status_code == 200:
+            self.cache.store(
+                url,
+                response.content,
+                etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified'),
+            )
+        return response
+
+    def close(self):
+        if self.inner is not None and hasattr(self.inner, 'close'):
+            self.inner.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def add_cache_arguments(parser):
+    """各スクリプト共通のキャッシュ関連オプションを argparse に追加する"""
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help=f"HTTPレスポンスをディスク ({CACHE_DIRECTORY}) にキャッシュし、期限切れのものは条件付きGETで再検証します。"
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="ネットワークにアクセスせず、キャッシュ済みのレスポンスだけで処理します (キャッシュ再生モード)。"
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=CACHE_TTL_SECONDS,
+        help=f"キャッシュを再検証せずに使う期間 (秒, デフォルト: {CACHE_TTL_SECONDS})"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=CACHE_DIRECTORY,
+        help=f"キャッシュの保存先ディレクトリ (デフォルト: {CACHE_DIRECTORY})"
+    )
+
+
+def wrap_client_from_args(args, inner=None):
+    """--cache / --offline が指定されていれば inner を CachedClient で包んで返す"""
+    if not (args.cache or args.offline):
+        return inner
+    cache = HttpCache(directory=args.cache_dir, ttl=args.cache_ttl)
+    return CachedClient(cache, inner=inner, offline=args.offline)
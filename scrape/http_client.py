@@ -0,0 +1,355 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+# --- 設定項目 ---
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+# コネクションプールの最大接続数
+DEFAULT_POOL_SIZE = 10
+# 再試行の対象とするHTTPステータスコード
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# 指数バックオフの基準秒数と上限秒数
+BACKOFF_BASE_SECONDS = 2.0
+BACKOFF_MAX_SECONDS = 60.0
+# 適応的レート制御 (AIMD) の設定
+#   応答が正常な間は ADAPTIVE_INCREASE_INTERVAL 秒ごとにレートを ADAPTIVE_RATE_STEP、同時接続数を 1 ずつ増やし、
+#   429/5xx・タイムアウト・応答時間の急増があればレートと同時接続数に ADAPTIVE_DECREASE_FACTOR を掛けて下げる
+ADAPTIVE_RATE_STEP = 0.25
+ADAPTIVE_INCREASE_INTERVAL = 2.0
+ADAPTIVE_DECREASE_FACTOR = 0.5
+# 下げた直後の応答 (下げる前に送ったもの) で続けて下げないよう、次に下げるまで空ける秒数
+ADAPTIVE_DECREASE_COOLDOWN = 2.0
+# レートの下限 (リクエスト数/秒) と、上限を指定しなかった場合の上限 (初期レートの何倍まで上げるか)
+ADAPTIVE_MIN_RATE = 0.2
+ADAPTIVE_MAX_RATE_FACTOR = 4.0
+# 同時接続数の上限を指定しなかった場合の上限 (初期値の何倍まで上げるか)
+ADAPTIVE_MAX_CONCURRENCY_FACTOR = 2
+# 応答時間が平均の何倍を超えたら急増とみなすか (かつ ADAPTIVE_LATENCY_FLOOR_SECONDS 秒以上の場合のみ)
+ADAPTIVE_LATENCY_SPIKE_FACTOR = 3.0
+ADAPTIVE_LATENCY_FLOOR_SECONDS = 1.0
+# 応答時間の平均 (指数移動平均) の平滑化係数
+ADAPTIVE_LATENCY_EWMA_ALPHA = 0.2
+# --- ここまで設定項目 ---
+
+
+def create_session(pool_size=DEFAULT_POOL_SIZE):
+    """コネクションプールを共有する requests.Session を作成する"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({'User-Agent': USER_AGENT})
+    return session
+
+
+def parse_retry_after(value):
+    """Retry-After ヘッダー (秒数 または HTTP日付) を待機秒数に変換する。解釈できなければ None"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def backoff_delay(attempt, retry_after=None, base=BACKOFF_BASE_SECONDS, cap=BACKOFF_MAX_SECONDS):
+    """attempt 回目 (1始まり) の再試行までの待機秒数を返す
+
+    指数バックオフ + フルジッター (0 ～ base * 2^(attempt-1) の一様乱数, 上限 cap)。
+    サーバーが Retry-After を返していれば、それより早くは再試行しない。
+    """
+    delay = random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def is_retryable_response(response):
+    return response.status_code in RETRYABLE_STATUS_CODES
+
+
+def record_response(url, response, elapsed_ms, size=None):
+    """1回のHTTPリクエストの結果 (ホスト別のステータス・所要時間・受信バイト数) をメトリクスに記録する
+
+    size を省略するとボディの長さを数える。stream=True のレスポンスはボディを読むと消費してしまうため、
+    呼び出し側が受信したバイト数 (または Content-Length) を渡す。
+    """
+    host = urlparse(url).netloc
+    metrics.inc('http_requests_total', host=host, status=response.status_code)
+    metrics.observe('http_request_duration_ms', elapsed_ms, host=host)
+    if size is None:
+        size = len(response.content or b'')
+    metrics.inc('http_response_bytes_total', size, host=host)
+
+
+def record_request_error(url, error):
+    """レスポンスを受け取れなかったリクエスト (タイムアウト・接続エラーなど) をメトリクスに記録する"""
+    metrics.inc('http_errors_total', host=urlparse(url).netloc, error=type(error).__name__)
+
+
+class TokenBucket:
+    """全スレッドで共有するトークンバケット方式のレートリミッター
+
+    rate: 1秒あたりに補充されるトークン数 (= 平均リクエスト数/秒)
+    capacity: バケットの容量 (= 許容するバースト数)
+    """
+
+    def __init__(self, rate, capacity=1):
+        if rate <= 0:
+            raise ValueError(f"rate は正の値である必要があります: {rate}")
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(capacity))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def set_rate(self, rate):
+        """補充レートを変更する (それまでの経過時間分は変更前のレートで補充する)"""
+        with self._lock:
+            self._refill()
+            self.rate = float(rate)
+
+    def acquire(self):
+        """トークンを1つ取得する。足りなければ補充されるまで待機し、待機した秒数を返す"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class HostConcurrencyLimiter:
+    """ホストごとの同時接続数を制限する (上限は set_limit で実行中に変更できる)"""
+
+    def __init__(self, max_per_host):
+        self.max_per_host = max(1, int(max_per_host))
+        self._active = {}
+        self._condition = threading.Condition()
+
+    def set_limit(self, max_per_host):
+        """上限を変更する。下げた場合、既に確保済みの接続枠は解放されるまでそのまま使われる"""
+        with self._condition:
+            self.max_per_host = max(1, int(max_per_host))
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self, url):
+        host = urlparse(url).netloc
+        with self._condition:
+            while self._active.get(host, 0) >= self.max_per_host:
+                self._condition.wait()
+            self._active[host] = self._active.get(host, 0) + 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._active[host] -= 1
+                self._condition.notify_all()
+
+
+class AdaptiveRateController:
+    """サーバーの応答に合わせてトークンバケットのレートとホスト別の同時接続数を変える (AIMD)
+
+    正常な応答が続く間は ADAPTIVE_INCREASE_INTERVAL 秒ごとにレートと同時接続数を少しずつ (加算的に) 上げ、
+    429/5xx・タイムアウト・接続エラー・応答時間の急増があれば乗算的に下げる。
+    レートは min_rate 〜 max_rate、同時接続数は 1 〜 max_concurrency の範囲で動かす。
+    現在の値はメトリクスのゲージ (http_rate_limit_per_second / http_concurrency_limit) に出す。
+    """
+
+    def __init__(self, bucket, host_limiter, min_rate=ADAPTIVE_MIN_RATE, max_rate=None, max_concurrency=None):
+        self.bucket = bucket
+        self.host_limiter = host_limiter
+        self.min_rate = min(min_rate, bucket.rate)
+        self.max_rate = max(max_rate or bucket.rate * ADAPTIVE_MAX_RATE_FACTOR, bucket.rate)
+        self.max_concurrency = max(1, int(max_concurrency or host_limiter.max_per_host * ADAPTIVE_MAX_CONCURRENCY_FACTOR))
+        if host_limiter.max_per_host > self.max_concurrency:
+            host_limiter.set_limit(self.max_concurrency)
+        self.rate = bucket.rate
+        self.concurrency = host_limiter.max_per_host
+        self._latency = None
+        self._last_increase = time.monotonic()
+        self._last_decrease = None
+        self._lock = threading.Lock()
+        self._publish()
+
+    def _publish(self):
+        metrics.set_gauge('http_rate_limit_per_second', round(self.rate, 3))
+        metrics.set_gauge('http_concurrency_limit', self.concurrency)
+
+    def _apply(self, rate, concurrency):
+        self.rate = rate
+        self.concurrency = concurrency
+        self.bucket.set_rate(rate)
+        self.host_limiter.set_limit(concurrency)
+        self._publish()
+
+    def on_response(self, status_code, latency):
+        """レスポンスを受け取るたびに呼ぶ (latency はヘッダーを受け取るまでの秒数)"""
+        if status_code in RETRYABLE_STATUS_CODES:
+            self._decrease('status_429' if status_code == 429 else 'status_5xx')
+            return
+        with self._lock:
+            baseline = self._latency
+            self._latency = latency if baseline is None else baseline + ADAPTIVE_LATENCY_EWMA_ALPHA * (latency - baseline)
+        if baseline is not None and latency >= max(ADAPTIVE_LATENCY_FLOOR_SECONDS, baseline * ADAPTIVE_LATENCY_SPIKE_FACTOR):
+            self._decrease('latency')
+        else:
+            self._increase()
+
+    def on_error(self, error):
+        """レスポンスを受け取れなかったときに呼ぶ。タイムアウトと接続エラーだけを混雑とみなす"""
+        if isinstance(error, requests.exceptions.Timeout):
+            self._decrease('timeout')
+        elif isinstance(error, requests.exceptions.ConnectionError):
+            self._decrease('connection_error')
+
+    def _increase(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_increase < ADAPTIVE_INCREASE_INTERVAL:
+                return
+            self._last_increase = now
+            rate = min(self.max_rate, self.rate + ADAPTIVE_RATE_STEP)
+            concurrency = min(self.max_concurrency, self.concurrency + 1)
+            if (rate, concurrency) != (self.rate, self.concurrency):
+                self._apply(rate, concurrency)
+
+    def _decrease(self, reason):
+        with self._lock:
+            now = time.monotonic()
+            if self._last_decrease is not None and now - self._last_decrease < ADAPTIVE_DECREASE_COOLDOWN:
+                return
+            self._last_decrease = now
+            # 下げた直後は ADAPTIVE_INCREASE_INTERVAL 秒待ってから上げ始める
+            self._last_increase = now
+            metrics.inc('rate_controller_decreases_total', reason=reason)
+            self._apply(
+                max(self.min_rate, self.rate * ADAPTIVE_DECREASE_FACTOR),
+                max(1, int(self.concurrency * ADAPTIVE_DECREASE_FACTOR)),
+            )
+
+
+class PoliteClient:
+    """プール済みセッション・レート制限・ホスト別同時接続数制限をまとめたHTTPクライアント
+
+    複数スレッドから同時に get() を呼び出してよい。
+    レート制限は実際にリクエストを送る直前にのみ適用されるため、
+    既存ファイルのスキップなどリクエストを伴わない処理は待機しない。
+    adaptive=True の場合、rate と max_per_host は初期値になり、AdaptiveRateController が
+    応答に合わせてレート (max_rate まで) と同時接続数 (max_concurrency まで) を上げ下げする。
+    同時接続数を上げられるよう、呼び出し側は max_concurrency 本のスレッドからリクエストする。
+    request_slot で直接リクエストする場合は、結果を record / record_error で知らせる。
+    """
+
+    def __init__(self, rate=1.0, burst=1, max_per_host=2, pool_size=DEFAULT_POOL_SIZE, session=None,
+                 adaptive=False, max_rate=None, max_concurrency=None):
+        self.bucket = TokenBucket(rate, capacity=burst)
+        self.host_limiter = HostConcurrencyLimiter(max_per_host)
+        self.controller = None
+        if adaptive:
+            self.controller = AdaptiveRateController(self.bucket, self.host_limiter, max_rate=max_rate, max_concurrency=max_concurrency)
+        self.session = session or create_session(pool_size=max(pool_size, self.max_concurrency))
+
+    @property
+    def max_concurrency(self):
+        """ホストあたりの同時接続数の上限 (自動調整で上げられる最大値。自動調整しない場合は max_per_host)"""
+        if self.controller is not None:
+            return self.controller.max_concurrency
+        return self.host_limiter.max_per_host
+
+    @contextmanager
+    def request_slot(self, url):
+        """ホスト別の接続枠とトークンを確保してセッションを渡す
+
+        stream=True でボディを読み切るまで接続枠を保持したい場合に使う。
+        """
+        with self.host_limiter.slot(url):
+            waited = self.bucket.acquire()
+            if waited:
+                metrics.inc('rate_limit_wait_seconds_total', waited)
+            yield self.session
+
+    def record(self, url, response, elapsed_ms, size=None, latency_ms=None):
+        """レスポンスをメトリクスに記録し、適応的レート制御に知らせる
+
+        latency_ms (ヘッダーを受け取るまでの時間) を省略すると elapsed_ms を応答時間とみなす。
+        """
+        record_response(url, response, elapsed_ms, size=size)
+        if self.controller is not None:
+            self.controller.on_response(response.status_code, (elapsed_ms if latency_ms is None else latency_ms) / 1000)
+
+    def record_error(self, url, error):
+        record_request_error(url, error)
+        if self.controller is not None:
+            self.controller.on_error(error)
+
+    def get(self, url, **kwargs):
+        with self.request_slot(url) as session:
+            start = time.perf_counter()
+            try:
+                response = session.get(url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                self.record_error(url, e)
+                raise
+            size = int(response.headers.get('Content-Length') or 0) if kwargs.get('stream') else None
+            self.record(url, response, (time.perf_counter() - start) * 1000, size=size)
+            return response
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def add_adaptive_arguments(parser):
+    """各スクリプト共通の適応的レート制御のオプションを argparse に追加する"""
+    parser.add_argument(
+        "--no-adaptive",
+        action="store_true",
+        help="サーバーの応答に合わせたレート・同時接続数の自動調整 (AIMD) を行わず、--rate の固定レートでリクエストします。"
+    )
+    parser.add_argument(
+        "--max-rate",
+        type=float,
+        default=None,
+        help=f"自動調整で上げるリクエスト数/秒の上限 (デフォルト: 初期レートの {ADAPTIVE_MAX_RATE_FACTOR:g} 倍)"
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=None,
+        help=f"自動調整で上げるホストあたりの同時接続数の上限 (デフォルト: 初期値の {ADAPTIVE_MAX_CONCURRENCY_FACTOR} 倍)"
+    )
+
+
+def adaptive_options_from_args(args):
+    """PoliteClient に渡す adaptive / max_rate / max_concurrency の引数を返す"""
+    return {'adaptive': not args.no_adaptive, 'max_rate': args.max_rate, 'max_concurrency': args.max_concurrency}
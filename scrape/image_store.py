@@ -0,0 +1,306 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from atomic_io import replace_atomic, write_bytes_atomic
+from card_store import RARITY_INFO
+from file_hash import file_sha256
+from profiling import add_profile_arguments, start_profile_from_args
+
+# --- 設定項目 ---
+# 画像本体 (内容のハッシュ名) とマニフェストの保存先
+IMAGE_STORE_DIRECTORY = 'cgss_image_store'
+# カードID → ハッシュ・サイズ・取得元URL・ETag などを記録するマニフェスト (IMAGE_STORE_DIRECTORY 内)
+IMAGE_MANIFEST_FILENAME = 'image_manifest.json'
+# カード名付きの画像 (フロントエンドが参照するファイル) のディレクトリ
+IMAGE_SAVE_DIRECTORY_BASE = 'cgss_images'
+# verify の並列数
+VERIFY_WORKERS = 8
+# --- ここまで設定項目 ---
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+
+
+class IncompleteImageError(ValueError):
+    """ダウンロードした画像が途中で切れている、または画像として不完全"""
+
+
+def looks_complete(path):
+    """画像ファイルが末尾まで揃っているかを、形式ごとの先頭/末尾のマーカーで簡易に判定する
+
+    途中で切れたダウンロード (強制終了・接続断) は末尾のマーカーがないため検出できる。
+    形式が分からないファイルは空でなければ完全とみなす。
+    """
+    try:
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            head = f.read(12)
+            f.seek(max(0, size - 16))
+            tail = f.read()
+    except OSError:
+        return False
+    if size == 0:
+        return False
+    if head.startswith(b'\xff\xd8'):
+        return tail.rstrip(b'\x00\r\n ').endswith(b'\xff\xd9')
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return tail.endswith(b'IEND\xaeB`\x82')
+    if head.startswith(b'GIF8'):
+        return tail.endswith(b';')
+    if head.startswith(b'RIFF') and head[8:12] == b'WEBP':
+        return int.from_bytes(head[4:8], 'little') + 8 == size
+    return True
+
+
+class ImageStore:
+    """画像を内容の SHA-256 をファイル名にして保存し、カードIDとの対応をマニフェストで管理する
+
+    画像本体は objects/<ハッシュ先頭2文字>/<ハッシュ><拡張子> に1つだけ置き (同じ画像を使うカードは共有する)、
+    フロントエンドが参照するカード名付きのファイル (cgss_images/<レアリティ>/<ID>_<名前>.jpg) は
+    本体へのハードリンク (できない場合はコピー) として作る。
+    マニフェストは {"cards": {"<カードID>": {"sha256", "size", "ext", "url", "etag", "last_modified", "path"}}}。
+    path は IMAGE_SAVE_DIRECTORY_BASE からの相対パス。複数スレッドから同時に使ってよい。
+    """
+
+    def __init__(self, directory=IMAGE_STORE_DIRECTORY, image_directory=IMAGE_SAVE_DIRECTORY_BASE):
+        self.directory = directory
+        self.image_directory = image_directory
+        self.manifest_path = os.path.join(directory, IMAGE_MANIFEST_FILENAME)
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(directory, 'tmp'), exist_ok=True)
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                self.cards = json.load(f).get('cards', {})
+        except (OSError, json.JSONDecodeError):
+            self.cards = {}
+
+    def object_path(self, sha256, ext):
+        return os.path.join(self.directory, 'objects', sha256[:2], sha256 + ext)
+
+    def entry(self, card_id):
+        with self._lock:
+            entry = self.cards.get(str(card_id))
+            return dict(entry) if entry else None
+
+    def has_object(self, entry):
+        """マニフェストのエントリの画像本体が存在し、サイズが一致するか (ハッシュの確認は verify で行う)"""
+        try:
+            return os.path.getsize(self.object_path(entry['sha256'], entry['ext'])) == entry['size']
+        except OSError:
+            return False
+
+    def is_materialized(self, entry, image_path):
+        """カード名付きのファイルが画像本体と同じ内容か (ハードリンクなら同じファイル、コピーならサイズで判定)"""
+        object_path = self.object_path(entry['sha256'], entry['ext'])
+        try:
+            return os.path.samefile(object_path, image_path) or os.path.getsize(image_path) == entry['size']
+        except OSError:
+            return False
+
+    def ingest_chunks(self, chunks, ext, expected_size=None):
+        """チャンクの列を一時ファイルに書きながらハッシュを計算し、画像本体として保存して (ハッシュ, サイズ) を返す
+
+        expected_size (Content-Length) と長さが違う場合や画像として不完全な場合は IncompleteImageError。
+        一時ファイルは rename で置き換えるため、途中で止まっても不完全な画像本体は残らない。
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.directory, 'tmp'), suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    if chunk:
+                        f.write(chunk)
+                        digest.update(chunk)
+                        size += len(chunk)
+            if expected_size is not None and size != expected_size:
+                raise IncompleteImageError(f"サイズが一致しません (受信 {size} bytes, Content-Length {expected_size} bytes)")
+            if not looks_complete(tmp_path):
+                raise IncompleteImageError("画像の末尾が欠けています")
+            sha256 = digest.hexdigest()
+            object_path = self.object_path(sha256, ext)
+            if os.path.exists(object_path) and os.path.getsize(object_path) == size:
+                # 同じ内容の画像が既にある (重複) ので一時ファイルは捨てる
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                replace_atomic(tmp_path, object_path)
+            return sha256, size
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def ingest_file(self, path, ext):
+        """ダウンロード済みのファイルを画像本体として取り込む (マニフェスト導入前の画像の移行用)"""
+        with open(path, 'rb') as f:
+            return self.ingest_chunks(iter(lambda: f.read(65536), b''), ext, expected_size=os.path.getsize(path))
+
+    def materialize(self, entry, image_path):
+        """画像本体からカード名付きのファイルを作る (一時ファイル + rename で置き換える)"""
+        object_path = self.object_path(entry['sha256'], entry['ext'])
+        directory = os.path.dirname(os.path.abspath(image_path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        os.close(fd)
+        os.remove(tmp_path)
+        try:
+            try:
+                os.link(object_path, tmp_path)
+            except OSError:
+                shutil.copyfile(object_path, tmp_path)
+            os.replace(tmp_path, image_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def record(self, card_id, sha256, size, ext, url, image_path, etag=None, last_modified=None):
+        """カードの画像の情報をマニフェストに記録し、以前の名前のファイルが残っていれば削除する (カード名の変更)"""
+        relative_path = os.path.relpath(image_path, self.image_directory)
+        with self._lock:
+            previous = self.cards.get(str(card_id))
+            self.cards[str(card_id)] = {
+                'sha256': sha256,
+                'size': size,
+                'ext': ext,
+                'url': url,
+                'etag': etag,
+                'last_modified': last_modified,
+                'path': relative_path,
+            }
+        if previous and previous.get('path') and previous['path'] != relative_path:
+            old_path = os.path.join(self.image_directory, previous['path'])
+            if os.path.exists(old_path):
+                os.remove(old_path)
+
+    def forget(self, card_id):
+        with self._lock:
+            self.cards.pop(str(card_id), None)
+
+    def save(self):
+        with self._lock:
+            data = json.dumps({'cards': self.cards}, ensure_ascii=False, indent=1, sort_keys=True).encode('utf-8')
+        write_bytes_atomic(self.manifest_path, data)
+
+    def referenced_objects(self):
+        with self._lock:
+            return {os.path.abspath(self.object_path(entry['sha256'], entry['ext'])) for entry in self.cards.values()}
+
+
+def _verify_entry(store, card_id, entry):
+    """1件のエントリを検査し、問題の種類 (なければ None) を返す"""
+    object_path = store.object_path(entry['sha256'], entry['ext'])
+    if not os.path.exists(object_path):
+        return 'missing_object'
+    if os.path.getsize(object_path) != entry['size'] or file_sha256(object_path) != entry['sha256'] or not looks_complete(object_path):
+        return 'corrupt_object'
+    image_path = os.path.join(store.image_directory, entry['path'])
+    if not os.path.exists(image_path):
+        return 'missing_file'
+    if not os.path.samefile(object_path, image_path) and file_sha256(image_path) != entry['sha256']:
+        return 'mismatched_file'
+    return None
+
+
+def verify_store(store, workers=VERIFY_WORKERS, repair=False):
+    """マニフェストの全画像と、マニフェストにない画像ファイルを並列に検査し、{問題の種類: [対象]} を返す
+
+    repair=True の場合、壊れた画像本体と未管理の不完全なファイルを削除してマニフェストから外し
+    (次回のダウンロードで取得し直される)、カード名付きのファイルは正しい画像本体から作り直す。
+    """
+    problems = {'missing_object': [], 'corrupt_object': [], 'missing_file': [], 'mismatched_file': [], 'partial_unmanaged': []}
+    cards = {card_id: dict(entry) for card_id, entry in store.cards.items()}
+    managed_paths = {os.path.abspath(os.path.join(store.image_directory, entry['path'])) for entry in cards.values()}
+    unmanaged = []
+    for info in RARITY_INFO.values():
+        rarity_dir = os.path.join(store.image_directory, info['subdir'])
+        if os.path.isdir(rarity_dir):
+            unmanaged += [
+                os.path.join(rarity_dir, name) for name in sorted(os.listdir(rarity_dir))
+                if name.lower().endswith(IMAGE_EXTENSIONS) and os.path.abspath(os.path.join(rarity_dir, name)) not in managed_paths
+            ]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = dict(zip(cards, executor.map(lambda item: _verify_entry(store, *item), cards.items())))
+        partial = [path for path, complete in zip(unmanaged, executor.map(looks_complete, unmanaged)) if not complete]
+    for card_id, problem in results.items():
+        if problem:
+            problems[problem].append(card_id)
+    problems['partial_unmanaged'] = partial
+
+    if repair:
+        for card_id in problems['missing_object'] + problems['corrupt_object']:
+            entry = cards[card_id]
+            for path in (store.object_path(entry['sha256'], entry['ext']), os.path.join(store.image_directory, entry['path'])):
+                if os.path.exists(path):
+                    os.remove(path)
+            store.forget(card_id)
+        for card_id in problems['missing_file'] + problems['mismatched_file']:
+            store.materialize(cards[card_id], os.path.join(store.image_directory, cards[card_id]['path']))
+        for path in partial:
+            os.remove(path)
+        store.save()
+    return problems
+
+
+def prune_store(store):
+    """どのカードからも参照されていない画像本体と、中断したダウンロードの一時ファイルを削除し、削除した画像本体の数を返す"""
+    referenced = store.referenced_objects()
+    removed = 0
+    tmp_dir = os.path.join(store.directory, 'tmp')
+    for name in os.listdir(tmp_dir):
+        os.remove(os.path.join(tmp_dir, name))
+    objects_dir = os.path.join(store.directory, 'objects')
+    for root, _, names in os.walk(objects_dir):
+        for name in names:
+            path = os.path.abspath(os.path.join(root, name))
+            if path not in referenced:
+                os.remove(path)
+                removed += 1
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="内容のハッシュで管理しているカード画像 (download_cgss_images_cli.py が保存したもの) を検査・整理します。")
+    parser.add_argument("--store", default=IMAGE_STORE_DIRECTORY, help=f"画像ストアのディレクトリ (デフォルト: {IMAGE_STORE_DIRECTORY})")
+    parser.add_argument("--images", default=IMAGE_SAVE_DIRECTORY_BASE, help=f"カード名付きの画像のディレクトリ (デフォルト: {IMAGE_SAVE_DIRECTORY_BASE})")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    verify_parser = subparsers.add_parser("verify", help="画像本体のハッシュ・サイズ・末尾を並列に検査し、壊れた/途中で切れたファイルを探します。")
+    verify_parser.add_argument("-w", "--workers", type=int, default=VERIFY_WORKERS, help=f"並列数 (デフォルト: {VERIFY_WORKERS})")
+    verify_parser.add_argument("--repair", action="store_true", help="壊れたファイルを削除し (次回のダウンロードで取得し直す)、カード名付きのファイルを作り直します。")
+    subparsers.add_parser("prune", help="どのカードからも参照されていない画像本体を削除します。")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    start_profile_from_args(args, 'image_store')
+
+    store = ImageStore(args.store, args.images)
+    if args.command == "verify":
+        card_count = len(store.cards)
+        problems = verify_store(store, workers=max(1, args.workers), repair=args.repair)
+        labels = {
+            'missing_object': "画像本体がない",
+            'corrupt_object': "画像本体が壊れている (ハッシュ/サイズ不一致・末尾の欠け)",
+            'missing_file': "カード名付きのファイルがない",
+            'mismatched_file': "カード名付きのファイルの内容が違う",
+            'partial_unmanaged': "マニフェストにない不完全なファイル",
+        }
+        print(f"検査したカード: {card_count} 件")
+        for problem, targets in problems.items():
+            print(f"  {labels[problem]}: {len(targets)} 件")
+            for target in targets[:20]:
+                print(f"    {target}")
+        if any(problems.values()):
+            print("修復しました。" if args.repair else "--repair を指定すると修復します。")
+    elif args.command == "prune":
+        print(f"参照されていない画像本体を {prune_store(store)} 件削除しました。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# filter_rules.json に移す前の、ハードコードされた filter_category の判定。
+# categorize_availability.py --check-parity で、ルール表と判定エンジン (filter_rules.py) の変更が
+# 以前の判定結果を変えていないかを確かめる基準として残している。
+# ルール表の判定を意図して変更した場合は、ここも同じように変更する。
+import re
+
+import pandas as pd
+
+# --- 判定ルールで使うキーワード ---
+COLLAB_EVENT_NAMES = [
+    "ハーモニクス", "ももクロ×デレステコラボイベント", "星街すいせい×デレステコラボ"
+]
+FES_KEYWORDS = ["シンデレラフェス", "フェス限定", "ノワール限定", "ブラン限定", "ドミナントガシャ"]
+EVENT_KEYWORDS = [
+    "イベント", "報酬", "ランキング", "ポイント", "メダル", "live carnival", "live groove",
+    "live parade", "シンデレラキャラバン", "ススメ！シンデレラロード", "アイドルプロデュース",
+    "live infinity"
+]
+SPECIFIC_EVENT_REWARD_PATTERNS = ["＜カーニバルメダルチャンス報酬＞", "ポイント報酬", "ランキング報酬", "メダル交換", "期間中のlive報酬", "達成pt報酬", "動員数報酬", "map報酬", "課題クリア報酬", "イベントpt報酬", "イベント参加報酬"]
+EVENT_NAME_PATTERN_GENERAL = r'イベント「.*?」'
+GACHA_KEYWORDS = ["ガシャ", "gacha", "スカウト"]
+LIMITED_GACHA_KEYWORDS = ["期間限定アイドル", "限定ガシャ", "期間限定"]
+DATE_PERIOD_PATTERN = r'\d{4}/\d{1,2}/\d{1,2}\s*～\s*\d{4}/\d{1,2}/\d{1,2}|\d{4}年\d{1,2}月\d{1,2}日\s*～\s*\d{1,2}月\d{1,2}日|\(\s*\d{1,2}月\d{1,2}日\s*～\s*\d{1,2}月\d{1,2}日\s*\)|（\s*\d{1,2}月\d{1,2}日\s*～\s*\d{1,2}月\d{1,2}日\s*）|（初回：\d{4}年\d{1,2}月\d{1,2}日\s*～\s*\d{1,2}月\d{1,2}日\s*14:59）'
+SPECIFIC_GACHA_NAME_PATTERNS = [
+    "アニバーサリーパーティーガシャ", "バレンタイン", "クリスマス", "ハロウィン", "温泉ガシャ", "振袖ガシャ", "ブライダル", "サマーガシャ", "水着",
+    "ナイトタイムガシャ", "放課後タイムガシャ", "トラベルガシャ", "ストーリーガシャ", "セッションガシャ", "ギフトガシャ"
+]
+PERMANENT_KEYWORDS = ["初期選択", "ローカルガシャ", "プラチナガシャ"]
+
+def normalize_text_for_filter(text):
+    if pd.isna(text):
+        return ""
+    text = str(text)
+    text = text.lower()
+    text = re.sub(r'\s+', ' ', text).strip()
+    text = text.replace("プラチナオーディションガシャ", "プラチナガシャ")
+    text = text.replace("ライブ", "live")
+    return text
+
+def determine_filter_category(availability_text_original, is_card_N_or_R):
+    if pd.isna(availability_text_original) or not str(availability_text_original).strip():
+        # availabilityが空またはNaNの場合、レアリティに関わらず「恒常」（初期カード等と想定）
+        return "恒常"
+
+    text = normalize_text_for_filter(availability_text_original)
+    original_text_for_gacha_name_check = str(availability_text_original)
+
+    # --- 優先的に判定する特殊ケース ---
+    if any(collab_event.lower() in text for collab_event in COLLAB_EVENT_NAMES):
+        return "イベント報酬(コラボ)"
+    if "stage for cinderellaガシャ" in text:
+        return "期間限定ガシャ"
+    if "4/1限定コミュ" in text:
+        return "イベント報酬"
+    if "＜イベント限定アイドル＞" in availability_text_original:
+        return "イベント報酬"
+    if "コラボガシャ" in text and "＜期間限定アイドル＞" in availability_text_original:
+        return "期間限定ガシャ(コラボ)"
+
+    # --- 通常の判定ロジック ---
+    if any(kw in text for kw in FES_KEYWORDS):
+        if "復刻" in text:
+            return "フェス限定(復刻)"
+        return "フェス限定"
+
+    is_gacha_by_keyword = any(kw in text for kw in GACHA_KEYWORDS)
+
+    if not is_gacha_by_keyword and \
+       (any(kw in text for kw in EVENT_KEYWORDS) or \
+        any(specific_event_reward_pattern in availability_text_original for specific_event_reward_pattern in SPECIFIC_EVENT_REWARD_PATTERNS) or \
+        (re.search(EVENT_NAME_PATTERN_GENERAL, original_text_for_gacha_name_check, re.IGNORECASE) and not is_gacha_by_keyword) ):
+        return "イベント報酬"
+
+    is_limited_by_keyword_in_gacha_context = is_gacha_by_keyword and any(kw in text for kw in LIMITED_GACHA_KEYWORDS)
+    is_limited_by_date_period_in_gacha_context = is_gacha_by_keyword and bool(re.search(DATE_PERIOD_PATTERN, text))
+    is_limited_by_specific_gacha_name = is_gacha_by_keyword and any(pat.lower() in original_text_for_gacha_name_check.lower() for pat in SPECIFIC_GACHA_NAME_PATTERNS)
+    if is_limited_by_keyword_in_gacha_context or is_limited_by_date_period_in_gacha_context or is_limited_by_specific_gacha_name:
+        if "復刻" in text:
+            return "期間限定ガシャ(復刻)"
+        return "期間限定ガシャ"
+
+    if "初期選択" in text or "ローカルガシャ" in text:
+        return "恒常"
+    if "プラチナガシャ" in text:
+        return "恒常"
+        
+    # N/R CSV のカードで、availability が空でなく、かつ上記ルールに合致しなかった場合も「恒常」
+    if is_card_N_or_R:
+        return "恒常"
+
+    return "不明"
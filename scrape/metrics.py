@@ -0,0 +1,190 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from atomic_io import write_text_atomic
+
+# --- 設定項目 ---
+# 実行の終わりにメトリクスを書き出すディレクトリ (<ジョブ名>.metrics.json と <ジョブ名>.prom)
+METRICS_DIRECTORY = 'run_metrics'
+# Prometheus のメトリクス名の接頭辞
+METRICS_PREFIX = 'cgss_'
+# ヒストグラムのバケットの上限 (ミリ秒)
+DEFAULT_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+# --- ここまで設定項目 ---
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+class Histogram:
+    """累積バケット方式のヒストグラム (Prometheus の histogram と同じ形)"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """(上限, その上限以下の件数) のリスト。最後は (+Inf, 全件数)"""
+        total = 0
+        result = []
+        for bound, count in zip(list(self.buckets) + [float('inf')], self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class MetricsRegistry:
+    """カウンター・ゲージ・ヒストグラムをラベル付きで保持する (複数スレッドから同時に記録してよい)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def inc(self, name, value=1, **labels):
+        """カウンターを value だけ増やす"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self.gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name, value, **labels):
+        """ヒストグラムに1件の値 (ミリ秒など) を記録する"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """with ブロックの所要時間 (ミリ秒) をヒストグラムに記録する"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - start) * 1000, **labels)
+
+    def sleep(self, seconds, reason):
+        """time.sleep し、待機した秒数を sleep_seconds_total{reason} に記録する"""
+        if seconds > 0:
+            time.sleep(seconds)
+            self.inc('sleep_seconds_total', seconds, reason=reason)
+
+    def snapshot(self):
+        """全メトリクスを JSON にできる辞書で返す"""
+        def entries(items, value_of):
+            return [{'name': name, 'labels': dict(labels), **value_of(value)} for (name, labels), value in sorted(items)]
+
+        with self._lock:
+            return {
+                'started_at': self.started_at,
+                'finished_at': time.time(),
+                'counters': entries(self.counters.items(), lambda value: {'value': value}),
+                'gauges': entries(self.gauges.items(), lambda value: {'value': value}),
+                'histograms': entries(self.histograms.items(), lambda histogram: {
+                    'count': histogram.count,
+                    'sum': histogram.sum,
+                    'buckets': {('+Inf' if bound == float('inf') else str(bound)): count for bound, count in histogram.cumulative()},
+                }),
+            }
+
+    def to_prometheus(self, job, prefix=METRICS_PREFIX):
+        """Prometheus の textfile コレクター形式 (テキスト形式) の文字列を返す"""
+        def format_labels(labels, extra=()):
+            pairs = [('script', job)] + list(labels) + list(extra)
+            escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+            return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+        lines = []
+        snapshot_time = time.time()
+        with self._lock:
+            for kind, items in (('counter', self.counters), ('gauge', self.gauges)):
+                declared = set()
+                for (name, labels), value in sorted(items.items()):
+                    if name not in declared:
+                        lines.append(f"# TYPE {prefix}{name} {kind}")
+                        declared.add(name)
+                    lines.append(f"{prefix}{name}{format_labels(labels)} {value}")
+            declared = set()
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name not in declared:
+                    lines.append(f"# TYPE {prefix}{name} histogram")
+                    declared.add(name)
+                for bound, count in histogram.cumulative():
+                    le = '+Inf' if bound == float('inf') else str(bound)
+                    lines.append(f"{prefix}{name}_bucket{format_labels(labels, [('le', le)])} {count}")
+                lines.append(f"{prefix}{name}_sum{format_labels(labels)} {histogram.sum}")
+                lines.append(f"{prefix}{name}_count{format_labels(labels)} {histogram.count}")
+            lines.append(f"# TYPE {prefix}run_duration_seconds gauge")
+            lines.append(f"{prefix}run_duration_seconds{format_labels(())} {snapshot_time - self.started_at:.3f}")
+            lines.append(f"# TYPE {prefix}run_finished_timestamp_seconds gauge")
+            lines.append(f"{prefix}run_finished_timestamp_seconds{format_labels(())} {snapshot_time:.3f}")
+        return '\n'.join(lines) + '\n'
+
+
+# 各スクリプト・モジュールが共有する既定のレジストリ
+REGISTRY = MetricsRegistry()
+inc = REGISTRY.inc
+set_gauge = REGISTRY.set_gauge
+observe = REGISTRY.observe
+timer = REGISTRY.timer
+sleep = REGISTRY.sleep
+
+
+def dump_metrics(job, directory=METRICS_DIRECTORY, registry=REGISTRY):
+    """<directory>/<job>.metrics.json と <directory>/<job>.prom を書き出し、2つのパスを返す"""
+    os.makedirs(directory, exist_ok=True)
+    json_path = os.path.join(directory, f"{job}.metrics.json")
+    prom_path = os.path.join(directory, f"{job}.prom")
+    write_text_atomic(json_path, json.dumps({'job': job, **registry.snapshot()}, ensure_ascii=False, indent=1))
+    write_text_atomic(prom_path, registry.to_prometheus(job))
+    return json_path, prom_path
+
+
+def add_metrics_arguments(parser):
+    """各スクリプト共通のメトリクス関連オプションを argparse に追加する"""
+    parser.add_argument(
+        "--metrics-dir",
+        default=METRICS_DIRECTORY,
+        help=f"実行の終わりにメトリクス (JSON と Prometheus の textfile) を書き出すディレクトリ (デフォルト: {METRICS_DIRECTORY})"
+    )
+    parser.add_argument(
+        "--no-metrics",
+        action="store_true",
+        help="メトリクスを書き出しません。"
+    )
+
+
+def dump_metrics_from_args(args, job):
+    """--no-metrics が指定されていなければメトリクスを書き出してパスを表示する"""
+    if args.no_metrics:
+        return None
+    paths = dump_metrics(job, directory=args.metrics_dir)
+    print(f"メトリクスを書き出しました: {paths[0]}, {paths[1]}")
+    return paths
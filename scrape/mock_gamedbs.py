@@ -0,0 +1,274 @@
+import argparse
+import glob
+import html
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from card_store import CardStore, RARITY_INFO, CSV_DIRECTORY
+
+# --- 設定項目 ---
+# 一覧ページ1ページあたりのカード数
+LISTING_PAGE_SIZE = 40
+# 応答の遅延 (秒) と、その揺らぎ (0〜指定秒をランダムに加える)
+MOCK_LATENCY = 0.0
+MOCK_JITTER = 0.0
+# 503 を返す割合 (0〜1)
+MOCK_ERROR_RATE = 0.0
+# サーバー側のリクエスト数/秒の上限 (超えたら 429 + Retry-After を返す, None なら無制限)
+MOCK_RATE_LIMIT = None
+# 画像のディレクトリ (カードIDごとに実際の画像を返す)
+IMAGE_DIRECTORY = 'cgss_images'
+# --- ここまで設定項目 ---
+
+ATTRIBUTE_NAMES = {"Cu": "キュート", "Co": "クール", "Pa": "パッション"}
+DETAIL_PATH = re.compile(r'^/cgss/card/detail/(\d+)(?:/\d+)?$')
+IMAGE_PATH = re.compile(r'^/cgss/images/(\d+)\.jpg$')
+
+
+def listing_page_html(base_url, rarity, cards, page, page_size):
+    """imas.gamedbs.jp の一覧ページと同じ構造 (ul.dblst / div.pagination) のHTML"""
+    start = page * page_size
+    items = []
+    for card in cards[start:start + page_size]:
+        card_id = card['id']
+        items.append(
+            f'<li><a href="{base_url}/cgss/card/detail/{card_id}/{card_id}#card-{card_id}">'
+            f'<img class="lazy" src="/img/loading.gif" data-original="{base_url}/cgss/images/{card_id}.jpg" alt="">'
+            f'<div>{html.escape(card["name"])}</div></a></li>'
+        )
+    pagination = ''
+    if start + page_size < len(cards):
+        pagination = f'<a class="page-link" rel="next" href="/cgss/card?r={rarity}&amp;p={page + 1}">次へ</a>'
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8"><title>カード一覧</title></head><body>'
+        '<header><nav><ul class="menu"><li>デレステ</li></ul></nav></header>'
+        f'<ul class="dblst flexbox flexwrap">{"".join(items)}</ul>'
+        f'<div class="pagination">{pagination}</div>'
+        '<footer><p>mock</p></footer></body></html>'
+    )
+
+
+def detail_page_html(card):
+    """imas.gamedbs.jp の詳細ページと同じ構造 (ul.tblbox の li.h / li.d) のHTML"""
+    fields = [("属性", ATTRIBUTE_NAMES.get(card.get('attribute'), "キュート")), ("主な入手方法", card.get('availability') or "プラチナガシャ")]
+    fields += [(column[len('detail_'):], value) for column, value in card.items() if column.startswith('detail_') and value]
+    rows = ''.join(f'<li class="h">{html.escape(label)}</li><li class="d">{html.escape(str(value))}</li>' for label, value in fields)
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8"><title>カード詳細</title></head><body>'
+        f'<h1>{html.escape(card["name"])}</h1>'
+        f'<ul class="tblbox flexbox flexwrap">{rows}</ul>'
+        '<ul class="tblbox flexbox flexwrap"><li class="h">ボーカル</li><li class="d">5000</li>'
+        '<li class="h">ダンス</li><li class="d">5000</li><li class="h">ビジュアル</li><li class="d">5000</li></ul>'
+        '</body></html>'
+    )
+
+
+class MockStats:
+    """モックサーバーが返したレスポンスの集計 (複数スレッドから更新される)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.pages = 0
+            self.bytes_sent = 0
+            self.errors = 0
+            self.rate_limited = 0
+
+    def add(self, status, size):
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += size
+            if status == 200:
+                self.pages += 1
+            elif status == 429:
+                self.rate_limited += 1
+            elif status >= 500:
+                self.errors += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'pages': self.pages,
+                'bytes': self.bytes_sent,
+                'errors': self.errors,
+                'rate_limited': self.rate_limited,
+            }
+
+
+class MockGamedbsServer:
+    """カードCSVの内容から一覧/詳細ページと画像を返す、imas.gamedbs.jp の代わりのローカルHTTPサーバー
+
+    一覧: /cgss/card?r=<レアリティ>&p=<ページ番号>
+    詳細: /cgss/card/detail/<ID>/<ID>
+    画像: /cgss/images/<ID>.jpg
+    遅延・エラー (503)・サーバー側のレート制限 (429 + Retry-After) を設定できる。
+    with 文で使うと、別スレッドで起動して終了時に停止する。
+    """
+
+    def __init__(self, store, host='127.0.0.1', port=0, page_size=LISTING_PAGE_SIZE, latency=MOCK_LATENCY,
+                 jitter=MOCK_JITTER, error_rate=MOCK_ERROR_RATE, rate_limit=MOCK_RATE_LIMIT, image_dir=IMAGE_DIRECTORY, seed=None):
+        self.page_size = page_size
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.stats = MockStats()
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._window = []
+        self._window_lock = threading.Lock()
+
+        self.cards_by_rarity = {}
+        self.cards_by_id = {}
+        for rarity in store.rarities():
+            df = store.get(rarity).astype(object).where(store.get(rarity).notna(), None)
+            cards = df.to_dict('records')
+            self.cards_by_rarity[rarity] = cards
+            self.cards_by_id.update({str(card['id']): card for card in cards})
+        self.image_paths = {}
+        for info in RARITY_INFO.values():
+            for path in glob.glob(os.path.join(image_dir, info['subdir'], '*.jpg')):
+                self.image_paths.setdefault(os.path.basename(path).split('_', 1)[0], path)
+
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self.base_url = f"http://{host}:{self._httpd.server_address[1]}"
+        self._thread = None
+
+    def listing_url(self, rarity):
+        return f"{self.base_url}/cgss/card?r={rarity}&p=0"
+
+    def _roll(self):
+        with self._random_lock:
+            return self._random.random()
+
+    def _over_rate_limit(self):
+        """直近1秒間のリクエスト数が rate_limit を超えていれば True"""
+        if not self.rate_limit:
+            return False
+        now = time.monotonic()
+        with self._window_lock:
+            self._window = [t for t in self._window if now - t < 1.0]
+            if len(self._window) >= self.rate_limit:
+                return True
+            self._window.append(now)
+            return False
+
+    def respond(self, path):
+        """パスに対する (ステータス, Content-Type, ボディ, 追加ヘッダー) を返す"""
+        if self._over_rate_limit():
+            return 429, 'text/plain', b'Too Many Requests', {'Retry-After': '1'}
+        if self.error_rate and self._roll() < self.error_rate:
+            return 503, 'text/plain', b'Service Unavailable', {}
+
+        parts = urlsplit(path)
+        if parts.path == '/cgss/card':
+            query = parse_qs(parts.query)
+            rarity = query.get('r', [''])[0]
+            if rarity in self.cards_by_rarity:
+                page = int(query.get('p', ['0'])[0] or 0)
+                body = listing_page_html(self.base_url, rarity, self.cards_by_rarity[rarity], page, self.page_size)
+                return 200, 'text/html; charset=utf-8', body.encode('utf-8'), {}
+        match = DETAIL_PATH.match(parts.path)
+        if match and match.group(1) in self.cards_by_id:
+            body = detail_page_html(self.cards_by_id[match.group(1)])
+            return 200, 'text/html; charset=utf-8', body.encode('utf-8'), {}
+        match = IMAGE_PATH.match(parts.path)
+        if match and self.image_paths:
+            image_path = self.image_paths.get(match.group(1)) or next(iter(self.image_paths.values()))
+            with open(image_path, 'rb') as f:
+                return 200, 'image/jpeg', f.read(), {'ETag': f'"{match.group(1)}"'}
+        return 404, 'text/plain', b'Not Found', {}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _send(self, include_body):
+                if server.latency or server.jitter:
+                    time.sleep(server.latency + server._roll() * server.jitter)
+                status, content_type, body, headers = server.respond(self.path)
+                if status == 200 and headers.get('ETag') and self.headers.get('If-None-Match') == headers['ETag']:
+                    status, body = 304, b''
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                if include_body:
+                    self.wfile.write(body)
+                server.stats.add(status, len(body) if include_body else 0)
+
+            def do_GET(self):
+                self._send(include_body=True)
+
+            def do_HEAD(self):
+                self._send(include_body=False)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="mock-gamedbs", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """現在のスレッドで待ち受ける (Ctrl+C で終了)"""
+        try:
+            self._httpd.serve_forever()
+        finally:
+            self._httpd.server_close()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="カードCSVの内容から一覧/詳細ページと画像を返す、imas.gamedbs.jp の代わりのローカルHTTPサーバーを起動します (オフラインでの動作確認・計測用)。")
+    parser.add_argument("--port", type=int, default=8000, help="待ち受けるポート (デフォルト: 8000)")
+    parser.add_argument("--page-size", type=int, default=LISTING_PAGE_SIZE, help=f"一覧ページ1ページあたりのカード数 (デフォルト: {LISTING_PAGE_SIZE})")
+    parser.add_argument("--latency", type=float, default=MOCK_LATENCY, help="応答の遅延 (秒)")
+    parser.add_argument("--jitter", type=float, default=MOCK_JITTER, help="遅延の揺らぎ (秒)")
+    parser.add_argument("--error-rate", type=float, default=MOCK_ERROR_RATE, help="503 を返す割合 (0〜1)")
+    parser.add_argument("--rate-limit", type=float, default=MOCK_RATE_LIMIT, help="リクエスト数/秒の上限 (超えたら 429)")
+    args = parser.parse_args()
+
+    store = CardStore.load(CSV_DIRECTORY)
+    server = MockGamedbsServer(
+        store, port=args.port, page_size=args.page_size, latency=args.latency,
+        jitter=args.jitter, error_rate=args.error_rate, rate_limit=args.rate_limit,
+    )
+    print(f"モックサーバーを起動しました: {server.base_url}")
+    for rarity in store.rarities():
+        print(f"  {rarity}: {server.listing_url(rarity)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import atexit
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+# --- 設定項目 ---
+# --profile の結果 (<ジョブ名>.pstats / .collapsed / .profile.txt) を書き出すディレクトリ
+PROFILE_DIRECTORY = 'profiles'
+# 全スレッドのスタックを記録する間隔 (秒)
+SAMPLE_INTERVAL_SECONDS = 0.005
+# レポートに載せる関数・メモリ確保箇所の数
+REPORT_TOP_N = 30
+# --- ここまで設定項目 ---
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class StackSampler:
+    """一定間隔で全スレッドのスタックを記録し、flamegraph 用の collapsed 形式 (1行 = スタック 回数) にまとめる
+
+    cProfile はプロファイラーを有効にしたスレッドしか計測しないため、ワーカースレッドの
+    ホットパスはこちらで見る。待機中のスレッドも記録する (壁時計時間のサンプリング) ので、
+    ネットワーク待ちやスリープもスタックとして現れる。
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL_SECONDS):
+        self.interval = interval
+        self.counts = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(thread_names.get(ident, f"thread-{ident}"))
+                self.counts[';'.join(reversed(stack)).replace(' ', '_')] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.counts.most_common())
+
+
+class StageStats:
+    """stage() で囲んだ区間ごとの呼び出し回数・所要時間・メモリ使用量の増分のピーク"""
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.peak_bytes = None
+
+
+class ProfileSession:
+    """1回の実行の cProfile・スタックのサンプリング・tracemalloc・区間ごとの集計をまとめる"""
+
+    def __init__(self, job, directory=PROFILE_DIRECTORY, interval=SAMPLE_INTERVAL_SECONDS):
+        self.job = job
+        self.directory = directory
+        self.sampler = StackSampler(interval)
+        self.profiler = None
+        self.stages = {}
+        self._lock = threading.Lock()
+        self._open_stages = 0
+        # 区間の開始時に tracemalloc のピークを計測し直すため、それまでのピークをここに残す
+        self._peak_bytes = 0
+        self._started = None
+
+    def start(self):
+        tracemalloc.start()
+        self.profiler = cProfile.Profile()
+        try:
+            self.profiler.enable()
+        except ValueError as e:
+            # 別のプロファイラー (python -m cProfile など) が有効な場合は pstats を諦める
+            print(f"cProfile を有効にできませんでした: {e}", file=sys.stderr)
+            self.profiler = None
+        self.sampler.start()
+        self._started = time.perf_counter()
+
+    def enter_stage(self):
+        """区間の開始時に呼ぶ。他の区間が動いていなければメモリのピークを計測し直す"""
+        with self._lock:
+            exclusive = self._open_stages == 0
+            self._open_stages += 1
+            base = None
+            if exclusive:
+                self._peak_bytes = max(self._peak_bytes, tracemalloc.get_traced_memory()[1])
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+        return time.perf_counter(), base
+
+    def exit_stage(self, name, started, base):
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._open_stages -= 1
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = StageStats()
+            stats.calls += 1
+            stats.seconds += elapsed
+            if base is not None:
+                peak = tracemalloc.get_traced_memory()[1] - base
+                stats.peak_bytes = peak if stats.peak_bytes is None else max(stats.peak_bytes, peak)
+
+    def stop(self):
+        """計測を止めて結果のファイルを書き出し、パスのリストを返す"""
+        elapsed = time.perf_counter() - self._started
+        if self.profiler is not None:
+            self.profiler.disable()
+        self.sampler.stop()
+        peak_bytes = max(self._peak_bytes, tracemalloc.get_traced_memory()[1])
+        allocations = tracemalloc.take_snapshot().statistics('lineno')[:REPORT_TOP_N]
+        tracemalloc.stop()
+
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, self.job)
+        paths = []
+        if self.profiler is not None:
+            self.profiler.dump_stats(base + '.pstats')
+            paths.append(base + '.pstats')
+        with open(base + '.collapsed', 'w', encoding='utf-8') as f:
+            f.write(self.sampler.collapsed())
+        paths.append(base + '.collapsed')
+        with open(base + '.profile.txt', 'w', encoding='utf-8') as f:
+            f.write(self.report(elapsed, peak_bytes, allocations))
+        paths.append(base + '.profile.txt')
+        return paths
+
+    def report(self, elapsed, peak_bytes, allocations):
+        lines = [
+            f"ジョブ: {self.job}",
+            f"所要時間: {elapsed:.3f} 秒, tracemalloc のピーク: {peak_bytes / (1024 * 1024):.2f} MB, "
+            f"スタックのサンプル数: {self.sampler.samples}",
+            "",
+            "--- 区間ごとの集計 (時間は全スレッドの合計, メモリは他の区間と重ならなかった呼び出しの開始時からの増分のピーク) ---",
+            f"{'stage':<28} {'calls':>8} {'total s':>10} {'avg ms':>10} {'peak MB':>9}",
+        ]
+        for name, stats in sorted(self.stages.items(), key=lambda item: -item[1].seconds):
+            peak = f"{stats.peak_bytes / (1024 * 1024):.2f}" if stats.peak_bytes is not None else '-'
+            lines.append(f"{name:<28} {stats.calls:>8} {stats.seconds:>10.3f} {stats.seconds * 1000 / stats.calls:>10.3f} {peak:>9}")
+
+        if self.profiler is not None:
+            stream = io.StringIO()
+            pstats.Stats(self.profiler, stream=stream).sort_stats('cumulative').print_stats(REPORT_TOP_N)
+            lines += ["", "--- cProfile (メインスレッド, 累積時間順) ---", stream.getvalue().strip()]
+
+        lines += ["", "--- メモリ確保の多い箇所 (終了時点で確保されているもの) ---"]
+        lines += [str(statistic) for statistic in allocations]
+        return '\n'.join(lines) + '\n'
+
+
+@contextmanager
+def stage(name):
+    """プロファイル中なら with ブロックを name の区間として集計する (プロファイルしていなければ何もしない)"""
+    session = _session
+    if session is None:
+        yield
+        return
+    started, base = session.enter_stage()
+    try:
+        yield
+    finally:
+        session.exit_stage(name, started, base)
+
+
+def start_profile(job, directory=PROFILE_DIRECTORY):
+    """プロファイルを開始し、終了時 (finish_profile またはインタープリターの終了時) に結果を書き出す
+
+    既にプロファイル中なら何もしない (1プロセスで複数の処理を続けて実行する場合も1つの結果にまとめる)。
+    """
+    global _session
+    with _session_lock:
+        if _session is not None:
+            return _session
+        _session = ProfileSession(job, directory)
+        _session.start()
+    atexit.register(finish_profile)
+    print(f"プロファイルを開始しました (結果: {os.path.join(directory, job)}.*)", file=sys.stderr)
+    return _session
+
+
+def finish_profile():
+    """プロファイルを終了して結果を書き出し、パスのリストを返す。プロファイル中でなければ None"""
+    global _session
+    with _session_lock:
+        session, _session = _session, None
+    if session is None:
+        return None
+    paths = session.stop()
+    print(f"プロファイルの結果を書き出しました: {', '.join(paths)}", file=sys.stderr)
+    return paths
+
+
+def add_profile_arguments(parser):
+    """各スクリプト共通のプロファイル関連オプションを argparse に追加する"""
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="cProfile (pstats)・flamegraph 用の collapsed スタック・tracemalloc によるメモリのピークを取得し、"
+             "get_soup / extract_availability / determine_filter_category / CSV読み書き などの区間ごとに集計します。"
+    )
+    parser.add_argument(
+        "--profile-dir",
+        default=PROFILE_DIRECTORY,
+        help=f"--profile の結果を書き出すディレクトリ (デフォルト: {PROFILE_DIRECTORY})"
+    )
+
+
+def start_profile_from_args(args, job):
+    """--profile が指定されていればプロファイルを開始する"""
+    if not args.profile:
+        return None
+    return start_profile(job, directory=args.profile_dir)
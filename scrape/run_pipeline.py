@@ -0,0 +1,291 @@
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from card_store import CardStore, RARITY_INFO, CSV_DIRECTORY, apply_schema
+from card_db import add_database_argument, open_database_from_args
+from checkpoint import CheckpointJournal
+from http_client import PoliteClient, add_adaptive_arguments, adaptive_options_from_args
+from http_cache import add_cache_arguments, wrap_client_from_args
+from image_store import ImageStore
+from html_parsing import add_parser_argument, set_parser_backend
+import metrics
+from metrics import add_metrics_arguments, dump_metrics_from_args
+import profiling
+from profiling import add_profile_arguments, start_profile_from_args
+import scrape_cgss
+import collect_attribute_card_ids
+import update_csv_with_attributes
+import add_availability_to_csv
+import categorize_availability
+import download_cgss_images_cli
+import build_image_derivatives
+
+# --- 設定項目 ---
+# 全ステージ共通のリクエスト数/秒の上限 (--rate で上書き可能)
+PIPELINE_RATE_PER_SECOND = 2.0
+# 詳細ページ取得・画像ダウンロードの並列数 (--workers で上書き可能)
+PIPELINE_WORKERS = 4
+# --- ここまで設定項目 ---
+
+# 実行順に並べたステージ名
+STAGES = ['scrape', 'attributes', 'availability', 'categorize', 'images', 'derivatives']
+
+
+def merge_scraped_cards(existing_df, cards):
+    """一覧を全件取得し直した結果で基本列を置き換え、既存カードのそれ以外の列 (availability など) は引き継ぐ"""
+    scraped_df = scrape_cgss.cards_to_dataframe(cards)
+    carried_columns = [column for column in existing_df.columns if column not in scrape_cgss.BASE_COLUMNS]
+    if carried_columns:
+        scraped_df = scraped_df.merge(existing_df[['id'] + carried_columns], on='id', how='left')
+    return scraped_df
+
+
+def run_scrape_stage(store, client, full=False):
+    """全レアリティの一覧を並列にクロールし、ストアのカードを追加/更新する
+
+    既存カードがあるレアリティは新着カードのみを取得する (full=True なら全件取得し直す)。
+    """
+    def scrape_one(rarity):
+        target_info = scrape_cgss.RARITY_TARGETS[rarity]
+        existing_df = store.get(rarity)
+        if full or existing_df.empty:
+            cards = scrape_cgss.crawl_rarity(rarity, target_info, client=client)
+            if not cards:
+                print(f"{rarity}: カードを取得できなかったため、既存のデータをそのまま使います。")
+                return None
+            return merge_scraped_cards(existing_df, cards)
+        known_ids = set(existing_df['id'].astype(str))
+        new_cards = scrape_cgss.crawl_new_cards(rarity, target_info, known_ids, client=client)
+        if not new_cards:
+            print(f"No new cards for Rarity: {rarity}.")
+            return None
+        print(f"Found {len(new_cards)} new cards for Rarity: {rarity}.")
+        return scrape_cgss.merge_new_cards(existing_df, new_cards)
+
+    rarities = store.rarities()
+    with ThreadPoolExecutor(max_workers=len(rarities)) as executor:
+        results = dict(zip(rarities, executor.map(scrape_one, rarities)))
+    for rarity, df in results.items():
+        if df is not None:
+            store.set(rarity, apply_schema(df))
+
+
+def run_attributes_stage(store, client, crawl=True):
+    """属性別一覧からカードIDを集めて attribute 列を更新する (crawl=False なら保存済みの属性IDマップを使う)"""
+    if crawl:
+        targets = collect_attribute_card_ids.ATTRIBUTE_TARGETS
+        with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+            futures = {
+                attr_key: executor.submit(collect_attribute_card_ids.collect_single_attribute, attr_key, target_info, client)
+                for attr_key, target_info in targets.items()
+            }
+            attribute_id_map = {attr_key: future.result() for attr_key, future in futures.items()}
+        collect_attribute_card_ids.save_attribute_card_ids(attribute_id_map)
+    else:
+        attribute_id_map = update_csv_with_attributes.load_attribute_id_map()
+        print(f"属性カードIDマップを '{update_csv_with_attributes.ATTRIBUTE_ID_MAP_FILE}' から読み込みました。")
+
+    id_to_attribute, conflicts = update_csv_with_attributes.invert_attribute_id_map(attribute_id_map)
+    update_csv_with_attributes.report_attribute_conflicts(conflicts)
+    for rarity in store.rarities():
+        assigned_count = update_csv_with_attributes.assign_attributes(store.get(rarity), attribute_id_map, id_to_attribute)
+        store.mark_dirty(rarity)
+        print(f"  {rarity}: {assigned_count} 件のカードに具体的な属性を新規/更新割り当てしました。")
+
+
+def run_availability_stage(store, client, workers, max_retries, refresh_fields=False):
+    """詳細ページから availability などの列を更新し、使用したジャーナルのリストを返す
+
+    ジャーナルはストアを保存した後で削除する (保存前に止まった場合は次回の実行で再利用される)。
+    """
+    journals = []
+    for rarity in store.rarities():
+        print(f"\n--- {rarity} の「主な入手方法」情報を処理中 ---")
+        if store.database is not None:
+            # データベース使用時は先のステージの結果を行単位で反映してから、取得対象を索引で引き、
+            # 結果を1件ずつ行に書き込む (ジャーナルファイルは不要)
+            store.database.write_frame(rarity, store.get(rarity))
+            updated_count = add_availability_to_csv.enrich_database(
+                store.database, rarity, client,
+                workers=workers, max_retries=max_retries, refresh_fields=refresh_fields,
+            )
+            store.set(rarity, store.database.read_frame(rarity))
+        else:
+            journal = CheckpointJournal.for_csv(store.path_for(rarity))
+            updated_count = add_availability_to_csv.enrich_dataframe(
+                store.get(rarity), client, journal,
+                workers=workers, max_retries=max_retries, refresh_fields=refresh_fields,
+            )
+            store.mark_dirty(rarity)
+            journals.append(journal)
+        print(f"  {rarity}: {updated_count} 件のカードに「主な入手方法」を新規/更新割り当てしました。")
+    return journals
+
+
+def run_categorize_stage(store, use_cache=True):
+    """availability 列から filter_category 列を判定し直す"""
+    memo = None
+    if use_cache:
+        memo = categorize_availability.CategoryMemo(os.path.join(store.directory, categorize_availability.CATEGORY_CACHE_FILENAME))
+    for rarity in store.rarities():
+        applied_count, changed_to_specific_count = categorize_availability.categorize_dataframe(
+            store.get(rarity), RARITY_INFO[rarity]["is_N_or_R"], memo
+        )
+        store.mark_dirty(rarity)
+        print(f"  {rarity}: {applied_count} 件のカテゴリが変更され、うち {changed_to_specific_count} 件が具体的なカテゴリに設定/更新されました。")
+    if memo:
+        memo.save()
+        print(f"判定キャッシュ: 新規判定 {memo.evaluated_count} 件, キャッシュ利用 {memo.hit_count} 件 ({memo.path})")
+
+
+def run_images_stage(store, polite_client, workers, revalidate=False):
+    """ストアのカードの画像をダウンロードする (CSVは更新しない)
+
+    revalidate=True の場合、ダウンロード済みの画像も条件付きリクエストで更新を確かめる。
+    """
+    image_store = ImageStore(image_directory=download_cgss_images_cli.IMAGE_SAVE_DIRECTORY_BASE)
+    for rarity in store.rarities():
+        save_dir = os.path.join(download_cgss_images_cli.IMAGE_SAVE_DIRECTORY_BASE, RARITY_INFO[rarity]["subdir"])
+        os.makedirs(save_dir, exist_ok=True)
+        print(f"\n--- {rarity} の画像ダウンロード処理を開始します ---")
+        counts = download_cgss_images_cli.download_rarity_images(
+            store.get(rarity), rarity, save_dir, polite_client, workers=workers, store=image_store, revalidate=revalidate
+        )
+        print(f"  処理数: {counts['processed']}, ダウンロード成功: {counts['downloaded']}, スキップ: {counts['skipped']}, 失敗: {counts['failed']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="カードCSVを1回だけ読み込み、一覧取得 → 属性 → 入手方法 → カテゴリ判定 → 画像 → 派生画像 の各ステージを1プロセスで続けて実行し、各CSVを最後に1回だけ書き出します。"
+    )
+    parser.add_argument(
+        "--stages",
+        nargs='+',
+        choices=STAGES,
+        default=STAGES,
+        help=f"実行するステージ (指定順によらず {' → '.join(STAGES)} の順に実行, デフォルト: 全て)"
+    )
+    parser.add_argument(
+        "-r", "--rarity",
+        nargs='+',
+        choices=RARITY_INFO.keys(),
+        default=list(RARITY_INFO.keys()),
+        help="処理するレアリティ (デフォルト: 全て)"
+    )
+    parser.add_argument(
+        "-w", "--workers",
+        type=int,
+        default=PIPELINE_WORKERS,
+        help=f"詳細ページ取得・画像ダウンロードの並列数 (デフォルト: {PIPELINE_WORKERS})"
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=PIPELINE_RATE_PER_SECOND,
+        help=f"全ステージ共通のリクエスト数/秒の上限 (デフォルト: {PIPELINE_RATE_PER_SECOND})"
+    )
+    parser.add_argument(
+        "--full-scrape",
+        action="store_true",
+        help="新着カードのみではなく一覧を全件取得し直します (既存カードの入手方法などの列は引き継ぎます)。"
+    )
+    parser.add_argument(
+        "--reuse-attribute-map",
+        action="store_true",
+        help=f"属性別一覧をクロールせず、保存済みの {update_csv_with_attributes.ATTRIBUTE_ID_MAP_FILE} を使います。"
+    )
+    parser.add_argument(
+        "--refresh-fields",
+        action="store_true",
+        help="有効な入手方法が既にあるカードも詳細ページを取得し直します。"
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=add_availability_to_csv.MAX_FETCH_RETRIES,
+        help=f"詳細ページ取得の再試行回数の上限 (デフォルト: {add_availability_to_csv.MAX_FETCH_RETRIES})"
+    )
+    parser.add_argument(
+        "--no-category-cache",
+        action="store_true",
+        help="保存済みのカテゴリ判定結果を使わずに全行を判定し直します。"
+    )
+    add_database_argument(parser)
+    parser.add_argument(
+        "--revalidate-images",
+        action="store_true",
+        help="images ステージで、ダウンロード済みの画像も条件付きリクエストで更新を確かめます。"
+    )
+    add_cache_arguments(parser)
+    add_parser_argument(parser)
+    add_adaptive_arguments(parser)
+    add_metrics_arguments(parser)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    set_parser_backend(args.parser)
+    start_profile_from_args(args, 'run_pipeline')
+
+    if args.rate <= 0:
+        parser.error("--rate には正の値を指定してください。")
+    workers = max(1, args.workers)
+    stages = [stage for stage in STAGES if stage in args.stages]
+    rarities = [rarity for rarity in RARITY_INFO if rarity in args.rarity]
+
+    database = open_database_from_args(args)
+    store = CardStore.load(CSV_DIRECTORY, rarities=rarities, database=database)
+    print("カードデータを読み込みました: " + ", ".join(f"{rarity} {len(store.get(rarity))} 件" for rarity in store.rarities()))
+    print(f"実行するステージ: {' → '.join(stages)} (並列数: {workers}, レート上限: {args.rate:.2f} リクエスト/秒"
+          + (")" if args.no_adaptive else ", サーバーの応答に合わせて自動調整)"))
+
+    journals = []
+    with PoliteClient(rate=args.rate, max_per_host=workers, pool_size=workers, **adaptive_options_from_args(args)) as polite_client:
+        client = wrap_client_from_args(args, polite_client)
+        # 自動調整で同時接続数を上げられるよう、スレッドは上限の数だけ用意する
+        threads = polite_client.max_concurrency
+
+        if 'scrape' in stages:
+            print("\n=== scrape: 一覧ページから新着カードを取得 ===")
+            with metrics.timer('stage_duration_ms', stage='scrape'), profiling.stage('pipeline:scrape'):
+                run_scrape_stage(store, client, full=args.full_scrape)
+        if 'attributes' in stages:
+            print("\n=== attributes: 属性を割り当て ===")
+            with metrics.timer('stage_duration_ms', stage='attributes'), profiling.stage('pipeline:attributes'):
+                run_attributes_stage(store, client, crawl=not args.reuse_attribute_map)
+        if 'availability' in stages:
+            print("\n=== availability: 詳細ページから入手方法などを取得 ===")
+            with metrics.timer('stage_duration_ms', stage='availability'), profiling.stage('pipeline:availability'):
+                journals = run_availability_stage(store, client, threads, args.max_retries, refresh_fields=args.refresh_fields)
+        if 'categorize' in stages:
+            print("\n=== categorize: フィルターカテゴリを判定 ===")
+            with metrics.timer('stage_duration_ms', stage='categorize'), profiling.stage('pipeline:categorize'):
+                run_categorize_stage(store, use_cache=not args.no_category_cache)
+
+        # 画像ステージはCSVを更新しないので、その前に各CSVを1回だけ書き出す
+        written = store.save()
+        for journal in journals:
+            journal.discard()
+        for csv_path in written:
+            print(f"{csv_path} を保存しました。")
+
+        if 'images' in stages:
+            print("\n=== images: 画像をダウンロード ===")
+            with metrics.timer('stage_duration_ms', stage='images'), profiling.stage('pipeline:images'):
+                run_images_stage(store, polite_client, threads, revalidate=args.revalidate_images)
+
+    if 'derivatives' in stages:
+        print("\n=== derivatives: 縮小版・WebP/AVIF 版の画像を生成 ===")
+        if build_image_derivatives.HAS_PILLOW:
+            counts = build_image_derivatives.build_derivatives(rarities=store.rarities())
+            print(f"  生成: {counts['generated']} 枚, スキップ (変更なし): {counts['skipped']} 枚, 失敗: {counts['failed']} 枚")
+        else:
+            print("  Pillow がインストールされていないため省略します (pip install Pillow)。")
+
+    if database is not None:
+        database.close()
+    print("\n全てのステージが完了しました。")
+    dump_metrics_from_args(args, 'run_pipeline')
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,33 @@
 import requests
-from bs4 import BeautifulSoup
 import time
 import pandas as pd
 import re
+import os
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urljoin, urlparse, parse_qs, urlencode, urlunparse
 
+import metrics
+from metrics import add_metrics_arguments, dump_metrics_from_args
+import profiling
+from profiling import add_profile_arguments, start_profile_from_args
+from csv_io import read_csv, write_csv_atomic
+from card_db import add_database_argument, open_database_from_args
+from http_client import PoliteClient, USER_AGENT, record_response, record_request_error, add_adaptive_arguments, adaptive_options_from_args
+from http_cache import add_cache_arguments, wrap_client_from_args
+from html_parsing import make_soup, add_parser_argument, set_parser_backend
+
 BASE_URL = "https://imas.gamedbs.jp"
+# 並列クロール時の全体のリクエスト数/秒の上限 (--rate で上書き可能)
+CRAWL_RATE_PER_SECOND = 2.0
+# 並列クロール時の1ホストあたりの同時接続数
+CRAWL_MAX_CONNECTIONS_PER_HOST = 4
+# 逐次クロール (--parallel なし) のリクエスト数/秒 (ページ間1秒の待機に相当, 自動調整ではその初期値)
+SEQUENTIAL_RATE_PER_SECOND = 1.0
+# 差分取得 (--incremental) 時に一覧を新しい順に並べるための並び順パラメータ (s) の値
+NEWEST_FIRST_SORT_VALUE = "1"
+# CSVの基本列 (attribute / availability / filter_category は後続スクリプトが追加する)
+BASE_COLUMNS = ['id', 'name', 'rarity', 'image_url', 'detail_url']
 
 # 各レアリティの情報を辞書として定義
 RARITY_TARGETS = {
@@ -31,26 +53,42 @@ RARITY_TARGETS = {
     }
 }
 
-def get_soup(url):
-    """指定されたURLからHTMLを取得し、BeautifulSoupオブジェクトを返す"""
-    try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=15)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
-        return soup
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching {url}: {e}")
-        return None
-
-def scrape_cards_from_page(page_url, current_rarity_label):
+def get_soup(url, client=None, page_kind=None):
+    """指定されたURLからHTMLを取得し、BeautifulSoupオブジェクトを返す
+
+    client (PoliteClient) を渡した場合は共有セッションとレート制限を使う。
+    page_kind は html_parsing.make_soup に渡すページ種別 ('listing' / 'detail')。
+    """
+    with profiling.stage('get_soup'):
+        try:
+            # client (PoliteClient) のセッションは User-Agent に http_client.USER_AGENT を送る
+            if client:
+                response = client.get(url, timeout=15)
+            else:
+                start = time.perf_counter()
+                try:
+                    response = requests.get(url, headers={'User-Agent': USER_AGENT}, timeout=15)
+                except requests.exceptions.RequestException as e:
+                    record_request_error(url, e)
+                    raise
+                record_response(url, response, (time.perf_counter() - start) * 1000)
+            response.raise_for_status()
+            soup = make_soup(response.content, page_kind=page_kind)
+            return soup
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching {url}: {e}")
+            return None
+
+def scrape_cards_from_page(page_url, current_rarity_label, client=None):
     """1ページ分のカード情報をスクレイピングする"""
-    soup = get_soup(page_url)
+    soup = get_soup(page_url, client=client, page_kind='listing')
     if not soup:
         return [], None
+    with metrics.timer('extract_ms', page_kind='listing'):
+        return parse_listing_page(soup, page_url, current_rarity_label)
 
+def parse_listing_page(soup, page_url, current_rarity_label):
+    """一覧ページのSoupから (カード情報のリスト, 次ページのURL) を抽出する"""
     cards_data = []
     card_list_ul = soup.select_one('ul.dblst.flexbox.flexwrap')
     if not card_list_ul:
@@ -131,12 +169,14 @@ def scrape_cards_from_page(page_url, current_rarity_label):
                 next_page_url = urljoin(page_url, next_href) # page_url を基準にする
     return cards_data, next_page_url
 
-def scrape_rarity(rarity_key, target_info):
-    """指定されたレアリティのカードをスクレイピングする"""
+def crawl_rarity(rarity_key, target_info, client=None):
+    """指定されたレアリティの一覧を全ページたどり、取得したカードのリストを返す (保存はしない)
+
+    client を渡した場合はページ間の固定待機を行わず、client のレート制限に任せる。
+    """
     all_cards = []
     current_url = target_info["url"]
     rarity_label = target_info["rarity_label"]
-    output_filename = target_info["filename"]
     page_num = 1
 
     print(f"\n--- Starting scrape for Rarity: {rarity_key} ---")
@@ -144,7 +184,7 @@ def scrape_rarity(rarity_key, target_info):
 
     while current_url:
         print(f"Scraping page {page_num} for {rarity_key}: {current_url}")
-        cards_on_page, next_url = scrape_cards_from_page(current_url, rarity_label)
+        cards_on_page, next_url = scrape_cards_from_page(current_url, rarity_label, client=client)
 
         if cards_on_page:
             all_cards.extend(cards_on_page)
@@ -160,24 +200,47 @@ def scrape_rarity(rarity_key, target_info):
             # if page_num >= 2: # テスト用
             #     print(f"Reached page limit for {rarity_key} testing.")
             #     break
-            print(f"Waiting 1 second before next page...")
-            time.sleep(1)
+            if client is None:
+                print(f"Waiting 1 second before next page...")
+                metrics.sleep(1, reason='page_interval')
         else:
             if all_cards or cards_on_page :
                  print(f"No more pages found or finished scraping for {rarity_key}.")
         
         page_num += 1
 
+    return all_cards
+
+def cards_to_dataframe(cards):
+    """一覧ページから取得したカードのリストを BASE_COLUMNS の DataFrame (id は整数) にする"""
+    df = pd.DataFrame(cards, columns=BASE_COLUMNS)
+    df['id'] = df['id'].astype(int)
+    return df
+
+def save_rarity_frame(rarity_key, df, output_filename, database=None):
+    """レアリティの DataFrame をCSVに保存する
+
+    database (card_db.CardDatabase) があれば変わった行だけをデータベースに書き込み、その内容でCSVを書き出す。
+    """
+    if database is None:
+        write_csv_atomic(df, output_filename)
+    else:
+        database.write_frame(rarity_key, df)
+        database.export_csvs(os.path.dirname(output_filename) or '.', [rarity_key])
+
+def scrape_rarity(rarity_key, target_info, client=None, database=None):
+    """指定されたレアリティのカードをスクレイピングしてCSVに保存し、取得したカードのリストを返す"""
+    output_filename = target_info["filename"]
+    all_cards = crawl_rarity(rarity_key, target_info, client=client)
+
     if not all_cards:
         print(f"\nNo cards were scraped for Rarity: {rarity_key}.")
-        return
+        return all_cards
 
-    df = pd.DataFrame(all_cards)
-    if not df.empty:
-        df = df[['id', 'name', 'rarity', 'image_url', 'detail_url']]
+    df = cards_to_dataframe(all_cards)
 
     try:
-        df.to_csv(output_filename, index=False, encoding='utf-8-sig')
+        save_rarity_frame(rarity_key, df, output_filename, database)
         print(f"\nSuccessfully scraped {len(all_cards)} cards for Rarity: {rarity_key}.")
         print(f"Data saved to {output_filename}")
     except Exception as e:
@@ -185,15 +248,199 @@ def scrape_rarity(rarity_key, target_info):
         print(f"\nScraped data for {rarity_key} (first 5 entries):")
         for i, card in enumerate(all_cards[:5]):
             print(card)
+    return all_cards
+
+def with_query_param(url, key, value):
+    """URLのクエリパラメータ key を value に置き換えたURLを返す"""
+    parsed = urlparse(url)
+    query = parse_qs(parsed.query, keep_blank_values=True)
+    query[key] = [value]
+    return urlunparse(parsed._replace(query=urlencode(query, doseq=True)))
+
+def load_known_ids(csv_path):
+    """既存CSVを読み込み、(DataFrame, ID文字列の集合) を返す。CSVがなければ (None, 空集合)"""
+    if not os.path.exists(csv_path):
+        return None, set()
+    existing_df = read_csv(csv_path)
+    if 'id' not in existing_df.columns:
+        return existing_df, set()
+    return existing_df, set(existing_df['id'].dropna().astype(str))
+
+def crawl_new_cards(rarity_key, target_info, known_ids, client=None):
+    """一覧を新しい順にたどり、known_ids (ID文字列の集合) にないカードのリストを返す (保存はしない)
+
+    既知のIDしか含まないページに到達した時点で打ち切る。ただし1ページ目がIDの降順 (新しい順) に
+    並んでいることを確かめられなかった場合は、打ち切らずに全ページを確認する。
+    """
+    rarity_label = target_info["rarity_label"]
+    current_url = with_query_param(target_info["url"], "s", NEWEST_FIRST_SORT_VALUE)
+    page_num = 1
+    early_stop = False
+    new_cards = []
+    seen_ids = set()
+
+    print(f"\n--- Starting incremental scrape for Rarity: {rarity_key} ({len(known_ids)} known cards) ---")
+
+    while current_url:
+        print(f"Scraping page {page_num} for {rarity_key}: {current_url}")
+        cards_on_page, next_url = scrape_cards_from_page(current_url, rarity_label, client=client)
+        page_ids = [int(card['id']) for card in cards_on_page]
+
+        if page_num == 1:
+            # 並び順パラメータ (NEWEST_FIRST_SORT_VALUE) が期待どおり効いている場合だけ打ち切り判定を使う
+            # (古い順や名前順などのままだと、既知のカードだけのページの後にも新着カードがありうる)
+            early_stop = len(page_ids) > 1 and all(a > b for a, b in zip(page_ids, page_ids[1:]))
+            if not early_stop:
+                print(f"Warning: {rarity_key} の一覧がIDの降順 (新しい順) になっていません。打ち切りせずに全ページを確認します。")
+
+        page_new_cards = [
+            card for card in cards_on_page
+            if card['id'] not in known_ids and card['id'] not in seen_ids
+        ]
+        seen_ids.update(card['id'] for card in page_new_cards)
+        new_cards.extend(page_new_cards)
+        print(f"Found {len(page_new_cards)} new cards on this page.")
+
+        if early_stop and cards_on_page and not page_new_cards:
+            print(f"Page {page_num} contains only known cards. Stopping.")
+            break
+
+        current_url = next_url
+        if current_url and client is None:
+            metrics.sleep(1, reason='page_interval')
+        page_num += 1
+
+    return new_cards
+
+def merge_new_cards(existing_df, new_cards):
+    """既存の DataFrame に新着カードの行を追加し、id 順に並べ直した DataFrame を返す
+
+    既存行の attribute / availability / filter_category などの列はそのまま保持し、
+    新規行のそれらの列は空欄のまま後続の処理に任せる。
+    """
+    merged_df = pd.concat([existing_df, cards_to_dataframe(new_cards)], ignore_index=True)
+    return merged_df.sort_values('id', kind='stable').reset_index(drop=True)
+
+def scrape_rarity_incremental(rarity_key, target_info, client=None, database=None):
+    """新着カードのみを取得して既存CSVに追記し、追加したカードのリストを返す"""
+    output_filename = target_info["filename"]
+    if database is not None and rarity_key in database.rarities():
+        # 既知のIDはCSVを読まずにデータベースの索引 (rarity_key) で引く
+        existing_df = database.read_frame(rarity_key)
+        known_ids = {str(card_id) for card_id in database.card_ids(rarity_key)}
+    else:
+        existing_df, known_ids = load_known_ids(output_filename)
+
+    if existing_df is None or not known_ids:
+        print(f"\n{output_filename} が存在しないか空のため、{rarity_key} は全件取得します。")
+        return scrape_rarity(rarity_key, target_info, client=client, database=database)
+
+    new_cards = crawl_new_cards(rarity_key, target_info, known_ids, client=client)
+    if not new_cards:
+        print(f"No new cards for Rarity: {rarity_key}.")
+        return []
+
+    merged_df = merge_new_cards(existing_df, new_cards)
+    new_ids = sorted((card['id'] for card in new_cards), key=int)
+
+    try:
+        save_rarity_frame(rarity_key, merged_df, output_filename, database)
+        print(f"\nAppended {len(new_cards)} new cards for Rarity: {rarity_key} (IDs: {', '.join(new_ids)}).")
+        print(f"Data saved to {output_filename}")
+    except Exception as e:
+        print(f"Error saving {rarity_key} to CSV {output_filename}: {e}")
+    return new_cards
+
+def scrape_all_parallel(client, with_attributes=False, incremental=False, database=None):
+    """全レアリティ (と属性) の一覧ページを並列にクロールする
+
+    各一覧は「次のページ」リンクを順にたどるため一覧内は逐次だが、
+    一覧同士は1つの client (共有セッション・共有レート制限) の下で同時に進む。
+    全ての一覧が1つのレート制限を共有するため、所要時間はおおよそ 全一覧の合計ページ数 / レート になる
+    (逐次クロールとの差は、ページ間の待機にほかの一覧のリクエストを詰められること)。
+    """
+    import collect_attribute_card_ids
+
+    scrape_func = scrape_rarity_incremental if incremental else scrape_rarity
+    num_jobs = len(RARITY_TARGETS) + (len(collect_attribute_card_ids.ATTRIBUTE_TARGETS) if with_attributes else 0)
+    with ThreadPoolExecutor(max_workers=num_jobs) as executor:
+        rarity_futures = {
+            rarity_key: executor.submit(scrape_func, rarity_key, target_info, client, database)
+            for rarity_key, target_info in RARITY_TARGETS.items()
+        }
+        attribute_futures = {}
+        if with_attributes:
+            attribute_futures = {
+                attr_key: executor.submit(collect_attribute_card_ids.collect_single_attribute, attr_key, target_info, client)
+                for attr_key, target_info in collect_attribute_card_ids.ATTRIBUTE_TARGETS.items()
+            }
+
+        for rarity_key, future in rarity_futures.items():
+            future.result()
+
+        if with_attributes:
+            attribute_id_map = {attr_key: future.result() for attr_key, future in attribute_futures.items()}
+            collect_attribute_card_ids.save_attribute_card_ids(attribute_id_map)
 
 def main():
-    for rarity_key, target_info in RARITY_TARGETS.items():
-        scrape_rarity(rarity_key, target_info)
-        if rarity_key != list(RARITY_TARGETS.keys())[-1]:
-            print("\nWaiting 3 seconds before starting next rarity...\n")
-            time.sleep(3)
+    parser = argparse.ArgumentParser(description="imas.gamedbs.jp からデレステのカード一覧をレアリティ別CSVに保存します。")
+    parser.add_argument(
+        "--parallel",
+        action="store_true",
+        help="全レアリティの一覧を共有レート制限の下で並列にクロールします。"
+    )
+    parser.add_argument(
+        "--with-attributes",
+        action="store_true",
+        help="--parallel と併用し、属性別一覧 (collect_attribute_card_ids.py 相当) も同時にクロールして attribute_card_ids.json を更新します。"
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=CRAWL_RATE_PER_SECOND,
+        help=f"--parallel 時の全体のリクエスト数/秒の上限 (デフォルト: {CRAWL_RATE_PER_SECOND})"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="既存CSVにない新着カードのみを取得して追記します。既知のカードだけのページに達した時点で打ち切ります。"
+    )
+    add_database_argument(parser)
+    add_cache_arguments(parser)
+    add_parser_argument(parser)
+    add_adaptive_arguments(parser)
+    add_metrics_arguments(parser)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    set_parser_backend(args.parser)
+    start_profile_from_args(args, 'scrape_cgss')
+
+    if args.with_attributes and not args.parallel:
+        parser.error("--with-attributes は --parallel と併用してください。")
+    if args.rate <= 0:
+        parser.error("--rate には正の値を指定してください。")
+
+    database = open_database_from_args(args)
+    if database is not None:
+        database.import_csvs()
+
+    if args.parallel:
+        with PoliteClient(rate=args.rate, max_per_host=CRAWL_MAX_CONNECTIONS_PER_HOST, **adaptive_options_from_args(args)) as polite_client:
+            client = wrap_client_from_args(args, polite_client)
+            scrape_all_parallel(client, with_attributes=args.with_attributes, incremental=args.incremental, database=database)
+    else:
+        # 固定の待機ではなく、実際にネットワークへ出るリクエストだけをレート制限する
+        # (--no-adaptive なら従来どおり1秒に1リクエスト、それ以外はサーバーの応答に合わせて調整する)
+        with PoliteClient(rate=SEQUENTIAL_RATE_PER_SECOND, max_per_host=1, **adaptive_options_from_args(args)) as polite_client:
+            client = wrap_client_from_args(args, polite_client)
+            scrape_func = scrape_rarity_incremental if args.incremental else scrape_rarity
+            for rarity_key, target_info in RARITY_TARGETS.items():
+                scrape_func(rarity_key, target_info, client=client, database=database)
 
+    if database is not None:
+        database.close()
     print("\n\nAll scraping tasks completed.")
+    dump_metrics_from_args(args, 'scrape_cgss')
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -1,6 +1,12 @@
 import pandas as pd
 import json
 import os
+import argparse
+
+import profiling
+from profiling import add_profile_arguments, start_profile_from_args
+from csv_io import read_csv, write_csv_atomic
+from card_db import add_database_argument, open_database_from_args
 
 CSV_DIRECTORY = '.' # レアリティ別CSVがあるディレクトリ
 ATTRIBUTE_ID_MAP_FILE = "attribute_card_ids.json"
@@ -13,12 +19,97 @@ RARITY_CSV_FILES = [
     "cgss_n_card_list.csv",
 ]
 
+def load_attribute_id_map(path=ATTRIBUTE_ID_MAP_FILE):
+    """属性IDマップ (属性 → カードIDの集合) を読み込む"""
+    with open(path, "r", encoding="utf-8") as f:
+        json_data = json.load(f)
+    return {k: set(v) for k, v in json_data.items()}
+
+def invert_attribute_id_map(attribute_id_map):
+    """属性IDマップ (属性 → カードIDの集合) を カードID → 属性 の辞書に反転し、(辞書, 重複) を返す
+
+    複数の属性に含まれるカードIDは、マップで先に現れる属性を採用する。
+    重複は {カードID: [属性, ...]} (マップでの出現順) として返す。
+    """
+    id_to_attribute = {}
+    conflicts = {}
+    for attr_label, card_ids in attribute_id_map.items():
+        for card_id in card_ids:
+            card_id = str(card_id)
+            if card_id in id_to_attribute:
+                conflicts.setdefault(card_id, [id_to_attribute[card_id]]).append(attr_label)
+            else:
+                id_to_attribute[card_id] = attr_label
+    return id_to_attribute, conflicts
+
+def report_attribute_conflicts(conflicts):
+    """複数の属性に含まれるカードIDを表示する"""
+    if not conflicts:
+        return
+    print(f"  Warning: {len(conflicts)} 件のカードIDが複数の属性に含まれています (先の属性を採用します)。")
+    for card_id, attr_labels in sorted(conflicts.items(), key=lambda item: int(item[0]) if item[0].isdigit() else 0):
+        print(f"    ID {card_id}: {' / '.join(attr_labels)} -> {attr_labels[0]}")
+
+def assign_attributes(df, attribute_id_map, id_to_attribute=None):
+    """df の attribute 列を属性IDマップに従って更新し、具体的な属性を新規/更新割り当てした件数を返す
+
+    カードID → 属性 の辞書 (invert_attribute_id_map の結果) を id 列に map するだけで、行ごとのループは行わない。
+    複数ファイルに適用する場合は id_to_attribute に反転済みの辞書を渡すと反転を1回で済ませられる。
+    """
+    if 'attribute' not in df.columns:
+        # 文字列を書き込めるよう object 型で追加する
+        df['attribute'] = pd.Series(pd.NA, index=df.index, dtype=object)
+    elif df['attribute'].dtype != object:
+        # 全行が空だと float 列として読まれるため、文字列を書き込めるよう object 型にする
+        df['attribute'] = df['attribute'].astype(object)
+    if id_to_attribute is None:
+        id_to_attribute, _ = invert_attribute_id_map(attribute_id_map)
+
+    current = df['attribute']
+    assigned = df['id'].astype(str).map(id_to_attribute)
+    found = assigned.notna()
+    # 新しい属性が見つかり、現在の値と異なる行
+    changed = found & (current.isna() | (current.astype(str) != assigned.astype(str)))
+
+    # ポリシー: 属性情報が取得できない場合は"Unknown"にする
+    # (以前Cu/Co/Paだったものが、今回見つからなかった場合も"Unknown"になる)
+    vanished = ~found & current.notna() & (current != "Unknown")
+    names = df['name'] if 'name' in df.columns else pd.Series('', index=df.index)
+    for card_id, name, previous in zip(df['id'][vanished], names[vanished], current[vanished]):
+        print(f"  Warning: ID {card_id} ({name}) は以前属性 ({previous}) でしたが、今回属性が見つかりませんでした。'Unknown'に設定します。")
+
+    df['attribute'] = assigned.where(found, "Unknown").astype(object)
+    return int(changed.sum())
+
+def update_database_attributes(db, attribute_id_map, id_to_attribute):
+    """カードデータベース (card_db.CardDatabase) の各レアリティの attribute 列を更新し、CSVを書き出す
+
+    属性が変わった行だけをトランザクションで書き込み、属性が Unknown のカードは索引で引いて表示する。
+    """
+    for rarity in db.import_csvs(CSV_DIRECTORY):
+        print(f"{rarity} のCSVをデータベース ({db.path}) に取り込みました。")
+    for rarity in db.rarities():
+        print(f"\n--- {rarity} の属性情報を更新中 (データベース: {db.path}) ---")
+        df = db.read_frame(rarity)
+        with profiling.stage('assign_attributes'):
+            attributes_assigned_count = assign_attributes(df, attribute_id_map, id_to_attribute)
+        written_count, _ = db.write_frame(rarity, df)
+        db.export_csvs(CSV_DIRECTORY, [rarity])
+        print(f"  {rarity}: {attributes_assigned_count} 件のカードに具体的な属性を新規/更新割り当てしました (書き込んだ行: {written_count} 件)。")
+        unknown_ids = db.card_ids(rarity, attribute="Unknown")
+        if unknown_ids:
+            print(f"  属性が Unknown のカード: {len(unknown_ids)} 件 ({', '.join(str(card_id) for card_id in unknown_ids[:20])}{' ...' if len(unknown_ids) > 20 else ''})")
+
 def main():
+    parser = argparse.ArgumentParser(description=f"{ATTRIBUTE_ID_MAP_FILE} (collect_attribute_card_ids.py の結果) を使って、各CSVの attribute 列を更新します。")
+    add_database_argument(parser)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    start_profile_from_args(args, 'update_csv_with_attributes')
+
     # 属性IDマップを読み込む
     try:
-        with open(ATTRIBUTE_ID_MAP_FILE, "r", encoding="utf-8") as f:
-            json_data = json.load(f)
-            attribute_id_map = {k: set(v) for k, v in json_data.items()}
+        attribute_id_map = load_attribute_id_map(ATTRIBUTE_ID_MAP_FILE)
         print(f"属性カードIDマップを '{ATTRIBUTE_ID_MAP_FILE}' から読み込みました。")
     except FileNotFoundError:
         print(f"エラー: 属性カードIDマップファイル '{ATTRIBUTE_ID_MAP_FILE}' が見つかりません。")
@@ -28,6 +119,17 @@ def main():
         print(f"エラー: 属性カードIDマップファイルの読み込みに失敗しました: {e}")
         return
 
+    # カードID → 属性 の辞書は全ファイルで共有する
+    id_to_attribute, conflicts = invert_attribute_id_map(attribute_id_map)
+    report_attribute_conflicts(conflicts)
+
+    database = open_database_from_args(args)
+    if database is not None:
+        with database:
+            update_database_attributes(database, attribute_id_map, id_to_attribute)
+        print("\n全てのレアリティの属性情報更新処理が完了しました。")
+        return
+
     for csv_filename in RARITY_CSV_FILES:
         csv_filepath = os.path.join(CSV_DIRECTORY, csv_filename)
         if not os.path.exists(csv_filepath):
@@ -36,7 +138,7 @@ def main():
 
         print(f"\n--- {csv_filename} の属性情報を更新中 ---")
         try:
-            df = pd.read_csv(csv_filepath)
+            df = read_csv(csv_filepath)
         except Exception as e:
             print(f"  エラー: CSVファイルの読み込みに失敗 ({csv_filepath}): {e}")
             continue
@@ -45,53 +147,11 @@ def main():
             print(f"  エラー: CSVファイルに 'id' 列が見つかりません: {csv_filename}。スキップします。")
             continue
 
-        if 'attribute' not in df.columns:
-            # dtypeを指定して 'object' にするか、後で pd.NA を使うならそのままでも良い
-            df['attribute'] = pd.NA 
-        else:
-            # 既存の 'attribute' 列が数値型などになっていると pd.NA との比較で問題が起きうるので、
-            # object型に変換しておくか、pd.NAを許容するStringDtypeなどに変換する。
-            # ここでは、単純に pd.NA が入ることを許容する前提で進める。
-            # もし既存列が 0 や空文字で埋まっているなら、それを pd.NA に置換する処理も検討。
-            # 例: df['attribute'] = df['attribute'].replace('', pd.NA).replace(0, pd.NA)
-            pass
-
-        
-        attributes_assigned_count = 0
-        for index, row in df.iterrows():
-            card_id = str(row['id']) 
-            newly_assigned_attr = pd.NA 
-            current_attr_in_df = df.loc[index, 'attribute'] 
-
-            for attr_label, id_set in attribute_id_map.items():
-                if card_id in id_set:
-                    newly_assigned_attr = attr_label
-                    break 
-            
-            update_needed = False
-            if pd.notna(newly_assigned_attr): # 新しい属性が見つかった
-                if pd.isna(current_attr_in_df) or current_attr_in_df != newly_assigned_attr:
-                    df.loc[index, 'attribute'] = newly_assigned_attr
-                    attributes_assigned_count += 1
-                    update_needed = True
-            elif pd.isna(newly_assigned_attr): # 新しい属性が見つからなかった
-                # 現在がNAか"Unknown"でなければ、"Unknown"に設定する。
-                # (つまり、以前Cu/Co/Paだったものが、今回見つからなかった場合も"Unknown"になる)
-                # ポリシー: 属性情報が取得できない場合は"Unknown"にする
-                if pd.isna(current_attr_in_df) or current_attr_in_df != "Unknown":
-                    # ただし、既に具体的な属性(Cu/Co/Pa)が入っていて、今回見つからなかった場合はログを出しても良い
-                    if pd.notna(current_attr_in_df) and current_attr_in_df not in ["Unknown", pd.NA]:
-                         print(f"  Warning: ID {card_id} ({row.get('name', '')}) は以前属性 ({current_attr_in_df}) でしたが、今回属性が見つかりませんでした。'Unknown'に設定します。")
-                    df.loc[index, 'attribute'] = "Unknown"
-                    # attributes_assigned_count は具体的な属性が割り当てられた時だけカウントするなら、ここでは加算しない
-                    if not update_needed and (pd.isna(current_attr_in_df) or current_attr_in_df != "Unknown"):
-                        # "Unknown"への変更もカウントする場合
-                        # attributes_assigned_count += 1 
-                        pass
-
+        with profiling.stage('assign_attributes'):
+            attributes_assigned_count = assign_attributes(df, attribute_id_map, id_to_attribute)
 
         try:
-            df.to_csv(csv_filepath, index=False, encoding='utf-8-sig')
+            write_csv_atomic(df, csv_filepath)
             print(f"  {csv_filename} を更新しました。{attributes_assigned_count} 件のカードに具体的な属性を新規/更新割り当てしました。")
         except Exception as e:
             print(f"  CSVファイルへの書き込みエラー ({csv_filepath}): {e}")
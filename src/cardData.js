@@ -0,0 +1,89 @@
+// カードデータの読み込み
+// scrape/build_card_bundle.py が作る列指向のカードバンドル (data/bundle) があればそれを使い、
+// なければレアリティ別CSV (data/csv) を PapaParse で解析する。
+// どちらの場合も、CSVの1行と同じ形のオブジェクト (値は文字列, 空欄は '') の配列を返す。
+
+const BUNDLE_DIRECTORY = 'data/bundle';
+const BUNDLE_MANIFEST_FILENAME = 'cards.manifest.json';
+const BUNDLE_FORMAT_VERSION = 1;
+
+let bundlePromise = null;
+
+function dataUrl(path) {
+  const base = import.meta.env.BASE_URL.endsWith('/') ? import.meta.env.BASE_URL : `${import.meta.env.BASE_URL}/`;
+  let url = `${base}${path}`;
+  if (url.startsWith('//')) url = url.substring(1);
+  return url;
+}
+
+async function fetchBundle() {
+  // マニフェストはファイル名が固定なので毎回サーバーに確かめる
+  // (バンドル本体はファイル名に内容のハッシュを含むため、キャッシュをそのまま使える)
+  const manifestResponse = await fetch(dataUrl(`${BUNDLE_DIRECTORY}/${BUNDLE_MANIFEST_FILENAME}`), { cache: 'no-cache' });
+  if (!manifestResponse.ok) return null;
+  const manifest = await manifestResponse.json();
+  if (manifest.version !== BUNDLE_FORMAT_VERSION) return null;
+  const response = await fetch(dataUrl(`${BUNDLE_DIRECTORY}/${manifest.file}`));
+  if (!response.ok) return null;
+  const bundle = await response.json();
+  return bundle.version === BUNDLE_FORMAT_VERSION ? bundle : null;
+}
+
+// バンドルは全レアリティ分で1ファイルなので、1回だけ取得して使い回す
+export function loadCardBundle() {
+  if (!bundlePromise) {
+    bundlePromise = fetchBundle().catch((error) => {
+      console.warn('[CardData] カードバンドルを読み込めないため、CSVを使います:', error);
+      return null;
+    });
+  }
+  return bundlePromise;
+}
+
+// バンドルの1レアリティ分 (folder は N / R / SR / SSR) を行オブジェクトの配列に戻す。該当がなければ null
+export function decodeBundleRows(bundle, folder) {
+  const entry = Object.values(bundle.rarities).find(rarity => rarity.folder === folder);
+  if (!entry) return null;
+  const columnEntries = Object.entries(entry.columns);
+  const templateEntries = Object.entries(bundle.templates || {});
+  const rows = [];
+  for (let i = 0; i < entry.count; i++) {
+    const row = {};
+    for (const [column, values] of columnEntries) {
+      let value = values[i];
+      if (value === null || value === undefined) {
+        row[column] = '';
+        continue;
+      }
+      if (bundle.codes[column]) value = bundle.codes[column][value];
+      else if (bundle.prefixes[column]) value = bundle.prefixes[column] + value;
+      row[column] = String(value);
+    }
+    for (const [column, template] of templateEntries) {
+      row[column] = template.replaceAll('{id}', row.id);
+    }
+    rows.push(row);
+  }
+  return rows;
+}
+
+async function loadCsvRows(csvFilename) {
+  const response = await fetch(dataUrl(`data/csv/${csvFilename}`));
+  if (!response.ok) return [];
+  const csvText = await response.text();
+  // PapaParse はバンドルがない場合だけ読み込む
+  const { default: Papa } = await import('papaparse');
+  const results = await new Promise((resolve, reject) => {
+    Papa.parse(csvText, { header: true, skipEmptyLines: true, complete: resolve, error: reject });
+  });
+  if (results.errors && results.errors.length > 0) console.warn(`[CardData] PapaParse errors for ${csvFilename}:`, results.errors);
+  return results.data;
+}
+
+// 1レアリティ分のカードの行を読み込む (folder: N / R / SR / SSR, csvFilename: バンドルがない場合に読むCSV)
+export async function loadCardRows(folder, csvFilename) {
+  const bundle = await loadCardBundle();
+  const rows = bundle && decodeBundleRows(bundle, folder);
+  if (rows) return rows;
+  return loadCsvRows(csvFilename);
+}